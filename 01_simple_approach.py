@@ -1,7 +1,12 @@
 import os
+from typing import Optional
+
 from dotenv import load_dotenv
 
-from src.riot_api import RiotApiHelper
+from src.cli import create_data_handler
+from src.cohort_percentiles import CohortPercentiles, load_cohort
+from src.instrumentation import metrics, run_instrumented
+from src.match_summary import MatchSummary
 from src.summoner_data_handler import SummonerDataHandler
 
 
@@ -11,19 +16,30 @@ def calculate_cs_per_minute(cs: int, game_duration: int):
 
 
 # Function to analyze CS data and provide recommendations
-def analyze_cs(match_data: dict, player_index: int):
-    participant_data = match_data["info"]["participants"][player_index]
+@metrics.timed('analyze_cs')
+def analyze_cs(match_summary: MatchSummary, player_index: int, cohort: Optional[CohortPercentiles] = None):
+    participant_data = match_summary.player(player_index)
+    position = participant_data.individual_position
 
-    total_cs = participant_data["totalMinionsKilled"]
-    neutral_cs = participant_data["neutralMinionsKilled"]
-    game_duration = match_data["info"]["gameDuration"] / 60
+    total_cs = participant_data.total_minions_killed
+    neutral_cs = participant_data.neutral_minions_killed
+    game_duration = match_summary.game_duration / 60
 
     cs_per_minute = calculate_cs_per_minute(total_cs + neutral_cs, game_duration)
 
-    if cs_per_minute >= 7.0:
+    # With a cohort the bar is the median of everyone who played the same position, otherwise a fixed 7.0
+    good_cs_per_minute = 7.0
+    if cohort is not None:
+        good_cs_per_minute = cohort.quantile("cs_per_minute", 0.5, position=position) or good_cs_per_minute
+
+    if cs_per_minute >= good_cs_per_minute:
         recommendation = "Your CS per minute is good. Keep up the good work!"
     else:
         recommendation = "Your CS per minute could be improved. Focus on last-hitting minions more consistently."
+    if cohort is not None:
+        percentile = cohort.percentile("cs_per_minute", cs_per_minute, position=position)
+        if percentile is not None:
+            recommendation += f" (p{percentile:.0f} for {position})"
 
     gold_per_cs = 21
 
@@ -36,17 +52,12 @@ def analyze_cs(match_data: dict, player_index: int):
     return cs_per_minute, recommendation, potential
 
 
-def main():
-    load_dotenv()
-    api_key = os.getenv("API_KEY")
-    summoner_name = os.getenv("SUMMONER_NAME")
-
-    riot_api_helper = RiotApiHelper(api_key)
-    data_handler = SummonerDataHandler(riot_api_helper)
-
-    for current_match_data in data_handler.iterator_on_match_data(summoner_name):
-        player_index = data_handler.find_player_index_in_data(current_match_data, summoner_name)
-        cs_per_minute, recommendation, potential = analyze_cs(current_match_data, player_index)
+def run(data_handler: SummonerDataHandler, summoner_name: str, **filters):
+    # filters select the matches to analyze, see MatchManifest.entries
+    cohort = load_cohort()
+    for match_summary in data_handler.iterator_on_summaries(summoner_name, **filters):
+        player_index = data_handler.find_player_index_in_summary(match_summary, summoner_name)
+        cs_per_minute, recommendation, potential = analyze_cs(match_summary, player_index, cohort)
         print(f'------------------------')
         print(f'Creep score: {cs_per_minute}')
         print(recommendation)
@@ -55,5 +66,11 @@ def main():
             print(f'{key} cs/m: {value:.0f} diff')
 
 
+def main():
+    load_dotenv()
+    summoner_name = os.getenv("SUMMONER_NAME")
+    run(create_data_handler(summoner_name), summoner_name)
+
+
 if __name__ == '__main__':
-    main()
+    run_instrumented(main)
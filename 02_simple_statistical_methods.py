@@ -2,74 +2,94 @@ import os
 
 from dotenv import load_dotenv
 import numpy as np
-from scipy import stats
 import matplotlib.pyplot as plt
 
-from src.riot_api import RiotApiHelper
+from src.career_zscore import career_zscores, split_by_match
+from src.cli import create_data_handler
+from src.instrumentation import metrics, run_instrumented
+from src.plot_rendering import CS_TIMELINE, draw_cs_timeline, render_charts
 from src.summoner_data_handler import SummonerDataHandler
 
 
+@metrics.timed('analyze_cs')
 def analyze_cs(match_data_timeline: dict, player_index: int):
+    # scipy takes longer to import than the whole zscore command needs, and only this per match variant uses it
+    from scipy import stats
+
     participant_frames: dict = match_data_timeline["info"]["frames"]
     minions_killed_by_player = [x["participantFrames"][str(player_index)]["minionsKilled"] for x in participant_frames]
     # Calculate Z-Score for CS per minute
     cs_per_minute_array = np.array(minions_killed_by_player)
     z_scores = stats.zscore(cs_per_minute_array)
+    anomalies, recommendation = find_anomalies(z_scores)
+
+    return cs_per_minute_array, anomalies, recommendation
+
+
+def find_anomalies(z_scores: np.ndarray):
     anomalies = np.where(np.abs(z_scores) < 0.2)
     if len(anomalies[0]) > 0:
         recommendation = "Anomalies detected in CS per minute. Review your gameplay for potential mistakes."
     else:
         recommendation = "No significant anomalies detected in CS per minute. Keep practicing!"
 
-    return cs_per_minute_array, anomalies, recommendation
-
-
-def main():
-    load_dotenv()
-    api_key = os.getenv("API_KEY")
-    summoner_name = os.getenv("SUMMONER_NAME")
+    return anomalies, recommendation
 
-    riot_api_helper = RiotApiHelper(api_key)
-    data_handler = SummonerDataHandler(riot_api_helper)
 
-    for current_match_data in data_handler.iterator_on_data(summoner_name):
+def run(data_handler: SummonerDataHandler, summoner_name: str, **filters):
+    # filters select the matches to analyze, see MatchManifest.entries
+    # Collect the CS series of every match first, then score the whole history in one vectorized pass
+    cs_by_match = {}
+    game_durations = {}
+    for current_match_data in data_handler.iterator_on_data(summoner_name, **filters):
         player_index = data_handler.find_player_index_in_data(current_match_data["timeline"], summoner_name)
         player_id = player_index + 1
-        game_duration = current_match_data["match"]["info"]["gameDuration"] / 60
-        cs_per_minute_array, anomalies, recommendation = analyze_cs(current_match_data["timeline"], player_id)
-
-        # Plot CS data along with anomalies
-        timestamps = np.arange(0, game_duration + 1, 1)  # Assuming intervals of 1 minute
-        zero = 0 * timestamps
-        range_9_10 = (9 * timestamps, 10 * timestamps)
-        range_7_9 = (7 * timestamps, 9 * timestamps)
-        max_cs_per_minute = 12.6 * timestamps
+        match_id = current_match_data["match"]["metadata"]["matchId"]
+        frames = current_match_data["timeline"]["info"]["frames"]
+        cs_by_match[match_id] = np.array([x["participantFrames"][str(player_id)]["minionsKilled"] for x in frames])
+        game_durations[match_id] = current_match_data["match"]["info"]["gameDuration"] / 60
+
+    # With PLOT_OUTPUT_DIR set the charts are written to files in the background instead of being shown
+    plot_output_dir = os.getenv("PLOT_OUTPUT_DIR")
+    charts = []
+
+    with metrics.timer('zscore'):
+        history = career_zscores(cs_by_match)
+    match_z_scores = split_by_match(history, 'match_z')
+    career_z_scores = split_by_match(history, 'career_z')
+
+    for match_id, cs_per_minute_array in cs_by_match.items():
+        if len(cs_per_minute_array) == 0:
+            print(f'Skipping match {match_id}, its timeline has no frames')
+            continue
+        game_duration = game_durations[match_id]
+        anomalies, recommendation = find_anomalies(match_z_scores[match_id])
+        below_career = np.where(career_z_scores[match_id] < -1)[0]
 
         print(f'------------------------')
+        print(match_id)
         print(recommendation)
         print(f'Anomaly minutes: {list(anomalies)}')
+        print(f'Minutes well below your usual CS: {below_career.tolist()}')
 
-        plt.plot(timestamps, cs_per_minute_array, marker='x', label='CS per minute')
-        plt.scatter(anomalies[0], cs_per_minute_array[anomalies[0]], color='red', marker='o', label='Anomalies')
-        # Plot horizontal lines for different CS per minute ranges
-        plt.plot(timestamps, max_cs_per_minute, color='gray', linestyle='--', label='Max CS per minute (12.6)')
+        # Plot CS data along with anomalies
+        chart_data = {'cs_per_minute_array': cs_per_minute_array, 'anomaly_minutes': anomalies[0],
+                      'game_duration': game_duration}
+        if plot_output_dir:
+            charts.append((match_id, chart_data))
+        else:
+            draw_cs_timeline(plt.figure(), **chart_data)
+            plt.show()
 
-        plt.fill_between(timestamps, zero, range_9_10[0], color='red', alpha=0.3,
-                         label='CS per minute (7-) BAD')
-        plt.fill_between(timestamps, range_7_9[0], range_7_9[1], color='yellow', alpha=0.3,
-                         label='CS per minute (7-9) OKAY')
-        plt.fill_between(timestamps, range_9_10[0], range_9_10[1], color='blue', alpha=0.3,
-                         label='CS per minute (9-10) GOOD')
-        plt.fill_between(timestamps, range_9_10[1], max_cs_per_minute, color='green', alpha=0.3,
-                         label='CS per minute (10+) EXCELLENT')
+    if plot_output_dir:
+        render_charts(CS_TIMELINE, {summoner_name: charts}, plot_output_dir, os.getenv("PLOT_FORMAT", "png"))
 
-        plt.xlabel('Time (minutes)')
-        plt.ylabel('CS per minute')
-        plt.title('CS per Minute and Anomalies Timeline')
-        plt.legend()
-        plt.grid(True)
-        plt.show()
+
+def main():
+    load_dotenv()
+    summoner_name = os.getenv("SUMMONER_NAME")
+    run(create_data_handler(summoner_name), summoner_name)
 
 
 if __name__ == '__main__':
-    main()
+    run_instrumented(main)
@@ -1,175 +1,115 @@
 import os
+from typing import Optional
 
 from dotenv import load_dotenv
 import numpy as np
 
 from sklearn.ensemble import IsolationForest
 import pandas as pd
-from src.riot_api import RiotApiHelper
+from src.batch_runner import analyze_summoners
+from src.cli import create_data_handler
+from src.instrumentation import metrics, run_instrumented
+from src.plot_rendering import FEATURE_ANOMALIES, draw_feature_anomalies, render_charts
 from src.summoner_data_handler import SummonerDataHandler
+from src.timeline_features import participant_series
 import matplotlib.pyplot as plt
 
 
+@metrics.timed('analyze_cs')
 def analyze_cs(match_data_timeline: dict, player_index: int):
-    participant_frames: dict = match_data_timeline["info"]["frames"]
-    minions_killed_by_player = [x["participantFrames"][str(player_index)]["minionsKilled"] for x in participant_frames]
-    gold_gained_by_player = [x["participantFrames"][str(player_index)]["totalGold"] for x in participant_frames]
-    kills_by_player = []
-    assists_by_player = []
-    deaths_by_player = []
-    damage_done_by_player = []
-    damage_received_by_player = []
-    sum_kills = 0
-    sum_assists = 0
-    sum_deaths = 0
-    sum_damage_done = 0
-    sum_damage_received = 0
-    for frame in participant_frames:
-        current_frame_kills = 0
-        current_frame_assists = 0
-        current_frame_deaths = 0
-        current_damage_done = 0
-        current_damage_received = 0
-        for event in frame["events"]:
-            if event["type"] == 'CHAMPION_KILL':
-                if event["victimId"] == player_index:
-                    current_frame_deaths += 1
-                if event["killerId"] == player_index:
-                    current_frame_kills += 1
-                if "assistingParticipantIds" in event and player_index in event["assistingParticipantIds"]:
-                    current_frame_assists += 1
-                if 'victimDamageDealt' in event and (
-                        event["killerId"] == player_index or "assistingParticipantIds" in event and player_index in
-                        event["assistingParticipantIds"]):
-                    for damage_event in event['victimDamageDealt']:
-                        if damage_event['participantId'] != player_index:
-                            continue
-                        all_damage = damage_event['magicDamage'] + damage_event['physicalDamage'] + damage_event[
-                            'trueDamage']
-                        current_damage_done += all_damage
-                if 'victimDamageReceived' in event and (
-                        event["victimId"] == player_index):
-                    for damage_event in event['victimDamageReceived']:
-                        all_damage_received = damage_event['magicDamage'] + damage_event['physicalDamage'] + \
-                                              damage_event[
-                                                  'trueDamage']
-                        current_damage_received += all_damage_received
-        sum_kills += current_frame_kills
-        kills_by_player.append(sum_kills)
-        sum_assists += current_frame_assists
-        assists_by_player.append(sum_assists)
-        sum_deaths += current_frame_deaths
-        deaths_by_player.append(sum_deaths)
-        sum_damage_done += current_damage_done
-        damage_done_by_player.append(sum_damage_done)
-        sum_damage_received += current_damage_received
-        damage_received_by_player.append(sum_damage_received)
-
-    return np.array(minions_killed_by_player), np.array(gold_gained_by_player), np.array(kills_by_player), np.array(
-        assists_by_player), np.array(deaths_by_player), np.array(damage_done_by_player), np.array(
-        damage_received_by_player)
+    # Cumulative CS, gold, kills, assists, deaths, damage done and damage received of the player for every frame
+    return participant_series(match_data_timeline, player_index,
+                              ('cs', 'gold', 'kills', 'assists', 'deaths', 'damage_done', 'damage_received'))
 
 
-def main():
-    load_dotenv()
-    api_key = os.getenv("API_KEY")
-    summoner_name = os.getenv("SUMMONER_NAME")
-
-    riot_api_helper = RiotApiHelper(api_key)
-    data_handler = SummonerDataHandler(riot_api_helper)
+def analyze_match(summoner_name: str, match_id: str, current_match_data: dict, player_index: int) -> dict:
+    # Chart data of one match. Module level, so analyze_summoners can run it in worker processes.
+    player_id = player_index + 1
+    game_duration = current_match_data["match"]["info"]["gameDuration"] / 60
 
-    for current_match_data in data_handler.iterator_on_data(summoner_name):
-        player_index = data_handler.find_player_index_in_data(current_match_data["timeline"], summoner_name)
-        player_id = player_index + 1
-        game_duration = current_match_data["match"]["info"]["gameDuration"] / 60
-
-        cs, gold, kills, assists, deaths, damage_done, damage_received = analyze_cs(
-            current_match_data["timeline"],
-            player_id)
+    cs, gold, kills, assists, deaths, damage_done, damage_received = analyze_cs(
+        current_match_data["timeline"],
+        player_id)
 
-        minutes = np.arange(0, game_duration , 1)  # Assuming intervals of 1 minute
+    minutes = np.arange(0, game_duration , 1)  # Assuming intervals of 1 minute
 
-        # Combine the arrays into a single feature matrix
-        feature_matrix = np.column_stack((np.diff(cs), np.diff(gold), np.diff(kills), np.diff(assists), np.diff(deaths),
-                                          np.diff(damage_done), np.diff(damage_received)))
-        # Create an Isolation Forest model
-        model = IsolationForest(n_estimators=100, max_samples='auto',
-                                contamination=0.05)  # Adjust the contamination parameter as needed
+    # Combine the arrays into a single feature matrix
+    feature_matrix = np.column_stack((np.diff(cs), np.diff(gold), np.diff(kills), np.diff(assists), np.diff(deaths),
+                                      np.diff(damage_done), np.diff(damage_received)))
+    # Create an Isolation Forest model
+    model = IsolationForest(n_estimators=100, max_samples='auto',
+                            contamination=0.05)  # Adjust the contamination parameter as needed
 
-        # Fit the model on your data
+    # Fit the model on your data
+    with metrics.timer('model_fit'):
         model.fit(feature_matrix)
 
-        # Predict anomalies (1 for inliers, -1 for outliers)
+    # Predict anomalies (1 for inliers, -1 for outliers)
+    with metrics.timer('model_predict'):
         anomaly_scores = model.predict(feature_matrix)
 
-        # Create a DataFrame to store the anomaly scores and the original data
-        anomalies_df = pd.DataFrame({'Anomaly Score': anomaly_scores, 'CS': np.diff(cs),
-                                     'Total gold': np.diff(gold), 'Kills': np.diff(kills), 'Assists': np.diff(assists),
-                                     'Deaths': np.diff(deaths), 'Damage done': np.diff(damage_done),
-                                     'Damage received': np.diff(damage_received),
-                                     'Minute': minutes})
-
-        # Filter out the anomalies
-        anomalies = anomalies_df[anomalies_df['Anomaly Score'] == -1]
-
-        # Find minutes where anomalies are present in all data
-        anomalies_all_data = anomalies.groupby('Minute').size() == 7  # 7 metrics have anomalies
+    # Create a DataFrame to store the anomaly scores and the original data
+    anomalies_df = pd.DataFrame({'Anomaly Score': anomaly_scores, 'CS': np.diff(cs),
+                                 'Total gold': np.diff(gold), 'Kills': np.diff(kills), 'Assists': np.diff(assists),
+                                 'Deaths': np.diff(deaths), 'Damage done': np.diff(damage_done),
+                                 'Damage received': np.diff(damage_received),
+                                 'Minute': minutes})
 
-        # Get the minutes with anomalies in all data
-        minutes_with_anomalies_all_data = anomalies_all_data[anomalies_all_data].index.tolist()
+    # Filter out the anomalies
+    anomalies = anomalies_df[anomalies_df['Anomaly Score'] == -1]
 
-        # Create subplots
-        fig, axes = plt.subplots(4, 2, figsize=(14, 12))
+    # Find minutes where anomalies are present in all data
+    anomalies_all_data = anomalies.groupby('Minute').size() == 7  # 7 metrics have anomalies
 
-        # Plot CS with anomalies
-        axes[0, 0].plot(minutes, np.diff(cs), label='CS', color='blue')
-        axes[0, 0].plot(anomalies['Minute'], anomalies['CS'], 'ro', label='Anomalies')
-        axes[0, 0].set_title('CS Over Time')
+    # Get the minutes with anomalies in all data
+    minutes_with_anomalies_all_data = anomalies_all_data[anomalies_all_data].index.tolist()
 
-        # Plot Gold with anomalies
-        axes[0, 1].plot(minutes, np.diff(gold), label='Gold', color='green')
-        axes[0, 1].plot(anomalies['Minute'], anomalies['Total gold'], 'ro', label='Anomalies')
-        axes[0, 1].set_title('Gold Over Time')
+    # Plot every metric with its anomalies
+    anomaly_rows = np.where(anomaly_scores == -1)[0]
+    return {'minutes': minutes, 'feature_matrix': feature_matrix, 'anomaly_rows': anomaly_rows}
 
-        # Plot Kills with anomalies
-        axes[1, 0].plot(minutes, np.diff(kills), label='Kills', color='purple')
-        axes[1, 0].plot(anomalies['Minute'], anomalies['Kills'], 'ro', label='Anomalies')
-        axes[1, 0].set_title('Kills Over Time')
 
-        # Plot Assists with anomalies
-        axes[1, 1].plot(minutes, np.diff(assists), label='Assists', color='orange')
-        axes[1, 1].plot(anomalies['Minute'], anomalies['Assists'], 'ro', label='Anomalies')
-        axes[1, 1].set_title('Assists Over Time')
+def run(data_handler: SummonerDataHandler, summoner_name: str, **filters):
+    # filters select the matches to analyze, see MatchManifest.entries
+    # With PLOT_OUTPUT_DIR set the charts are written to files in the background instead of being shown
+    plot_output_dir = os.getenv("PLOT_OUTPUT_DIR")
+    charts = []
 
-        # Plot Deaths with anomalies
-        axes[2, 0].plot(minutes, np.diff(deaths), label='Deaths', color='red')
-        axes[2, 0].plot(anomalies['Minute'], anomalies['Deaths'], 'ro', label='Anomalies')
-        axes[2, 0].set_title('Deaths Over Time')
-
-        # Plot Damage Done with anomalies
-        axes[2, 1].plot(minutes, np.diff(damage_done), label='Damage Done', color='cyan')
-        axes[2, 1].plot(anomalies['Minute'], anomalies['Damage done'], 'ro', label='Anomalies')
-        axes[2, 1].set_title('Damage Done Over Time')
-
-        # Plot Damage Received with anomalies
-        axes[3, 0].plot(minutes, np.diff(damage_received), label='Damage Received', color='magenta')
-        axes[3, 0].plot(anomalies['Minute'], anomalies['Damage received'], 'ro', label='Anomalies')
-        axes[3, 0].set_title('Damage Received Over Time')
-
-        # Remove empty subplot
-        fig.delaxes(axes[3, 1])
+    for current_match_data in data_handler.iterator_on_data(summoner_name, **filters):
+        player_index = data_handler.find_player_index_in_data(current_match_data["timeline"], summoner_name)
+        match_id = current_match_data['match']['metadata']['matchId']
+        chart_data = analyze_match(summoner_name, match_id, current_match_data, player_index)
+        if plot_output_dir:
+            charts.append((match_id, chart_data))
+        else:
+            draw_feature_anomalies(plt.figure(figsize=(14, 12)), **chart_data)
+            # Show the combined visualization
+            plt.show()
+
+    if plot_output_dir:
+        render_charts(FEATURE_ANOMALIES, {summoner_name: charts}, plot_output_dir, os.getenv("PLOT_FORMAT", "png"))
+
+
+def run_batch(summoner_names: list[str], max_workers: Optional[int] = None, **filters):
+    # Nightly runs over many summoners: every match is analyzed in a process pool, the charts are written to
+    # PLOT_OUTPUT_DIR (rendered in parallel too) and one line per match is printed
+    plot_output_dir = os.getenv("PLOT_OUTPUT_DIR")
+    results = analyze_summoners(analyze_match, summoner_names, os.getenv("MATCH_STORE_FORMAT", "json"),
+                                max_workers=max_workers, filters=filters)
+    charts = {}
+    for summoner_name, match_id, chart_data in results:
+        print(f"{summoner_name:<20} {match_id:<16} anomaly minutes: {chart_data['anomaly_rows'].tolist()}")
+        charts.setdefault(summoner_name, []).append((match_id, chart_data))
+    if plot_output_dir:
+        render_charts(FEATURE_ANOMALIES, charts, plot_output_dir, os.getenv("PLOT_FORMAT", "png"),
+                      max_workers=max_workers)
 
-        # Set common labels
-        for ax in axes.flat:
-            ax.set_xlabel('Minute')
-            ax.set_ylabel('Value')
-            ax.legend()
 
-        # Adjust spacing between subplots
-        plt.tight_layout()
+def main():
+    load_dotenv()
+    summoner_name = os.getenv("SUMMONER_NAME")
+    run(create_data_handler(summoner_name), summoner_name)
 
-        # Show the combined visualization
-        plt.show()
 
 if __name__ == '__main__':
-    main()
+    run_instrumented(main)
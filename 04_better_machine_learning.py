@@ -2,83 +2,36 @@ import os
 
 import numpy as np
 from dotenv import load_dotenv
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score
-from sklearn.model_selection import train_test_split
 
-from src.riot_api import RiotApiHelper
+from src.cli import create_data_handler
+from src.feature_store import FeatureStore
+from src.instrumentation import metrics, run_instrumented
 from src.summoner_data_handler import SummonerDataHandler
+from src.timeline_features import participant_series
+from src.weak_minute_model import WeakMinuteModel
 
 
+@metrics.timed('analyze_cs')
 def analyze_cs(match_data_timeline: dict, player_index: int):
-    participant_frames: dict = match_data_timeline["info"]["frames"]
-    minions_killed_by_player = [x["participantFrames"][str(player_index)]["minionsKilled"] for x in participant_frames]
-    gold_gained_by_player = [x["participantFrames"][str(player_index)]["totalGold"] for x in participant_frames]
-    kills_by_player = []
-    assists_by_player = []
-    deaths_by_player = []
-    damage_done_by_player = []
-    damage_received_by_player = []
-    sum_kills = 0
-    sum_assists = 0
-    sum_deaths = 0
-    sum_damage_done = 0
-    sum_damage_received = 0
-    for frame in participant_frames:
-        current_frame_kills = 0
-        current_frame_assists = 0
-        current_frame_deaths = 0
-        current_damage_done = 0
-        current_damage_received = 0
-        for event in frame["events"]:
-            if event["type"] == 'CHAMPION_KILL':
-                if event["victimId"] == player_index:
-                    current_frame_deaths += 1
-                if event["killerId"] == player_index:
-                    current_frame_kills += 1
-                if "assistingParticipantIds" in event and player_index in event["assistingParticipantIds"]:
-                    current_frame_assists += 1
-                if 'victimDamageDealt' in event and (
-                        event["killerId"] == player_index or ("assistingParticipantIds" in event and player_index in
-                        event["assistingParticipantIds"])):
-                    for damage_event in event['victimDamageDealt']:
-                        if damage_event['participantId'] != player_index:
-                            continue
-                        all_damage = damage_event['magicDamage'] + damage_event['physicalDamage'] + damage_event[
-                            'trueDamage']
-                        current_damage_done += all_damage
-                if 'victimDamageReceived' in event and (
-                        event["victimId"] == player_index):
-                    for damage_event in event['victimDamageReceived']:
-                        all_damage_received = damage_event['magicDamage'] + damage_event['physicalDamage'] + \
-                                              damage_event[
-                                                  'trueDamage']
-                        current_damage_received += all_damage_received
-        sum_kills += current_frame_kills
-        kills_by_player.append(sum_kills)
-        sum_assists += current_frame_assists
-        assists_by_player.append(sum_assists)
-        sum_deaths += current_frame_deaths
-        deaths_by_player.append(sum_deaths)
-        sum_damage_done += current_damage_done
-        damage_done_by_player.append(sum_damage_done)
-        sum_damage_received += current_damage_received
-        damage_received_by_player.append(sum_damage_received)
-
-    return np.array(minions_killed_by_player), np.array(gold_gained_by_player), np.array(kills_by_player), np.array(
-        assists_by_player), np.array(deaths_by_player), np.array(damage_done_by_player), np.array(
-        damage_received_by_player)
-
-
-def main():
-    load_dotenv()
-    api_key = os.getenv("API_KEY")
-    summoner_name = os.getenv("SUMMONER_NAME")
-
-    riot_api_helper = RiotApiHelper(api_key)
-    data_handler = SummonerDataHandler(riot_api_helper)
-
-    for current_match_data in data_handler.iterator_on_data(summoner_name):
+    # Cumulative CS, gold, kills, assists, deaths, damage done and damage received of the player for every frame
+    return participant_series(match_data_timeline, player_index,
+                              ('cs', 'gold', 'kills', 'assists', 'deaths', 'damage_done', 'damage_received'))
+
+
+def run(data_handler: SummonerDataHandler, summoner_name: str, **filters):
+    # filters select the matches to analyze, see MatchManifest.entries
+    # Make sure the matches are downloaded, then train (or load) one model on every minute of every stored match
+    if not os.path.exists(summoner_name):
+        data_handler.save_match_data_for_summoner(summoner_name, summoner_name)
+    feature_store = FeatureStore(os.getenv("FEATURE_STORE_DIR", ".feature_store"))
+    feature_store.update_from_directory(summoner_name)
+    model = WeakMinuteModel.load_or_train(os.getenv("WEAK_MINUTE_MODEL_PATH", "weak_minute_model.pkl"), feature_store)
+    # The model is fitted on every stored match, so it is only scored on the matches it had not seen yet
+    if model.held_out_accuracy is not None:
+        accuracy, held_out_matches = model.held_out_accuracy
+        print(f"Model Accuracy on {held_out_matches} new matches, before fitting them: {accuracy:.2f}")
+
+    for current_match_data in data_handler.iterator_on_data(summoner_name, **filters):
         player_index = data_handler.find_player_index_in_data(current_match_data["timeline"], summoner_name)
         player_id = player_index + 1
         print(current_match_data['match']['info']['gameId'])
@@ -95,28 +48,8 @@ def main():
         feature_matrix = np.column_stack((cs_diff, gold_diff, kills_diff, assists_diff, deaths_diff, damage_done_diff,
                                          damage_received_diff))
 
-        # Define criteria for labeling weak points (you can customize these criteria)
-        low_cs_threshold = 7
-        high_deaths_threshold = 2
-
-        # Create labels for weak and strong minutes based on criteria
-        labels = ["weak" if (cs_diff[i] < low_cs_threshold) or (deaths_diff[i] > high_deaths_threshold) else "strong"
-                  for i in
-                  range(len(cs_diff))]
-
-        # Split data into training and testing sets
-        X_train, X_test, y_train, y_test = train_test_split(feature_matrix, labels, test_size=0.2, random_state=42)
-
-        # Train a Random Forest classifier (you can use other classifiers as well)
-        classifier = RandomForestClassifier(n_estimators=100, random_state=42)
-        classifier.fit(X_train, y_train)
-
-        # Predict weak points using the trained model
-        predictions = classifier.predict(X_test)
-
-        # Calculate accuracy on the test set (optional)
-        accuracy = accuracy_score(y_test, predictions)
-        print(f"Model Accuracy: {accuracy:.2f}")
+        # Predict weak points with the model trained on the whole corpus, no refit per match
+        predictions = model.predict(feature_matrix)
 
         # Highlight weak minutes based on model predictions
         weak_minutes = [i for i, prediction in enumerate(predictions) if prediction == "weak" and i > 2]
@@ -176,5 +109,11 @@ def main():
             print("\n")
 
 
+def main():
+    load_dotenv()
+    summoner_name = os.getenv("SUMMONER_NAME")
+    run(create_data_handler(summoner_name), summoner_name)
+
+
 if __name__ == '__main__':
-    main()
+    run_instrumented(main)
@@ -0,0 +1,199 @@
+import argparse
+import functools
+import importlib
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import numpy as np
+
+from benchmarks.synthetic_corpus import generate_corpus
+from src.career_zscore import career_zscores, split_by_match
+from src.feature_store import FeatureStore
+from src.match_store import TIMELINE, find_match_file, get_match_store
+from src.plot_rendering import FEATURE_ANOMALIES, render_charts
+from src.summoner_data_handler import SummonerDataHandler
+from src.timeline_features import extract_participant_features
+from src.weak_minute_model import WeakMinuteModel
+
+
+def _script(name: str):
+    # The numbered scripts are not valid module names for an import statement, but importlib can load them
+    return importlib.import_module(name)
+
+
+def stage_directory_load(data_handler: SummonerDataHandler, summoner_name: str, matches: list,
+                         feature_store: FeatureStore):
+    for _ in data_handler.iterator_on_data(summoner_name):
+        pass
+
+
+def stage_feature_extraction(data_handler: SummonerDataHandler, summoner_name: str, matches: list,
+                             feature_store: FeatureStore):
+    for data, _ in matches:
+        extract_participant_features(data['timeline'])
+
+
+def stage_zscore(data_handler: SummonerDataHandler, summoner_name: str, matches: list,
+                 feature_store: FeatureStore):
+    # What the zscore command does: the CS series of every match, scored in one pass against the match and the career
+    cs_by_match = {}
+    for data, player_index in matches:
+        frames = data['timeline']['info']['frames']
+        cs_by_match[data['match']['metadata']['matchId']] = np.array(
+            [frame['participantFrames'][str(player_index + 1)]['minionsKilled'] for frame in frames])
+    history = career_zscores(cs_by_match)
+    split_by_match(history, 'match_z')
+    split_by_match(history, 'career_z')
+
+
+def stage_isolation_forest(data_handler: SummonerDataHandler, summoner_name: str, matches: list,
+                           feature_store: FeatureStore):
+    from sklearn.ensemble import IsolationForest
+
+    machine_learning = _script('03_simple_machine_learning')
+    for data, player_index in matches:
+        series = machine_learning.analyze_cs(data['timeline'], player_index + 1)
+        feature_matrix = np.column_stack([np.diff(values) for values in series])
+        IsolationForest(n_estimators=100, contamination=0.05).fit(feature_matrix).predict(feature_matrix)
+
+
+def stage_random_forest(data_handler: SummonerDataHandler, summoner_name: str, matches: list,
+                        feature_store: FeatureStore):
+    # One model for the whole sample like 04 trains it: fitted on the first half of the feature store, then the
+    # second half is folded in by WeakMinuteModel.update the way a sync brings in new matches
+    match_ids = feature_store.match_ids()
+    model = WeakMinuteModel()
+    model.train(feature_store, match_ids[:max(len(match_ids) // 2, 1)])
+    model.update(feature_store)
+
+
+def stage_plot_rendering(data_handler: SummonerDataHandler, summoner_name: str, matches: list,
+                         feature_store: FeatureStore, file_format: str = 'png'):
+    # The anomalies chart through the renderer the analyses use, Agg figures spread over the worker processes. The
+    # death minutes stand in for the anomaly rows so no forest is fitted here.
+    charts = []
+    for data, player_index in matches:
+        series = _script('03_simple_machine_learning').analyze_cs(data['timeline'], player_index + 1)
+        feature_matrix = np.column_stack([np.diff(values) for values in series])
+        charts.append((data['match']['metadata']['matchId'], {
+            'minutes': np.arange(len(feature_matrix)),
+            'feature_matrix': feature_matrix,
+            'anomaly_rows': np.flatnonzero(feature_matrix[:, 4] > 0),
+        }))
+    with tempfile.TemporaryDirectory() as output_dir:
+        render_charts(FEATURE_ANOMALIES, {summoner_name: charts}, output_dir, file_format)
+
+
+STAGES = {
+    'directory_load': stage_directory_load,
+    'feature_extraction': stage_feature_extraction,
+    'zscore': stage_zscore,
+    'isolation_forest': stage_isolation_forest,
+    'random_forest': stage_random_forest,
+    'plot_rendering': stage_plot_rendering,
+    'plot_rendering_pdf': functools.partial(stage_plot_rendering, file_format='pdf'),
+}
+
+
+def measure(stage, *args, trace_memory: bool) -> tuple[float, float]:
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    stage(*args)
+    seconds = time.perf_counter() - start
+    peak_mb = 0.0
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    return seconds, peak_mb
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(sizes: list[int], stages: list[str], corpus_root: str, store_name: str, sample_size: int,
+        trace_memory: bool) -> dict:
+    # Import the scripts and their heavy dependencies up front, import time is not what we measure
+    _script('03_simple_machine_learning')
+
+    results = []
+    for size in sizes:
+        summoner_name = os.path.join(corpus_root, f'synthetic_{size}')
+        generate_corpus(summoner_name, size, get_match_store(store_name))
+
+        data_handler = SummonerDataHandler(None, get_match_store(store_name), cache_max_entries=sample_size)
+        matches = []
+        timeline_paths = {}
+        for match_id in data_handler.list_match_ids(summoner_name)[:sample_size]:
+            data = data_handler.load_match(summoner_name, match_id)
+            matches.append((data, data_handler.find_player_index_in_data(data['timeline'], summoner_name)))
+            timeline_paths[match_id] = find_match_file(summoner_name, match_id, TIMELINE)[0]
+        # The model stage trains from a feature store of the sample, its extraction is not part of the timing
+        feature_store_dir = tempfile.TemporaryDirectory()
+        feature_store = FeatureStore(feature_store_dir.name)
+        feature_store.update(timeline_paths)
+
+        for stage_name in stages:
+            # Only the directory load walks the whole corpus, the per-match stages run on the sample
+            num_matches = size if stage_name == 'directory_load' else len(matches)
+            # A fresh handler each time, so the directory load never hits a warm cache
+            stage_data_handler = SummonerDataHandler(None, get_match_store(store_name), cache_max_entries=1)
+            seconds, peak_mb = measure(STAGES[stage_name], stage_data_handler, summoner_name, matches,
+                                       feature_store, trace_memory=trace_memory)
+            result = {
+                'corpus_size': size,
+                'stage': stage_name,
+                'matches': num_matches,
+                'seconds': seconds,
+                'ms_per_match': seconds * 1000 / max(num_matches, 1),
+                'peak_memory_mb': peak_mb,
+            }
+            print(f"{size:>6} {stage_name:<20} {seconds:8.3f}s {result['ms_per_match']:9.2f} ms/match "
+                  f"{peak_mb:8.1f} MB")
+            results.append(result)
+        feature_store_dir.cleanup()
+
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'store': store_name,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the analysis pipeline on synthetic corpora')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000],
+                        help='Corpus sizes to benchmark, eg. 10 1000 10000')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--corpus-root', default=os.path.join('benchmarks', 'corpora'),
+                        help='Generated corpora are kept here and reused between runs')
+    parser.add_argument('--store', default='gzip', help='Match store format of the generated corpora')
+    parser.add_argument('--sample-size', type=int, default=50,
+                        help='Number of matches the per-match stages run on')
+    parser.add_argument('--trace-memory', action='store_true', help='Record peak memory with tracemalloc (slower)')
+    parser.add_argument('--output', default='bench_output.json', help='Where to write the JSON results')
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.stages, args.corpus_root, args.store, args.sample_size, args.trace_memory)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
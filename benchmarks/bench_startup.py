@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.bench_pipeline import git_commit
+
+# Every command is run as a fresh process, the way cron and the job runners start it
+COMMANDS = {
+    'python': [sys.executable, '-c', 'pass'],
+    'help': [sys.executable, '-m', 'src', '--help'],
+    'report': [sys.executable, '-m', 'src', 'report'],
+    'cs': [sys.executable, '-m', 'src', 'cs'],
+    'zscore': [sys.executable, '-m', 'src', 'zscore'],
+    # The standalone script of the cs command, for comparison
+    'script_01': [sys.executable, '01_simple_approach.py'],
+}
+
+
+def time_command(command: list[str], env: dict, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run(commands: list[str], summoner_name: str, repeat: int) -> dict:
+    env = dict(os.environ, SUMMONER_NAME=summoner_name, MPLBACKEND='Agg')
+    for name in ('METRICS_OUTPUT', 'PROFILE_OUTPUT', 'TRACE_MEMORY'):
+        env.pop(name, None)
+    env.setdefault('PLOT_OUTPUT_DIR', os.path.join('benchmarks', 'corpora', 'startup_plots'))
+    results = []
+    for name in commands:
+        timings = time_command(COMMANDS[name], env, repeat)
+        result = {
+            'command': name,
+            'median_ms': statistics.median(timings) * 1000,
+            'min_ms': min(timings) * 1000,
+            'max_ms': max(timings) * 1000,
+        }
+        print(f"{name:<10} {result['median_ms']:8.0f} ms median {result['min_ms']:8.0f} ms min")
+        results.append(result)
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'summoner': summoner_name,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the startup and run time of the CLI commands')
+    parser.add_argument('--commands', nargs='+', default=list(COMMANDS), choices=list(COMMANDS))
+    parser.add_argument('--summoner', default='alienteavend', help='Stored summoner directory the commands run on')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='bench_startup.json', help='Where to write the JSON results')
+    args = parser.parse_args()
+
+    report = run(args.commands, args.summoner, args.repeat)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import copy
+import json
+import os
+import random
+
+from src.helpers import atomic_write_json
+from src.match_store import MATCH, TIMELINE, MatchStore, get_match_store, list_match_ids
+
+SEED_DIR = 'alienteavend'
+
+# Per-participant frame counters that get scaled, the rest of the schema is copied from the seed as-is
+SCALED_FRAME_FIELDS = ('minionsKilled', 'jungleMinionsKilled', 'totalGold', 'currentGold', 'xp')
+
+
+def load_seeds(seed_dir: str = SEED_DIR) -> list[tuple[dict, dict]]:
+    store = get_match_store('json')
+    return [(store.load(seed_dir, match_id, MATCH), store.load(seed_dir, match_id, TIMELINE))
+            for match_id in list_match_ids(seed_dir)]
+
+
+def synthesize_match(seed: tuple[dict, dict], match_number: int, rng: random.Random) -> tuple[str, dict, dict]:
+    match_data, timeline_data = copy.deepcopy(seed)
+    platform = match_data['metadata']['matchId'].split('_')[0]
+    game_id = 9_000_000_000 + match_number
+    match_id = f'{platform}_{game_id}'
+
+    match_data['metadata']['matchId'] = match_id
+    match_data['info']['gameId'] = game_id
+    timeline_data['metadata']['matchId'] = match_id
+    timeline_data['info']['gameId'] = game_id
+
+    # Each participant gets its own skill factor, so the synthetic games differ in the features we analyze
+    factors = {str(participant_id): rng.uniform(0.7, 1.3) for participant_id in range(1, 11)}
+    for frame in timeline_data['info']['frames']:
+        for participant_id, participant_frame in frame['participantFrames'].items():
+            for field in SCALED_FRAME_FIELDS:
+                participant_frame[field] = int(participant_frame[field] * factors[participant_id])
+    for index, participant in enumerate(match_data['info']['participants']):
+        factor = factors[str(index + 1)]
+        participant['totalMinionsKilled'] = int(participant['totalMinionsKilled'] * factor)
+        participant['neutralMinionsKilled'] = int(participant['neutralMinionsKilled'] * factor)
+        participant['goldEarned'] = int(participant['goldEarned'] * factor)
+    return match_id, match_data, timeline_data
+
+
+def generate_corpus(target_dir: str, num_matches: int, store: MatchStore, seed_dir: str = SEED_DIR,
+                    random_seed: int = 42):
+    # The target directory doubles as the summoner name, like the directories the scripts download into
+    os.makedirs(target_dir, exist_ok=True)
+    summoner_name = os.path.basename(os.path.normpath(target_dir))
+    with open(os.path.join(seed_dir, f'{os.path.basename(seed_dir)}.json'), 'r', encoding='utf-8') as file:
+        summoner_data = json.load(file)
+    summoner_data['name'] = summoner_name
+    atomic_write_json(os.path.join(target_dir, f'{summoner_name}.json'), summoner_data)
+
+    rng = random.Random(random_seed)
+    seeds = load_seeds(seed_dir)
+    existing = set(list_match_ids(target_dir))
+    for match_number in range(num_matches):
+        match_id, match_data, timeline_data = synthesize_match(seeds[match_number % len(seeds)], match_number, rng)
+        if match_id in existing:
+            continue
+        store.save(target_dir, match_id, MATCH, match_data)
+        store.save(target_dir, match_id, TIMELINE, timeline_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic match corpus from the bundled matches')
+    parser.add_argument('target_dir')
+    parser.add_argument('num_matches', type=int)
+    parser.add_argument('--store', default='gzip', help='Match store format of the generated files')
+    parser.add_argument('--seed-dir', default=SEED_DIR)
+    args = parser.parse_args()
+    generate_corpus(args.target_dir, args.num_matches, get_match_store(args.store), args.seed_dir)
+
+
+if __name__ == '__main__':
+    main()
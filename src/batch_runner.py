@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from typing import Callable, Iterable, Optional
+
+from src.match_store import get_match_store
+from src.summoner_data_handler import SummonerDataHandler
+
+_worker_data_handler: Optional[SummonerDataHandler] = None
+
+
+def _run_chunk(func: Callable, chunk: list, fail_fast: bool) -> list:
+    results = []
+    for item in chunk:
+        try:
+            results.append(func(item))
+        except Exception as e:
+            if fail_fast:
+                raise
+            results.append(e)
+    return results
+
+
+def _worker_count(max_workers: Optional[int], num_items: int, chunksize: int) -> int:
+    num_chunks = -(-num_items // chunksize)
+    return max(1, min(max_workers or os.cpu_count() or 1, num_chunks))
+
+
+def _run_chunks(executor: ProcessPoolExecutor, func: Callable, items: list, chunksize: int, fail_fast: bool) -> list:
+    chunks = [items[start:start + chunksize] for start in range(0, len(items), chunksize)]
+    futures = [executor.submit(_run_chunk, func, chunk, fail_fast) for chunk in chunks]
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    for future in futures:
+        if future in done and future.exception() is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise future.exception()
+    return [result for future in futures for result in future.result()]
+
+
+def run_batch(func: Callable, items: Iterable, max_workers: Optional[int] = None, chunksize: int = 1,
+              fail_fast: bool = True) -> list:
+    # Runs func on every item in a process pool and returns the results in the order of the items.
+    # With fail_fast the remaining work is cancelled and the first error is raised, otherwise the
+    # exception takes the place of the result of the failed item.
+    items = list(items)
+    if not items:
+        return []
+    with ProcessPoolExecutor(max_workers=_worker_count(max_workers, len(items), chunksize)) as executor:
+        return _run_chunks(executor, func, items, chunksize, fail_fast)
+
+
+def _init_worker(match_store_name: str):
+    global _worker_data_handler
+    # Workers only read stored matches, so they need no API access and keep a small cache of their own
+    _worker_data_handler = SummonerDataHandler(None, get_match_store(match_store_name), cache_max_entries=2)
+
+
+def _analyze_stored_match(job: tuple):
+    analysis, summoner_name, match_id = job
+    data = _worker_data_handler.load_match(summoner_name, match_id)
+    player_index = _worker_data_handler.find_player_index_in_data(data['match'], summoner_name)
+    return analysis(summoner_name, match_id, data, player_index)
+
+
+def analyze_summoners(analysis: Callable, summoner_names: Iterable[str], match_store_name: str = 'json',
+                      max_workers: Optional[int] = None, chunksize: int = 4, fail_fast: bool = True,
+                      filters: Optional[dict] = None) -> list:
+    # analysis(summoner_name, match_id, data, player_index) has to be a module level function so it can be
+    # sent to the worker processes. filters select the matches, see MatchManifest.entries.
+    # Returns (summoner_name, match_id, result) tuples in a stable order.
+    data_handler = SummonerDataHandler(None, get_match_store(match_store_name))
+    jobs = []
+    for summoner_name in summoner_names:
+        if not os.path.isdir(summoner_name):
+            print(f'Skipping {summoner_name}, there is no stored match data for it')
+            continue
+        for match_id in data_handler.list_match_ids(summoner_name, **(filters or {})):
+            jobs.append((analysis, summoner_name, match_id))
+    if not jobs:
+        return []
+
+    with ProcessPoolExecutor(max_workers=_worker_count(max_workers, len(jobs), chunksize), initializer=_init_worker,
+                             initargs=(match_store_name,)) as executor:
+        results = _run_chunks(executor, _analyze_stored_match, jobs, chunksize, fail_fast)
+    return [(summoner_name, match_id, result) for (_, summoner_name, match_id), result in zip(jobs, results)]
@@ -0,0 +1,49 @@
+import numpy as np
+
+
+def pack_series(series_by_match: dict[str, np.ndarray]) -> tuple[list[str], np.ndarray, np.ndarray]:
+    # Ragged layout: the series of match i is values[offsets[i]:offsets[i + 1]], an empty series is an empty slice
+    match_ids = list(series_by_match)
+    lengths = np.array([len(series_by_match[match_id]) for match_id in match_ids], dtype=np.int64)
+    offsets = np.zeros(len(match_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate([np.asarray(series_by_match[match_id], dtype=float) for match_id in match_ids]
+                            + [np.empty(0)])
+    return match_ids, values, offsets
+
+
+def _grouped_zscore(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    # z-score of every value within its group, like scipy.stats.zscore it is nan where a group is constant
+    counts = np.bincount(groups)
+    mean = np.bincount(groups, weights=values) / np.maximum(counts, 1)
+    deviations = values - mean[groups]
+    std = np.sqrt(np.bincount(groups, weights=deviations ** 2) / np.maximum(counts, 1))
+    z_scores = np.full(len(values), np.nan)
+    np.divide(deviations, std[groups], out=z_scores, where=std[groups] > 0)
+    return z_scores
+
+
+def career_zscores(series_by_match: dict[str, np.ndarray]) -> dict:
+    # One vectorized pass over every match of a player:
+    # - match_z: z-score of every value within its own match (what 02 computes per match)
+    # - career_z: z-score of every value against the same minute of every game of the career
+    match_ids, values, offsets = pack_series(series_by_match)
+    lengths = np.diff(offsets)
+    result = {'match_ids': match_ids, 'values': values, 'offsets': offsets}
+    if len(values) == 0:
+        result['match_z'] = result['career_z'] = result['career_mean'] = np.empty(0)
+        return result
+
+    match_index = np.repeat(np.arange(len(match_ids)), lengths)
+    result['match_z'] = _grouped_zscore(values, match_index)
+
+    minute = np.arange(len(values)) - np.repeat(offsets[:-1], lengths)
+    result['career_z'] = _grouped_zscore(values, minute)
+    result['career_mean'] = np.bincount(minute, weights=values) / np.bincount(minute)
+    return result
+
+
+def split_by_match(result: dict, key: str) -> dict[str, np.ndarray]:
+    offsets = result['offsets']
+    return {match_id: result[key][offsets[index]:offsets[index + 1]]
+            for index, match_id in enumerate(result['match_ids'])}
@@ -0,0 +1,241 @@
+import argparse
+import importlib
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+# Only the standard library is imported up front, every command imports what it needs when it runs.
+# These commands are started from cron and job runners many times a day, so startup time matters.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Subcommand -> numbered script whose run(data_handler, summoner_name, **filters) implements it
+SCRIPTS = {
+    'cs': '01_simple_approach',
+    'zscore': '02_simple_statistical_methods',
+    'anomalies': '03_simple_machine_learning',
+    'weak-minutes': '04_better_machine_learning',
+}
+
+
+def create_data_handler(summoner_name: Optional[str] = None, online: bool = False):
+    # The API helper (and requests with it) is only set up when something has to be downloaded,
+    # commands on already stored matches never touch the network
+    from src.identity_registry import IdentityRegistry
+    from src.match_store import get_match_store
+    from src.summoner_data_handler import SummonerDataHandler
+
+    riot_api_helper = None
+    if online or summoner_name is None or not os.path.isdir(summoner_name):
+        from src.response_cache import ResponseCache
+        from src.riot_api import RiotApiHelper
+
+        response_cache = ResponseCache(os.getenv("RESPONSE_CACHE_PATH", ".riot_api_cache.sqlite"))
+        riot_api_helper = RiotApiHelper(os.getenv("API_KEY"), response_cache=response_cache)
+    identity_registry = IdentityRegistry(os.getenv("IDENTITY_REGISTRY_PATH", ".identity_registry.sqlite"))
+    return SummonerDataHandler(riot_api_helper, get_match_store(os.getenv("MATCH_STORE_FORMAT", "json")),
+                               identity_registry=identity_registry)
+
+
+def load_script(name: str):
+    # The numbered scripts live next to src/ and are not valid names for an import statement
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    return importlib.import_module(name)
+
+
+def sync(args):
+    data_handler = create_data_handler(args.summoner, online=True)
+    data_handler.sync_match_data_for_summoner(args.summoner, args.summoner, max_matches=args.max_matches,
+                                              page_size=args.page_size)
+    print(f'{len(data_handler.list_match_ids(args.summoner))} matches stored for {args.summoner}')
+    # Only the matches this sync added are folded into the season aggregates
+    season_aggregates(data_handler, args.summoner)
+
+
+def analyze(args):
+    script = load_script(SCRIPTS[args.command])
+    if getattr(args, 'workers', None) is not None or getattr(args, 'summoners', None):
+        # Only the stored matches are analyzed, in a process pool, nothing is downloaded
+        script.run_batch(args.summoners or [args.summoner], args.workers, **match_filters(args))
+        return
+    script.run(create_data_handler(args.summoner), args.summoner, **match_filters(args))
+
+
+def report(args):
+    if not os.path.isdir(args.summoner):
+        print(f'No stored matches for {args.summoner}, run the sync command first')
+        return
+    data_handler = create_data_handler(args.summoner)
+    filters = {'order_by': 'game_creation', 'descending': True, **match_filters(args)}
+    for entry in data_handler.list_matches(args.summoner, **filters):
+        if entry['player_index'] is None:
+            print(f"Skipping match {entry['match_id']}, {args.summoner} was not found in it")
+            continue
+        player = data_handler.load_summary(args.summoner, entry['match_id']).player(entry['player_index'])
+        minutes = entry['game_duration'] / 60
+        cs = player.total_minions_killed + player.neutral_minions_killed
+        played_at = datetime.fromtimestamp(entry['game_creation'] / 1000, timezone.utc).strftime('%Y-%m-%d %H:%M')
+        print(f"{played_at}  {entry['match_id']:<16} {entry['champion_name'] or '':<14} "
+              f"{entry['individual_position'] or '':<8} {minutes:5.1f} min  "
+              f"{player.kills}/{player.deaths}/{player.assists:<3} {cs / minutes:5.2f} cs/m  "
+              f"{'Win' if player.win else 'Loss'}")
+
+
+def replay(args):
+    # Plays the stored timelines of the selected matches through the online anomaly scorer, frame by frame,
+    # like a live game would feed it
+    from src.online_anomaly import replay_frames, score_frames
+
+    if not os.path.isdir(args.summoner):
+        print(f'No stored matches for {args.summoner}, run the sync command first')
+        return
+    data_handler = create_data_handler(args.summoner)
+    filters = {'order_by': 'game_creation', 'descending': True, **match_filters(args)}
+    entries = data_handler.list_matches(args.summoner, **filters)
+    if args.match is not None:
+        entries = [entry for entry in entries if entry['match_id'] == args.match]
+        if not entries:
+            print(f'Match {args.match} is not stored for {args.summoner}')
+            return
+    for entry in entries:
+        if entry['player_index'] is None:
+            print(f"Skipping match {entry['match_id']}, {args.summoner} was not found in it")
+            continue
+        frames = replay_frames(os.path.join(args.summoner, entry['timeline_file']), args.speed)
+        anomalies = []
+        latencies = []
+        print(f"{entry['match_id']}  {entry['champion_name'] or ''} {entry['individual_position'] or ''}")
+        for score in score_frames(frames, entry['player_index'] + 1, threshold=args.threshold,
+                                  warmup=args.warmup):
+            latencies.append(score['latency_ms'])
+            if not score['anomaly']:
+                continue
+            anomalies.append(score['minute'])
+            feature, z_score = max(score['z_scores'].items(), key=lambda item: abs(item[1]))
+            print(f"  minute {score['minute']:>2}: {feature} {score['features'][feature]:+g} (z {z_score:+.1f})")
+        if latencies:
+            print(f"  {len(anomalies)} of {len(latencies)} minutes flagged, "
+                  f"{sum(latencies) / len(latencies):.3f} ms per frame (max {max(latencies):.3f} ms)")
+
+
+def season_aggregates(data_handler, summoner_name: str):
+    from src.season_aggregates import SeasonAggregates
+
+    aggregates = SeasonAggregates(os.getenv("SEASON_AGGREGATES_PATH", ".season_aggregates.sqlite"))
+    aggregates.update(data_handler, summoner_name)
+    return aggregates
+
+
+def season(args):
+    if args.by and args.last_games is not None:
+        args.parser.error('--by only works with --last-days, the last games are counted over every champion')
+    if not os.path.isdir(args.summoner):
+        print(f'No stored matches for {args.summoner}, run the sync command first')
+        return
+    aggregates = season_aggregates(create_data_handler(args.summoner), args.summoner)
+    window = {'last_games': args.last_games, 'last_days': args.last_days}
+    rows = {'All': aggregates.totals(args.summoner, **window)}
+    if args.by:
+        rows.update(aggregates.breakdown(args.summoner, args.by, last_days=args.last_days))
+    for name, totals in rows.items():
+        print(f"{name:<14} {totals['games']:4} games  {totals['win_rate']:4.0%} wins  "
+              f"{totals['cs_per_minute']:5.2f} cs/m  {totals['gold_per_minute']:6.1f} gold/m  "
+              f"{totals['damage_per_minute']:6.1f} dmg/m  {totals['kda']:4.2f} KDA")
+
+
+def match_filters(args) -> dict:
+    filters = {
+        'champion': args.champion,
+        'position': args.position,
+        'queue_id': args.queue,
+        'since': parse_date(args.since) if args.since else None,
+        'until': parse_date(args.until) if args.until else None,
+        'limit': args.limit,
+    }
+    filters = {name: value for name, value in filters.items() if value is not None}
+    if 'limit' in filters and 'order_by' not in filters:
+        # The newest matches first, that is what a limit is asked for
+        filters.update(order_by='game_creation', descending=True)
+    return filters
+
+
+def parse_date(value: str) -> int:
+    # YYYY-MM-DD (UTC) -> gameCreation style milliseconds
+    return int(datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    # The common options are accepted after the subcommand, eg. python -m src report --summoner NAME
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--summoner', default=None, help='Summoner name / data directory (default: SUMMONER_NAME)')
+    common.add_argument('--metrics-output', help='Write the run metrics here, .json or .prom')
+    common.add_argument('--profile-output', help='Run under cProfile and dump the stats here')
+    common.add_argument('--trace-memory', action='store_true', help='Record the peak memory with tracemalloc')
+
+    parser = argparse.ArgumentParser(prog='python -m src', description='League of Legends match analysis')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sync_parser = commands.add_parser('sync', parents=[common], help='Download the matches that are not stored yet')
+    sync_parser.add_argument('--max-matches', type=int, default=None)
+    sync_parser.add_argument('--page-size', type=int, default=100)
+    sync_parser.set_defaults(handler=sync)
+
+    descriptions = {
+        'cs': 'CS per minute of every match and the gold it cost',
+        'zscore': 'CS anomalies by z-score, per match and against the career',
+        'anomalies': 'Per minute anomalies with an IsolationForest',
+        'weak-minutes': 'Weak minutes predicted by the corpus wide RandomForest',
+        'report': 'One line summary of every stored match',
+    }
+    for command, description in descriptions.items():
+        command_parser = commands.add_parser(command, parents=[common], help=description)
+        add_match_filters(command_parser)
+        command_parser.set_defaults(handler=report if command == 'report' else analyze)
+        if command == 'anomalies':
+            command_parser.add_argument('--workers', type=int, help='Analyze the matches in this many processes')
+            command_parser.add_argument('--summoners', nargs='+', help='Data directories to analyze in one batch, '
+                                                                        'instead of --summoner')
+
+    replay_parser = commands.add_parser('replay', parents=[common],
+                                        help='Replay stored timelines through the online anomaly scorer')
+    add_match_filters(replay_parser)
+    replay_parser.add_argument('--match', help='Only this match id')
+    replay_parser.add_argument('--speed', type=float, help='Game seconds per second, eg. 60; as fast as possible '
+                                                           'when not set')
+    replay_parser.add_argument('--threshold', type=float, default=3.0, help='z-score that flags a minute')
+    replay_parser.add_argument('--warmup', type=int, default=5, help='Minutes scored before any is flagged')
+    replay_parser.set_defaults(handler=replay)
+
+    season_parser = commands.add_parser('season', parents=[common],
+                                        help='CS, gold and damage per minute, KDA and win rate over the history')
+    window = season_parser.add_mutually_exclusive_group()
+    window.add_argument('--last-games', type=int)
+    window.add_argument('--last-days', type=int)
+    season_parser.add_argument('--by', choices=['champion', 'position'], help='Also one line per champion or position')
+    # The parser reports the --by and --last-games combination, argparse has no way to declare it
+    season_parser.set_defaults(handler=season, parser=season_parser)
+    return parser
+
+
+def add_match_filters(parser: argparse.ArgumentParser):
+    parser.add_argument('--champion')
+    parser.add_argument('--position', help='individualPosition, eg. BOTTOM')
+    parser.add_argument('--queue', type=int, help='Queue id, eg. 420 for ranked solo')
+    parser.add_argument('--since', help='First day to include, YYYY-MM-DD')
+    parser.add_argument('--until', help='First day to exclude, YYYY-MM-DD')
+    parser.add_argument('--limit', type=int, help='Only the newest N matches')
+
+
+def main(argv: Optional[list[str]] = None):
+    args = build_parser().parse_args(argv)
+
+    from dotenv import load_dotenv
+    from src.instrumentation import run_instrumented
+
+    load_dotenv()
+    args.summoner = args.summoner or os.getenv("SUMMONER_NAME")
+    if not args.summoner:
+        raise Exception("Set SUMMONER_NAME or pass --summoner")
+    run_instrumented(lambda: args.handler(args), args.metrics_output, args.profile_output, args.trace_memory)
@@ -0,0 +1,392 @@
+import argparse
+import io
+import math
+import os
+import random
+import sqlite3
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from src.feature_store import FeatureStore
+from src.helpers import atomic_write_bytes
+from src.match_store import MATCH, TIMELINE, find_match_file, list_match_ids
+from src.timeline_features import FEATURE_INDEX, extract_participant_features_from_file
+
+COHORT_VERSION = 3
+
+# Per minute metrics: cumulative CS (lane and jungle), gold and xp at the minute, and the CS gained during it
+MINUTE_METRICS = ('cs', 'cs_diff', 'gold', 'xp')
+# Whole game metrics, looked up with minute=None
+GAME_METRICS = ('cs_per_minute',)
+# Minutes past this one are folded into it, so the number of sketches stays bounded however long a game runs
+MAX_MINUTE = 45
+# Grouping of a sketch key: every participant, per individualPosition or per champion
+ALL, POSITION, CHAMPION = 'all', 'position', 'champion'
+
+
+class KllSketch:
+    # KLL quantile sketch: level h holds items that each stand for 2 ** h values. When the levels are over capacity
+    # the lowest full level is sorted and every other item is promoted, so the memory stays around 3 * k items
+    # whatever the number of values, with a rank error of roughly 1.7 / k. Sketches with the same k merge.
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.n = 0
+        self.levels: list[list[float]] = [[]]
+        self._sorted: Optional[tuple[np.ndarray, np.ndarray]] = None
+
+    def update(self, value: float):
+        self.levels[0].append(float(value))
+        self.n += 1
+        self._sorted = None
+        if len(self.levels[0]) >= self.__capacity(0):
+            self.__compress()
+
+    def update_many(self, values: Iterable[float]):
+        values = [float(value) for value in values]
+        self.levels[0].extend(values)
+        self.n += len(values)
+        self._sorted = None
+        self.__compress()
+
+    def merge(self, other: 'KllSketch'):
+        if other.k != self.k:
+            raise Exception(f'Cannot merge a sketch with k={other.k} into one with k={self.k}')
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        self._sorted = None
+        self.__compress()
+
+    def rank(self, value: float) -> float:
+        # Fraction of the values that are lower or equal
+        if self.n == 0:
+            return math.nan
+        values, cumulative_weights = self.__sorted()
+        return float(cumulative_weights[np.searchsorted(values, value, side='right')]) / self.n
+
+    def quantile(self, q: float) -> float:
+        if self.n == 0:
+            return math.nan
+        values, cumulative_weights = self.__sorted()
+        index = np.searchsorted(cumulative_weights[1:], q * self.n, side='left')
+        return float(values[min(index, len(values) - 1)])
+
+    def __sorted(self) -> tuple[np.ndarray, np.ndarray]:
+        # Sorted items and the total weight below each of them, built once until the next update
+        if self._sorted is None:
+            values = np.concatenate([np.asarray(items, dtype=np.float64) for items in self.levels])
+            weights = np.concatenate([np.full(len(items), 1 << level, dtype=np.int64)
+                                      for level, items in enumerate(self.levels)])
+            order = np.argsort(values, kind='stable')
+            self._sorted = values[order], np.concatenate(([0], np.cumsum(weights[order])))
+        return self._sorted
+
+    def __capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def __compress(self):
+        while sum(len(items) for items in self.levels) > sum(self.__capacity(level)
+                                                             for level in range(len(self.levels))):
+            for level, items in enumerate(self.levels):
+                if len(items) < self.__capacity(level):
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                items.sort()
+                # With an odd count the largest item stays on its level, the rest are halved
+                kept = [items.pop()] if len(items) % 2 else []
+                self.levels[level + 1].extend(items[random.getrandbits(1)::2])
+                self.levels[level] = kept
+                break
+
+    def to_state(self) -> tuple:
+        return self.k, self.n, self.levels
+
+    @classmethod
+    def from_state(cls, state: tuple) -> 'KllSketch':
+        sketch = cls(state[0])
+        sketch.n = state[1]
+        sketch.levels = [list(items) for items in state[2]]
+        return sketch
+
+
+def participant_metrics(match_data: dict, match_features: np.ndarray) -> dict[str, np.ndarray]:
+    # metric -> (minutes, participants) values of one match; whole game metrics have a single row
+    cs = match_features[:, :, FEATURE_INDEX['cs']] + match_features[:, :, FEATURE_INDEX['jungle_cs']]
+    game_minutes = match_data['info']['gameDuration'] / 60
+    participants = match_data['info']['participants']
+    total_cs = np.array([participant['totalMinionsKilled'] + participant['neutralMinionsKilled']
+                         for participant in participants], dtype=np.float64)
+    return {
+        'cs': cs,
+        'cs_diff': np.diff(cs, axis=0),
+        'gold': match_features[:, :, FEATURE_INDEX['gold']],
+        'xp': match_features[:, :, FEATURE_INDEX['xp']],
+        'cs_per_minute': (total_cs / game_minutes).reshape(1, -1),
+    }
+
+
+def match_ids_path(path: str) -> str:
+    # The ids of the added matches are kept in SQLite next to the cohort file, eg. cohort_percentiles.matches.sqlite.
+    # They are only needed to skip or refuse matches that were already added, so loading the sketches for lookups
+    # does not grow with the corpus.
+    return os.path.splitext(path)[0] + '.matches.sqlite'
+
+
+class CohortPercentiles:
+    # One KLL sketch per (metric, grouping, group, minute) over every participant of every added match, not just
+    # the tracked players, eg. the cumulative CS at minute 10 of everyone who played MIDDLE. Sketches have a fixed
+    # size, so lookups cost the same and memory stays bounded at any corpus size:
+    #   cohort.percentile('cs', 83, minute=10, position='MIDDLE')  ->  35.0, p35 for a MIDDLE player at minute 10
+    # Cohorts built by separate workers over disjoint matches are combined with merge.
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.sketches: dict[tuple[str, str, str, int], KllSketch] = {}
+        # Matches added since the last save, the saved ones are looked up in the file of match_ids_path
+        self.added_match_ids: set[str] = set()
+        # Bumped by every save, ids written by a save whose cohort file was not replaced are dropped again
+        self.generation = 0
+        self.path: Optional[str] = None
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def has_match(self, match_id: str) -> bool:
+        if match_id in self.added_match_ids:
+            return True
+        connection = self.__saved_match_ids()
+        return connection is not None and connection.execute(
+            'SELECT 1 FROM matches WHERE match_id = ?', (match_id,)).fetchone() is not None
+
+    def match_ids(self) -> Iterator[str]:
+        yield from self.added_match_ids
+        connection = self.__saved_match_ids()
+        if connection is not None:
+            for match_id, in connection.execute('SELECT match_id FROM matches'):
+                yield match_id
+
+    def match_count(self) -> int:
+        connection = self.__saved_match_ids()
+        saved = connection.execute('SELECT COUNT(*) FROM matches').fetchone()[0] if connection is not None else 0
+        return saved + len(self.added_match_ids)
+
+    def add_match(self, match_data: dict, match_features: np.ndarray) -> bool:
+        match_id = match_data['metadata']['matchId']
+        if self.has_match(match_id):
+            return False
+        participants = match_data['info']['participants']
+        groups = [self.__groups(participant) for participant in participants]
+        for metric, values in participant_metrics(match_data, match_features).items():
+            for row, minute_values in enumerate(values):
+                minute = min(row, MAX_MINUTE) if metric in MINUTE_METRICS else -1
+                self.__sketch(metric, ALL, '', minute).update_many(minute_values.tolist())
+                for participant_index, value in enumerate(minute_values.tolist()):
+                    for grouping, group in groups[participant_index]:
+                        self.__sketch(metric, grouping, group, minute).update(value)
+        self.added_match_ids.add(match_id)
+        return True
+
+    def update_from_directory(self, save_dir: str, feature_store: Optional[FeatureStore] = None) -> int:
+        # Adds the stored matches of a data directory that were not added yet, returns how many were added.
+        # Features already in the feature store are read from it instead of being extracted again.
+        added = 0
+        for match_id in list_match_ids(save_dir):
+            if self.has_match(match_id):
+                continue
+            match_path, match_store = find_match_file(save_dir, match_id, MATCH)
+            timeline_path, _ = find_match_file(save_dir, match_id, TIMELINE)
+            if timeline_path is None:
+                continue
+            with open(match_path, 'rb') as file:
+                match_data = match_store.decode(file.read())
+            if feature_store is not None and match_id in feature_store:
+                match_features = feature_store.get_match(match_id)
+            else:
+                match_features = extract_participant_features_from_file(timeline_path)
+            added += self.add_match(match_data, match_features)
+        return added
+
+    def merge(self, other: 'CohortPercentiles'):
+        if other.k != self.k:
+            raise Exception(f'Cannot merge a cohort with k={other.k} into one with k={self.k}')
+        other_match_ids = set(other.match_ids())
+        shared = sum(self.has_match(match_id) for match_id in other_match_ids)
+        if shared:
+            # The values of a match cannot be taken out of a sketch again, they would be counted twice
+            raise Exception(f'Cohorts share {shared} matches, build them over disjoint matches to merge them')
+        for key, sketch in other.sketches.items():
+            if key in self.sketches:
+                self.sketches[key].merge(sketch)
+            else:
+                self.sketches[key] = KllSketch.from_state(sketch.to_state())
+        self.added_match_ids.update(other_match_ids)
+
+    def sketch(self, metric: str, minute: Optional[int] = None, position: Optional[str] = None,
+               champion: Optional[str] = None) -> Optional[KllSketch]:
+        if metric not in MINUTE_METRICS + GAME_METRICS:
+            raise Exception(f'Unknown cohort metric {metric}, expected one of {MINUTE_METRICS + GAME_METRICS}')
+        if position is not None and champion is not None:
+            raise Exception("Pass either a position or a champion, cohorts are not kept per position and champion")
+        if metric in MINUTE_METRICS:
+            if minute is None:
+                raise Exception(f'{metric} is kept per minute, pass a minute')
+            minute = min(minute, MAX_MINUTE)
+        else:
+            minute = -1
+        if position is not None:
+            return self.sketches.get((metric, POSITION, position, minute))
+        if champion is not None:
+            return self.sketches.get((metric, CHAMPION, champion, minute))
+        return self.sketches.get((metric, ALL, '', minute))
+
+    def percentile(self, metric: str, value: float, minute: Optional[int] = None, position: Optional[str] = None,
+                   champion: Optional[str] = None) -> Optional[float]:
+        # 0-100 percentile of the value in its cohort, None when the cohort has no values
+        sketch = self.sketch(metric, minute, position, champion)
+        if sketch is None or sketch.n == 0:
+            return None
+        return 100 * sketch.rank(value)
+
+    def quantile(self, metric: str, q: float, minute: Optional[int] = None, position: Optional[str] = None,
+                 champion: Optional[str] = None) -> Optional[float]:
+        # Value at quantile q (0-1) of the cohort, eg. q=0.5 for the median, None when the cohort has no values
+        sketch = self.sketch(metric, minute, position, champion)
+        if sketch is None or sketch.n == 0:
+            return None
+        return sketch.quantile(q)
+
+    def save(self, path: str):
+        # Plain arrays in an npz file, no pickle, so cohorts from other workers are safe to load and merge.
+        # The items of every level of every sketch are concatenated in values, level_sizes holds the item count
+        # of each level and level_counts the number of levels of each sketch.
+        # The new match ids are written first under the next generation, replacing the npz file is the commit point.
+        generation = self.generation + 1
+        match_ids = self.added_match_ids if path == self.path else set(self.match_ids())
+        # Saved to another file, whatever that file held is replaced
+        connection = self.__connect(path, self.generation if path == self.path else 0)
+        connection.executemany('INSERT OR REPLACE INTO matches (match_id, generation) VALUES (?, ?)',
+                               [(match_id, generation) for match_id in match_ids])
+        connection.commit()
+
+        keys = list(self.sketches)
+        levels = [items for key in keys for items in self.sketches[key].levels]
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            version=np.array(COHORT_VERSION), k=np.array(self.k), max_minute=np.array(MAX_MINUTE),
+            generation=np.array(generation),
+            metrics=np.array([key[0] for key in keys], dtype=str),
+            groupings=np.array([key[1] for key in keys], dtype=str),
+            groups=np.array([key[2] for key in keys], dtype=str),
+            minutes=np.array([key[3] for key in keys], dtype=np.int64),
+            counts=np.array([self.sketches[key].n for key in keys], dtype=np.int64),
+            level_counts=np.array([len(self.sketches[key].levels) for key in keys], dtype=np.int64),
+            level_sizes=np.array([len(items) for items in levels], dtype=np.int64),
+            values=np.array([value for items in levels for value in items], dtype=np.float64),
+        )
+        atomic_write_bytes(path, buffer.getvalue())
+        if self._connection is not None and self._connection is not connection:
+            self._connection.close()
+        self.generation = generation
+        self.path = path
+        self._connection = connection
+        self.added_match_ids = set()
+
+    @classmethod
+    def load(cls, path: str) -> 'CohortPercentiles':
+        try:
+            data = dict(np.load(path, allow_pickle=False))
+        except (OSError, ValueError) as e:
+            raise Exception(f'Cannot read the cohort in {path}, rebuild it: {e}')
+        if int(data['version']) != COHORT_VERSION or int(data['max_minute']) != MAX_MINUTE:
+            raise Exception(f'The cohort in {path} was built by another version, rebuild it')
+        cohort = cls(int(data['k']))
+        cohort.generation = int(data['generation'])
+        cohort.path = path
+        level_sizes = data['level_sizes'].tolist()
+        level_ends = np.cumsum(data['level_sizes']).tolist()
+        values = data['values'].tolist()
+        level = 0
+        for metric, grouping, group, minute, n, level_count in zip(
+                data['metrics'].tolist(), data['groupings'].tolist(), data['groups'].tolist(),
+                data['minutes'].tolist(), data['counts'].tolist(), data['level_counts'].tolist()):
+            levels = [values[level_ends[index] - level_sizes[index]:level_ends[index]]
+                      for index in range(level, level + level_count)]
+            level += level_count
+            cohort.sketches[(metric, grouping, group, minute)] = KllSketch.from_state((cohort.k, n, levels))
+        return cohort
+
+    @classmethod
+    def load_or_create(cls, path: str, k: int = 200) -> 'CohortPercentiles':
+        if os.path.exists(path):
+            return cls.load(path)
+        cohort = cls(k)
+        # Ids left next to a cohort file that was removed are dropped, generation 0 has none
+        cohort.path = path
+        return cohort
+
+    def __saved_match_ids(self) -> Optional[sqlite3.Connection]:
+        # Opened on first use, so a cohort loaded only for lookups never reads its match ids
+        if self._connection is None and self.path is not None:
+            if self.generation > 0 and not os.path.exists(match_ids_path(self.path)):
+                raise Exception(f'The match ids of the cohort in {self.path} are missing, expected them in '
+                                f'{match_ids_path(self.path)}')
+            self._connection = self.__connect(self.path, self.generation)
+        return self._connection
+
+    def __connect(self, path: str, generation: int) -> sqlite3.Connection:
+        # Drops the ids of saves newer than the given generation, their cohort file was never written
+        connection = sqlite3.connect(match_ids_path(path))
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS matches (match_id TEXT PRIMARY KEY, generation INTEGER NOT NULL)'
+        )
+        connection.execute('DELETE FROM matches WHERE generation > ?', (generation,))
+        connection.commit()
+        return connection
+
+    def __groups(self, participant: dict) -> list[tuple[str, str]]:
+        groups = [(CHAMPION, participant['championName'])]
+        # ARAM and other modes without lanes report 'Invalid'
+        if participant.get('individualPosition') not in (None, '', 'Invalid'):
+            groups.append((POSITION, participant['individualPosition']))
+        return groups
+
+    def __sketch(self, metric: str, grouping: str, group: str, minute: int) -> KllSketch:
+        key = (metric, grouping, group, minute)
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = KllSketch(self.k)
+        return sketch
+
+
+def load_cohort(path: Optional[str] = None) -> Optional[CohortPercentiles]:
+    # The cohort at COHORT_PATH, None when it was not built yet
+    path = path or os.getenv('COHORT_PATH', 'cohort_percentiles.npz')
+    if not os.path.exists(path):
+        return None
+    return CohortPercentiles.load(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or update the cohort percentile sketches')
+    parser.add_argument('save_dirs', nargs='*', help='Summoner directories holding the matches')
+    parser.add_argument('--output', default=os.getenv('COHORT_PATH', 'cohort_percentiles.npz'))
+    parser.add_argument('--merge', nargs='+', default=[], help='Cohort files built by other workers to merge in')
+    parser.add_argument('--k', type=int, default=200, help='Sketch size of a new cohort, larger is more accurate')
+    args = parser.parse_args()
+
+    cohort = CohortPercentiles.load_or_create(args.output, args.k)
+    feature_store = FeatureStore(os.getenv('FEATURE_STORE_DIR', '.feature_store'))
+    for save_dir in args.save_dirs:
+        print(f'Added {cohort.update_from_directory(save_dir, feature_store)} matches from {save_dir}')
+    for path in args.merge:
+        cohort.merge(CohortPercentiles.load(path))
+        print(f'Merged {path}')
+    cohort.save(args.output)
+    print(f'{cohort.match_count()} matches in {len(cohort.sketches)} sketches written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
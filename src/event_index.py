@@ -0,0 +1,146 @@
+from typing import Iterable, Optional
+
+import numpy as np
+
+from src.timeline_reader import read_timeline
+
+# Columns every event type has. participant is the acting participant: participantId, creatorId or killerId
+# (0 for minions, turrets and monsters). x and y are -1 for events without a position.
+COMMON_FIELDS = [
+    ('timestamp', np.int64, 'timestamp'),
+    ('participant', np.int8, None),
+    ('x', np.int32, None),
+    ('y', np.int32, None),
+]
+ACTOR_KEYS = ('participantId', 'creatorId', 'killerId')
+
+# Event type -> (column, dtype, key in the event) of the type specific fields. assistingParticipantIds is stored as
+# an 'assistants' bit mask, bit N set when participant N assisted.
+_NAME = 'U32'
+EVENT_FIELDS = {
+    'CHAMPION_KILL': [('victim', np.int8, 'victimId'), ('assistants', np.uint16, 'assistingParticipantIds'),
+                      ('bounty', np.int32, 'bounty'), ('shutdown_bounty', np.int32, 'shutdownBounty'),
+                      ('kill_streak_length', np.int16, 'killStreakLength')],
+    'CHAMPION_SPECIAL_KILL': [('kill_type', _NAME, 'killType'), ('multi_kill_length', np.int8, 'multiKillLength')],
+    'WARD_PLACED': [('ward_type', _NAME, 'wardType')],
+    'WARD_KILL': [('ward_type', _NAME, 'wardType')],
+    'ELITE_MONSTER_KILL': [('killer_team', np.int16, 'killerTeamId'), ('monster_type', _NAME, 'monsterType'),
+                           ('monster_sub_type', _NAME, 'monsterSubType'), ('bounty', np.int32, 'bounty'),
+                           ('assistants', np.uint16, 'assistingParticipantIds')],
+    'BUILDING_KILL': [('team', np.int16, 'teamId'), ('building_type', _NAME, 'buildingType'),
+                      ('lane_type', _NAME, 'laneType'), ('tower_type', _NAME, 'towerType'),
+                      ('bounty', np.int32, 'bounty'), ('assistants', np.uint16, 'assistingParticipantIds')],
+    'TURRET_PLATE_DESTROYED': [('team', np.int16, 'teamId'), ('lane_type', _NAME, 'laneType')],
+    'ITEM_PURCHASED': [('item_id', np.int32, 'itemId')],
+    'ITEM_SOLD': [('item_id', np.int32, 'itemId')],
+    'ITEM_DESTROYED': [('item_id', np.int32, 'itemId')],
+    'ITEM_UNDO': [('before_id', np.int32, 'beforeId'), ('after_id', np.int32, 'afterId'),
+                  ('gold_gain', np.int32, 'goldGain')],
+    'SKILL_LEVEL_UP': [('skill_slot', np.int8, 'skillSlot'), ('level_up_type', _NAME, 'levelUpType')],
+    'LEVEL_UP': [('level', np.int8, 'level')],
+}
+
+
+def event_dtype(event_type: str) -> np.dtype:
+    fields = COMMON_FIELDS + EVENT_FIELDS.get(event_type, [])
+    return np.dtype([(name, dtype) for name, dtype, _ in fields])
+
+
+def _event_row(event: dict, fields: list) -> tuple:
+    actor = next((event[key] for key in ACTOR_KEYS if key in event), 0)
+    position = event.get('position')
+    row = [event['timestamp'], actor, position['x'] if position else -1, position['y'] if position else -1]
+    for name, dtype, key in fields:
+        value = event.get(key)
+        if name == 'assistants':
+            row.append(sum(1 << participant_id for participant_id in value or ()))
+        elif value is None:
+            row.append('' if dtype == _NAME else -1)
+        else:
+            row.append(value)
+    return tuple(row)
+
+
+class EventIndex:
+    # The events of one timeline as one NumPy structured array per event type, in timestamp order, plus
+    # participant -> row maps. Built in a single pass over the frames, every query afterwards is a vectorized mask:
+    #   index.select('WARD_PLACED', participant=3, before=15 * 60 * 1000)
+    def __init__(self, events: dict[str, np.ndarray]):
+        self.events = events
+        self._participant_rows: dict[str, dict[int, np.ndarray]] = {}
+
+    @classmethod
+    def from_timeline(cls, match_data_timeline: dict, event_types: Optional[Iterable[str]] = None) -> 'EventIndex':
+        event_types = set(event_types) if event_types is not None else None
+        rows: dict[str, list] = {}
+        for frame in match_data_timeline['info']['frames']:
+            for event in frame['events']:
+                event_type = event['type']
+                if event_types is None or event_type in event_types:
+                    rows.setdefault(event_type, []).append(_event_row(event, EVENT_FIELDS.get(event_type, [])))
+        return cls({event_type: np.array(type_rows, dtype=event_dtype(event_type))
+                    for event_type, type_rows in rows.items()})
+
+    @classmethod
+    def from_file(cls, path: str, event_types: Optional[Iterable[str]] = None) -> 'EventIndex':
+        # Only the events are decoded, the participant frames of the timeline file are skipped
+        timeline = read_timeline(path, event_types, include_participant_frames=False)
+        return cls.from_timeline(timeline)
+
+    def event_types(self) -> list[str]:
+        return sorted(self.events)
+
+    def get(self, event_type: str) -> np.ndarray:
+        # An empty array of the right dtype for event types that did not happen in this game
+        if event_type not in self.events:
+            return np.empty(0, dtype=event_dtype(event_type))
+        return self.events[event_type]
+
+    def participant_rows(self, event_type: str) -> dict[int, np.ndarray]:
+        # participant id -> row numbers of its events, built on first use with one stable sort
+        if event_type not in self._participant_rows:
+            participants = self.get(event_type)['participant']
+            order = np.argsort(participants, kind='stable')
+            ids, starts = np.unique(participants[order], return_index=True)
+            self._participant_rows[event_type] = dict(zip(ids.tolist(), np.split(order, starts[1:])))
+        return self._participant_rows[event_type]
+
+    def for_participant(self, event_type: str, participant_id: int) -> np.ndarray:
+        rows = self.participant_rows(event_type).get(participant_id)
+        if rows is None:
+            return self.get(event_type)[:0]
+        return self.get(event_type)[rows]
+
+    def select(self, event_type: str, participant: Optional[int] = None, after: Optional[int] = None,
+               before: Optional[int] = None, assisted_by: Optional[int] = None) -> np.ndarray:
+        # after/before are timestamps in milliseconds, after is inclusive and before exclusive
+        events = self.for_participant(event_type, participant) if participant is not None else self.get(event_type)
+        mask = np.ones(len(events), dtype=bool)
+        if after is not None:
+            mask &= events['timestamp'] >= after
+        if before is not None:
+            mask &= events['timestamp'] < before
+        if assisted_by is not None:
+            mask &= (events['assistants'] >> assisted_by) & 1 == 1
+        return events[mask]
+
+    def counts_per_minute(self, event_type: str, num_participants: int = 10,
+                          num_minutes: Optional[int] = None) -> np.ndarray:
+        # (minutes, participants) event counts, participant id N at column N - 1
+        events = self.get(event_type)
+        minutes = events['timestamp'] // 60000
+        if num_minutes is None:
+            num_minutes = int(minutes.max()) + 1 if len(events) else 0
+        counts = np.zeros((num_minutes, num_participants), dtype=np.int64)
+        actors = events['participant'].astype(np.int64)
+        valid = (actors > 0) & (actors <= num_participants) & (minutes < num_minutes)
+        np.add.at(counts, (minutes[valid], actors[valid] - 1), 1)
+        return counts
+
+    def save(self, path: str):
+        np.savez(path, **self.events)
+
+    @classmethod
+    def load(cls, path: str) -> 'EventIndex':
+        with np.load(path) as data:
+            return cls({event_type: data[event_type] for event_type in data.files})
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from src.helpers import atomic_write_json
+from src.match_store import TIMELINE, find_match_file, list_match_ids
+from src.timeline_features import EXTRACTOR_VERSION, FEATURES, extract_participant_features_from_file
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FeatureStore:
+    # One memory-mapped (rows, features) file per feature set. Every match adds frames x participants rows,
+    # participant-major, so the rows of one participant in one match are a contiguous slice.
+    dtype = np.dtype(np.int64)
+
+    def __init__(self, root: str, feature_set: str = 'participant_minutes'):
+        self.directory = os.path.join(root, feature_set)
+        self.index_path = os.path.join(self.directory, 'index.json')
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = self.__load_index()
+        self.data_path = os.path.join(self.directory, self.index['data_file'])
+        self._rows: Optional[np.ndarray] = None
+
+    def __contains__(self, match_id: str) -> bool:
+        return match_id in self.index['matches']
+
+    def match_ids(self) -> list[str]:
+        return list(self.index['matches'])
+
+    def rows(self) -> np.ndarray:
+        if self._rows is None:
+            shape = (self.index['rows'], len(FEATURES))
+            if self.index['rows'] == 0:
+                self._rows = np.empty(shape, dtype=self.dtype)
+            else:
+                self._rows = np.memmap(self.data_path, dtype=self.dtype, mode='r', shape=shape)
+        return self._rows
+
+    def get(self, match_id: str, participant_id: int) -> np.ndarray:
+        # (frames, features) view of one participant in one match, no copy is made
+        start, stop = self.index['matches'][match_id]['participants'][str(participant_id)]
+        return self.rows()[start:stop]
+
+    def get_match(self, match_id: str) -> np.ndarray:
+        # (frames, participants, features), the same layout extract_participant_features returns
+        entry = self.index['matches'][match_id]
+        start, stop = entry['rows']
+        num_participants = len(entry['participants'])
+        return self.rows()[start:stop].reshape(num_participants, -1, len(FEATURES)).transpose(1, 0, 2)
+
+    def update_from_directory(self, save_dir: str) -> int:
+        timeline_paths = {}
+        for match_id in list_match_ids(save_dir):
+            path, _ = find_match_file(save_dir, match_id, TIMELINE)
+            if path is not None:
+                timeline_paths[match_id] = path
+        return self.update(timeline_paths)
+
+    def update(self, timeline_paths: dict[str, str]) -> int:
+        # Appends the matches that are new or whose timeline file changed, returns how many were (re)extracted
+        updated = 0
+        with open(self.data_path, 'ab') as data_file:
+            for match_id, path in timeline_paths.items():
+                stat = os.stat(path)
+                signature = [stat.st_size, stat.st_mtime_ns]
+                entry = self.index['matches'].get(match_id)
+                if entry is not None and entry['signature'] == signature:
+                    continue
+                source_hash = file_hash(path)
+                if entry is not None and entry['source_hash'] == source_hash:
+                    entry['signature'] = signature
+                    continue
+
+                features = extract_participant_features_from_file(path)
+                frames, num_participants, _ = features.shape
+                start = self.index['rows']
+                data_file.write(np.ascontiguousarray(features.transpose(1, 0, 2), dtype=self.dtype).tobytes())
+                self.index['rows'] += frames * num_participants
+                if entry is not None:
+                    self.index['dead_rows'] += entry['rows'][1] - entry['rows'][0]
+                self.index['matches'][match_id] = {
+                    'source_hash': source_hash,
+                    'signature': signature,
+                    'rows': [start, self.index['rows']],
+                    'participants': {
+                        str(participant + 1): [start + participant * frames, start + (participant + 1) * frames]
+                        for participant in range(num_participants)
+                    },
+                }
+                updated += 1
+            data_file.flush()
+            os.fsync(data_file.fileno())
+
+        self.__save_index()
+        self._rows = None
+        if self.index['dead_rows'] > self.index['rows'] // 2:
+            self.compact()
+        return updated
+
+    def compact(self):
+        # Writes the live rows to the next data file generation. Saving the index that points at the new file is
+        # the commit point: a crash before it leaves the old index and file untouched, the old file is only
+        # removed afterwards.
+        rows = self.rows()
+        generation = self.index.get('generation', 0) + 1
+        data_file_name = f'features.{generation}.bin'
+        matches = {}
+        position = 0
+        with open(os.path.join(self.directory, data_file_name), 'wb') as data_file:
+            for match_id, entry in self.index['matches'].items():
+                start, stop = entry['rows']
+                data_file.write(np.ascontiguousarray(rows[start:stop]).tobytes())
+                offset = position - start
+                matches[match_id] = {
+                    **entry,
+                    'rows': [start + offset, stop + offset],
+                    'participants': {participant_id: [first + offset, last + offset]
+                                     for participant_id, (first, last) in entry['participants'].items()},
+                }
+                position += stop - start
+            data_file.flush()
+            os.fsync(data_file.fileno())
+        self._rows = None
+        del rows
+
+        old_data_path = self.data_path
+        self.index = {**self.index, 'generation': generation, 'data_file': data_file_name, 'rows': position,
+                      'dead_rows': 0, 'matches': matches}
+        self.__save_index()
+        self.data_path = os.path.join(self.directory, data_file_name)
+        os.remove(old_data_path)
+
+    def __empty_index(self) -> dict:
+        return {
+            'extractor_version': EXTRACTOR_VERSION,
+            'features': list(FEATURES),
+            'dtype': self.dtype.str,
+            'rows': 0,
+            'dead_rows': 0,
+            'generation': 0,
+            'data_file': 'features.bin',
+            'matches': {},
+        }
+
+    def __load_index(self) -> dict:
+        index = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+        if index is None or index['extractor_version'] != EXTRACTOR_VERSION or index['features'] != list(FEATURES):
+            # Built by another extractor version, start over
+            index = self.__empty_index()
+            open(os.path.join(self.directory, index['data_file']), 'wb').close()
+            self.index = index
+            self.__save_index()
+            self.__remove_stale_data_files(index)
+            return index
+
+        # Indexes written before compaction was versioned all point at features.bin
+        index.setdefault('generation', 0)
+        index.setdefault('data_file', 'features.bin')
+        data_path = os.path.join(self.directory, index['data_file'])
+        # Rows written after the last index save (eg. a crash during update) are dropped
+        expected_size = index['rows'] * len(FEATURES) * self.dtype.itemsize
+        if not os.path.exists(data_path) or os.path.getsize(data_path) < expected_size:
+            raise Exception(f'Feature store data file {data_path} is shorter than its index')
+        if os.path.getsize(data_path) > expected_size:
+            os.truncate(data_path, expected_size)
+        self.__remove_stale_data_files(index)
+        return index
+
+    def __remove_stale_data_files(self, index: dict):
+        # Left behind by a compaction that crashed before or right after its index was saved
+        for filename in os.listdir(self.directory):
+            if filename.startswith('features.') and filename.endswith('.bin') and filename != index['data_file']:
+                os.remove(os.path.join(self.directory, filename))
+
+    def __save_index(self):
+        atomic_write_json(self.index_path, self.index, indent=None)
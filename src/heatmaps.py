@@ -0,0 +1,167 @@
+import io
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+
+from src.event_index import EventIndex
+from src.helpers import atomic_write_bytes, read_directory_puuid
+from src.match_store import MATCH, TIMELINE, find_match_file, list_match_ids
+from src.timeline_reader import read_timeline
+
+# Summoner's Rift coordinates run from 0 to about 15000 on both axes
+MAP_SIZE = 15000
+# (name, first minute, first minute of the next phase)
+PHASES = (('early', 0, 14), ('mid', 14, 25), ('late', 25, None))
+PHASE_NAMES = tuple(name for name, _, _ in PHASES)
+LAYERS = ('position', 'kill', 'death', 'ward_placed', 'ward_kill')
+HEATMAP_EVENTS = ('CHAMPION_KILL', 'WARD_PLACED', 'WARD_KILL')
+
+
+def phase_of_minute(minutes: np.ndarray) -> np.ndarray:
+    bounds = np.array([start for _, start, _ in PHASES[1:]])
+    return np.searchsorted(bounds, minutes, side='right')
+
+
+def frame_positions(match_data_timeline: dict) -> np.ndarray:
+    # (frames, participants, 2) x/y of every participant at every frame, participant id N at index N - 1
+    frames = match_data_timeline['info']['frames']
+    num_participants = len(match_data_timeline['metadata']['participants'])
+    positions = np.zeros((len(frames), num_participants, 2), dtype=np.int32)
+    for frame_index, frame in enumerate(frames):
+        for participant_id, participant_frame in frame['participantFrames'].items():
+            position = participant_frame['position']
+            positions[frame_index, int(participant_id) - 1] = (position['x'], position['y'])
+    return positions
+
+
+def layer_points(match_data_timeline: dict, events: Optional[EventIndex] = None) -> dict[str, tuple]:
+    # layer -> (participant ids, minutes, x, y) of every point of the match. Ward events carry no position,
+    # they are placed where their participant was at the frame of the event.
+    positions = frame_positions(match_data_timeline)
+    if events is None:
+        events = EventIndex.from_timeline(match_data_timeline, HEATMAP_EVENTS)
+    num_frames, num_participants, _ = positions.shape
+
+    frame_minutes = np.repeat(np.arange(num_frames), num_participants)
+    frame_participants = np.tile(np.arange(1, num_participants + 1), num_frames)
+    points = {'position': (frame_participants, frame_minutes, positions[..., 0].ravel(), positions[..., 1].ravel())}
+
+    kills = events.get('CHAMPION_KILL')
+    kill_minutes = kills['timestamp'] // 60000
+    points['kill'] = (kills['participant'], kill_minutes, kills['x'], kills['y'])
+    points['death'] = (kills['victim'], kill_minutes, kills['x'], kills['y'])
+
+    for layer, event_type in (('ward_placed', 'WARD_PLACED'), ('ward_kill', 'WARD_KILL')):
+        wards = events.get(event_type)
+        wards = wards[(wards['participant'] > 0) & (wards['participant'] <= num_participants)]
+        minutes = wards['timestamp'] // 60000
+        frame_index = np.minimum(minutes, num_frames - 1)
+        at = positions[frame_index, wards['participant'] - 1]
+        points[layer] = (wards['participant'], minutes, at[:, 0], at[:, 1])
+    return points
+
+
+class HeatmapAccumulator:
+    # Fixed size (phases, bins, bins) int32 count grids per layer for every tracked player (puuid) and champion.
+    # Matches are binned and added in one vectorized pass each, no raw points are kept, so memory only grows with
+    # the number of tracked players and of champions, not with the number of matches.
+    def __init__(self, bins: int = 64, players: Optional[Iterable[str]] = None):
+        self.bins = bins
+        # Player grids are kept for these puuids only, plus the summoner of every directory added with
+        # update_from_directory; the other participants of a match only count towards the champion grids
+        self.players = set(players or ())
+        self.grids: dict[tuple[str, str, str], np.ndarray] = {}
+        self.match_ids: set[str] = set()
+
+    def add_match(self, match_data: dict, match_data_timeline: dict, events: Optional[EventIndex] = None) -> bool:
+        match_id = match_data['metadata']['matchId']
+        if match_id in self.match_ids:
+            return False
+        participants = {participant['participantId']: participant
+                        for participant in match_data['info']['participants']}
+        cell_count = len(PHASES) * self.bins * self.bins
+
+        for layer, (participant_ids, minutes, x, y) in layer_points(match_data_timeline, events).items():
+            valid = (participant_ids > 0) & (x >= 0) & (y >= 0)
+            participant_ids = np.asarray(participant_ids[valid], dtype=np.int64)
+            phases = phase_of_minute(minutes[valid])
+            cells = (phases * self.bins + self.__bin(y[valid])) * self.bins + self.__bin(x[valid])
+            for participant_id in np.unique(participant_ids).tolist():
+                participant = participants.get(participant_id)
+                if participant is None:
+                    continue
+                counts = np.bincount(cells[participant_ids == participant_id], minlength=cell_count)
+                counts = counts.reshape(len(PHASES), self.bins, self.bins)
+                self.__grid(layer, 'champion', participant['championName'])[...] += counts
+                if participant['puuid'] in self.players:
+                    self.__grid(layer, 'player', participant['puuid'])[...] += counts
+        self.match_ids.add(match_id)
+        return True
+
+    def update_from_directory(self, save_dir: str) -> int:
+        # Adds the stored matches of a data directory that were not added yet, returns how many were added
+        puuid = read_directory_puuid(save_dir)
+        if puuid is not None:
+            self.players.add(puuid)
+        added = 0
+        for match_id in list_match_ids(save_dir):
+            if match_id in self.match_ids:
+                continue
+            match_path, match_store = find_match_file(save_dir, match_id, MATCH)
+            timeline_path, _ = find_match_file(save_dir, match_id, TIMELINE)
+            if timeline_path is None:
+                continue
+            with open(match_path, 'rb') as file:
+                match_data = match_store.decode(file.read())
+            timeline = read_timeline(timeline_path, HEATMAP_EVENTS, ('position',))
+            added += self.add_match(match_data, timeline)
+        return added
+
+    def heatmap(self, layer: str, player: Optional[str] = None, champion: Optional[str] = None,
+                phase: Optional[str] = None) -> np.ndarray:
+        # (bins, bins) counts, rows are y and columns x; all phases summed up unless one is asked for
+        if (player is None) == (champion is None):
+            raise Exception("Pass either a player puuid or a champion name")
+        grid = self.grids.get((layer, 'player', player) if player is not None else (layer, 'champion', champion))
+        if grid is None:
+            return np.zeros((self.bins, self.bins), dtype=np.int32)
+        if phase is None:
+            return grid.sum(axis=0)
+        return grid[PHASE_NAMES.index(phase)]
+
+    def keys(self, kind: str) -> list[str]:
+        return sorted({key for _, grid_kind, key in self.grids if grid_kind == kind})
+
+    def save(self, path: str):
+        grids = {'|'.join(key): grid for key, grid in self.grids.items()}
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, bins=np.array(self.bins), match_ids=np.array(sorted(self.match_ids)),
+                            players=np.array(sorted(self.players)), **grids)
+        atomic_write_bytes(path, buffer.getvalue())
+
+    @classmethod
+    def load(cls, path: str) -> 'HeatmapAccumulator':
+        with np.load(path) as data:
+            accumulator = cls(int(data['bins']), data['players'].tolist())
+            accumulator.match_ids = set(data['match_ids'].tolist())
+            for name in data.files:
+                if '|' in name:
+                    accumulator.grids[tuple(name.split('|', 2))] = data[name].astype(np.int32)
+        return accumulator
+
+    @classmethod
+    def load_or_create(cls, path: str, bins: int = 64,
+                       players: Optional[Iterable[str]] = None) -> 'HeatmapAccumulator':
+        if os.path.exists(path):
+            return cls.load(path)
+        return cls(bins, players)
+
+    def __bin(self, coordinates: np.ndarray) -> np.ndarray:
+        return np.clip(np.asarray(coordinates, dtype=np.int64) * self.bins // MAP_SIZE, 0, self.bins - 1)
+
+    def __grid(self, layer: str, kind: str, key: str) -> np.ndarray:
+        grid = self.grids.get((layer, kind, key))
+        if grid is None:
+            grid = self.grids[(layer, kind, key)] = np.zeros((len(PHASES), self.bins, self.bins), dtype=np.int32)
+        return grid
@@ -1,2 +1,62 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+_umask: Optional[int] = None
+_umask_lock = threading.Lock()
+
+
 def find_participant_index_by_puuid(puuid: str, timeline_data: dict):
     return timeline_data['metadata']['participants'].index(puuid)
+
+
+def _file_mode() -> int:
+    # The mode a plain open() gives new files. Read once, on the first write: Linux reports the umask in
+    # /proc/self/status, elsewhere it can only be read by setting it, which briefly changes the mode of the files
+    # other threads create, so it is not done at import time.
+    global _umask
+    with _umask_lock:
+        if _umask is None:
+            try:
+                with open('/proc/self/status', 'r', encoding='utf-8') as file:
+                    _umask = next(int(line.split()[1], 8) for line in file if line.startswith('Umask:'))
+            except (OSError, StopIteration, ValueError, IndexError):
+                _umask = os.umask(0o022)
+                os.umask(_umask)
+        return 0o666 & ~_umask
+
+
+def atomic_write_bytes(path: str, data: bytes):
+    # Write next to the target and rename, so readers never see a half written file
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+            # mkstemp creates the file as 0600, give it the same permissions a plain open() would
+            if hasattr(os, 'fchmod'):
+                os.fchmod(file.fileno(), _file_mode())
+            else:
+                os.chmod(tmp_path, _file_mode())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path: str, data, indent=4):
+    atomic_write_bytes(path, json.dumps(data, ensure_ascii=False, indent=indent).encode('utf-8'))
+
+
+def read_directory_puuid(save_dir: str):
+    # The summoner file of a data directory is named after the directory, which may also be given as a path
+    player_file = os.path.join(save_dir, f'{os.path.basename(os.path.normpath(save_dir))}.json')
+    if not os.path.exists(player_file):
+        return None
+    with open(player_file, 'r', encoding='utf-8') as file:
+        return json.load(file)['puuid']
@@ -0,0 +1,129 @@
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional
+
+
+def normalize_name(summoner_name: str) -> str:
+    # Summoner names are looked up case insensitively and without spaces, like the Riot API does
+    return summoner_name.replace(' ', '').lower()
+
+
+class IdentityRegistry:
+    # Persistent summoner name -> puuid -> participant index mapping. Names and summoners are loaded into dicts
+    # once, so resolving a name never touches the disk or the network. The participants of every stored match grow
+    # with the corpus, so they are looked up in SQLite on demand through its (match_id, puuid) key. New identities
+    # are written through to SQLite. Without a path the registry only lives in memory.
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.puuids_by_name: dict[str, str] = {}
+        self.summoners: dict[str, dict] = {}
+        # Only used without a path
+        self.participants: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            self.__open()
+
+    def puuid(self, summoner_name: str) -> Optional[str]:
+        return self.puuids_by_name.get(normalize_name(summoner_name))
+
+    def summoner(self, puuid: str) -> Optional[dict]:
+        return self.summoners.get(puuid)
+
+    def participant_index(self, match_id: str, puuid: str) -> Optional[int]:
+        # Position of the player in metadata.participants, participantId - 1
+        if self._connection is None:
+            return self.participants.get(match_id, {}).get(puuid)
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT participant_index FROM participants WHERE match_id = ? AND puuid = ?', (match_id, puuid)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def has_match(self, match_id: str) -> bool:
+        if self._connection is None:
+            return match_id in self.participants
+        with self._lock:
+            return self._connection.execute(
+                'SELECT 1 FROM participants WHERE match_id = ? LIMIT 1', (match_id,)).fetchone() is not None
+
+    def record_summoner(self, summoner_data: dict, alias: Optional[str] = None):
+        # The current name and the optional alias (eg. the data directory the summoner is stored in) both resolve
+        # to the puuid. Names the summoner had before a rename keep resolving to it until someone else takes them.
+        puuid = summoner_data['puuid']
+        names = [normalize_name(name) for name in (summoner_data.get('name'), alias) if name]
+        summoner = {'puuid': puuid, 'name': summoner_data.get('name'), 'summoner_id': summoner_data.get('id'),
+                    'account_id': summoner_data.get('accountId')}
+        if self.summoners.get(puuid) == summoner and all(self.puuids_by_name.get(name) == puuid for name in names):
+            return
+        with self._lock:
+            self.summoners[puuid] = summoner
+            for name in names:
+                self.puuids_by_name[name] = puuid
+            if self._connection is not None:
+                now = time.time()
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO summoners (puuid, name, summoner_id, account_id, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (puuid, summoner['name'], summoner['summoner_id'], summoner['account_id'], now))
+                self._connection.executemany('INSERT OR REPLACE INTO names (name, puuid, seen_at) VALUES (?, ?, ?)',
+                                             [(name, puuid, now) for name in names])
+                self._connection.commit()
+
+    def record_match(self, match_data: dict):
+        # Works on both the match and the timeline data, both list the puuids in participant order
+        match_id = match_data['metadata']['matchId']
+        if self.has_match(match_id):
+            return
+        participants = {puuid: index for index, puuid in enumerate(match_data['metadata']['participants'])}
+        with self._lock:
+            if self._connection is None:
+                self.participants[match_id] = participants
+            else:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO participants (match_id, puuid, participant_index) VALUES (?, ?, ?)',
+                    [(match_id, puuid, index) for puuid, index in participants.items()])
+                self._connection.commit()
+
+    def resolve(self, summoner_names: Iterable[str], riot_api_helper) -> dict[str, Optional[str]]:
+        # Bulk resolution: known names are answered from memory, the unknown ones are fetched concurrently
+        summoner_names = list(summoner_names)
+        unknown = [name for name in summoner_names if self.puuid(name) is None]
+        if unknown:
+            for name, summoner_data in riot_api_helper.get_summoners_by_names(unknown).items():
+                if summoner_data is None:
+                    print(f'Could not resolve the summoner {name}')
+                    continue
+                self.record_summoner(summoner_data, alias=name)
+        return {name: self.puuid(name) for name in summoner_names}
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def __open(self):
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS summoners ('
+            'puuid TEXT PRIMARY KEY, name TEXT, summoner_id TEXT, account_id TEXT, updated_at REAL NOT NULL)'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, puuid TEXT NOT NULL, seen_at REAL NOT NULL)'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS participants ('
+            'match_id TEXT NOT NULL, puuid TEXT NOT NULL, participant_index INTEGER NOT NULL, '
+            'PRIMARY KEY (match_id, puuid))'
+        )
+        self._connection.commit()
+
+        for puuid, name, summoner_id, account_id in self._connection.execute(
+                'SELECT puuid, name, summoner_id, account_id FROM summoners'):
+            self.summoners[puuid] = {'puuid': puuid, 'name': name, 'summoner_id': summoner_id,
+                                     'account_id': account_id}
+        self.puuids_by_name.update(self._connection.execute('SELECT name, puuid FROM names'))
@@ -0,0 +1,166 @@
+import io
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Optional
+
+from src.helpers import atomic_write_bytes
+
+PROMETHEUS_PREFIX = 'riot_analysis'
+
+
+class Metrics:
+    # Process wide counters, gauges and stage timers. Every update is a dict operation under a lock, cheap enough
+    # to leave on; when disabled the updates return right away. Worker processes of run_batch keep their own.
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+        # name -> [count, total seconds, max seconds]
+        self.timers: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at)
+
+    def timed(self, name: str):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'timers': {name: {'count': count, 'seconds': total, 'max_seconds': longest}
+                           for name, (count, total, longest) in self.timers.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        # Prometheus text exposition format, timers are written as summaries without quantiles
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = _metric_name(name) + '_total'
+            lines += [f'# TYPE {metric} counter', f'{metric} {value}']
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric = _metric_name(name)
+            lines += [f'# TYPE {metric} gauge', f'{metric} {value}']
+        for name, timer in sorted(snapshot['timers'].items()):
+            metric = _metric_name(name) + '_seconds'
+            lines += [f'# TYPE {metric} summary', f'{metric}_sum {timer["seconds"]}',
+                      f'{metric}_count {timer["count"]}',
+                      f'# TYPE {metric}_max gauge', f'{metric}_max {timer["max_seconds"]}']
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path: str):
+        # .prom files are written in the Prometheus text format (eg. for the node exporter textfile collector),
+        # everything else as JSON. The file is replaced atomically, so a scraper never reads half of it.
+        if path.endswith('.prom'):
+            data = self.to_prometheus().encode('utf-8')
+        else:
+            data = json.dumps(self.snapshot(), indent=4).encode('utf-8')
+        atomic_write_bytes(path, data)
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        lines = [f'{name:<32} {timer["count"]:>8} x {timer["seconds"]:10.3f}s (max {timer["max_seconds"]:.3f}s)'
+                 for name, timer in sorted(snapshot['timers'].items(), key=lambda item: -item[1]['seconds'])]
+        lines += [f'{name:<32} {value:>12g}' for name, value in sorted(snapshot['counters'].items())]
+        lines += [f'{name:<32} {value:>12g}' for name, value in sorted(snapshot['gauges'].items())]
+        return '\n'.join(lines)
+
+
+def _metric_name(name: str) -> str:
+    return f'{PROMETHEUS_PREFIX}_{re.sub(r"[^a-zA-Z0-9_]", "_", name)}'
+
+
+metrics = Metrics(enabled=os.getenv('METRICS_DISABLED', '') == '')
+
+
+@contextmanager
+def profile(output_path: Optional[str] = None, trace_memory: bool = False, top: int = 25):
+    # Optional deep dive on top of the always-on metrics: a cProfile run (stats dumped to output_path, readable
+    # with pstats or snakeviz) and/or tracemalloc, which records the peak memory as a gauge.
+    # The profilers are only imported when asked for, this module is imported everywhere and has to load fast
+    profiler = None
+    if output_path:
+        import cProfile
+        profiler = cProfile.Profile()
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(output_path)
+            import pstats
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top)
+            print(stream.getvalue())
+        if trace_memory:
+            metrics.set_gauge('peak_memory_bytes', tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+
+def run_instrumented(main, metrics_output: Optional[str] = None, profile_output: Optional[str] = None,
+                     trace_memory: bool = False):
+    # Runs a script's main under the given profiling and export settings, falling back to the environment:
+    # PROFILE_OUTPUT (cProfile stats file), TRACE_MEMORY=1, METRICS_OUTPUT (.json or .prom)
+    metrics_output = metrics_output or os.getenv('METRICS_OUTPUT')
+    profile_output = profile_output or os.getenv('PROFILE_OUTPUT')
+    trace_memory = trace_memory or os.getenv('TRACE_MEMORY', '') == '1'
+    # Exported even when main fails, the metrics of a failed run are the ones worth looking at
+    try:
+        with metrics.timer('total'):
+            with profile(profile_output, trace_memory=trace_memory):
+                main()
+    finally:
+        if metrics_output:
+            metrics.export(metrics_output)
+            print(f'Metrics written to {metrics_output}')
@@ -0,0 +1,269 @@
+import argparse
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Iterable, Optional
+
+from src.helpers import atomic_write_json
+from src.identity_registry import IdentityRegistry
+from src.match_manifest import MatchManifest
+from src.match_store import MATCH, TIMELINE, JsonFileMatchStore, MatchStore, find_match_file, get_match_store
+
+STORED = 'stored'
+SKIPPED = 'skipped'
+
+
+class SharedMatchStore:
+    # A single copy of every match for all crawled summoners. Files are addressed by the match id, which never
+    # changes for a finished game, and sharded on its hash: root/matches/<2 hex digits>/match_<id>.json.
+    # SQLite keeps the status of every seen match and the membership lists, puuid -> match ids.
+    filename = 'crawl.sqlite'
+
+    def __init__(self, root: str, match_store: Optional[MatchStore] = None):
+        self.root = root
+        self.match_store = match_store if match_store is not None else JsonFileMatchStore()
+        os.makedirs(os.path.join(root, 'matches'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(root, self.filename), check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS matches ('
+            'match_id TEXT PRIMARY KEY, status TEXT NOT NULL, game_mode TEXT, game_creation INTEGER, '
+            'added_at REAL NOT NULL)'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS members ('
+            'puuid TEXT NOT NULL, match_id TEXT NOT NULL, PRIMARY KEY (puuid, match_id))'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS members_match_id ON members (match_id)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS summoners ('
+            'puuid TEXT PRIMARY KEY, name TEXT, depth INTEGER NOT NULL, crawled_at REAL NOT NULL)'
+        )
+        self._connection.commit()
+
+    def shard_dir(self, match_id: str) -> str:
+        return os.path.join(self.root, 'matches', hashlib.sha1(match_id.encode('utf-8')).hexdigest()[:2])
+
+    def status(self, match_id: str) -> Optional[str]:
+        # STORED, SKIPPED (not a CLASSIC game) or None for matches never fetched
+        with self._lock:
+            row = self._connection.execute('SELECT status FROM matches WHERE match_id = ?', (match_id,)).fetchone()
+        return row[0] if row else None
+
+    def known(self, match_ids: Iterable[str]) -> set[str]:
+        match_ids = list(match_ids)
+        with self._lock:
+            return {match_id for match_id, in self._connection.execute(
+                f"SELECT match_id FROM matches WHERE match_id IN ({','.join('?' * len(match_ids))})", match_ids)}
+
+    def save(self, match_id: str, match_data: dict, match_timeline_data: dict):
+        # Every participant becomes a member, so the games of summoners crawled later are already known
+        shard_dir = self.shard_dir(match_id)
+        os.makedirs(shard_dir, exist_ok=True)
+        self.match_store.save(shard_dir, match_id, MATCH, match_data)
+        self.match_store.save(shard_dir, match_id, TIMELINE, match_timeline_data)
+        info = match_data['info']
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?)',
+                                     (match_id, STORED, info['gameMode'], info['gameCreation'], time.time()))
+            self._connection.executemany('INSERT OR IGNORE INTO members (puuid, match_id) VALUES (?, ?)',
+                                         [(puuid, match_id) for puuid in match_data['metadata']['participants']])
+            self._connection.commit()
+
+    def mark_skipped(self, match_id: str, match_data: dict):
+        info = match_data['info']
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?)',
+                                     (match_id, SKIPPED, info['gameMode'], info['gameCreation'], time.time()))
+            self._connection.commit()
+
+    def add_members(self, puuid: str, match_ids: Iterable[str]):
+        with self._lock:
+            self._connection.executemany('INSERT OR IGNORE INTO members (puuid, match_id) VALUES (?, ?)',
+                                         [(puuid, match_id) for match_id in match_ids])
+            self._connection.commit()
+
+    def mark_crawled(self, puuid: str, name: Optional[str], depth: int):
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO summoners VALUES (?, ?, ?, ?)',
+                                     (puuid, name, depth, time.time()))
+            self._connection.commit()
+
+    def match_ids(self, puuid: str) -> list[str]:
+        # The stored matches of a summoner, newest first
+        with self._lock:
+            return [match_id for match_id, in self._connection.execute(
+                'SELECT m.match_id FROM members JOIN matches m USING (match_id) '
+                'WHERE members.puuid = ? AND m.status = ? ORDER BY m.game_creation DESC', (puuid, STORED))]
+
+    def participants(self, match_id: str) -> list[str]:
+        with self._lock:
+            return [puuid for puuid, in self._connection.execute(
+                'SELECT puuid FROM members WHERE match_id = ?', (match_id,))]
+
+    def crawled_summoners(self) -> list[dict]:
+        with self._lock:
+            rows = self._connection.execute('SELECT puuid, name, depth, crawled_at FROM summoners').fetchall()
+        return [dict(zip(('puuid', 'name', 'depth', 'crawled_at'), row)) for row in rows]
+
+    def load(self, match_id: str, kind: str) -> dict:
+        return self.match_store.load(self.shard_dir(match_id), match_id, kind)
+
+    def export_summoner(self, puuid: str, save_dir: str, summoner_data: Optional[dict] = None) -> int:
+        # Fills a per summoner data directory, the layout the analysis scripts read, with hard links to the shared
+        # files, so no match is stored twice on disk. Falls back to copies across file systems.
+        os.makedirs(save_dir, exist_ok=True)
+        summoner_file = os.path.join(save_dir, f'{os.path.basename(os.path.normpath(save_dir))}.json')
+        if not os.path.exists(summoner_file):
+            atomic_write_json(summoner_file, summoner_data if summoner_data is not None else {'puuid': puuid})
+
+        manifest = MatchManifest(save_dir)
+        exported = 0
+        for match_id in self.match_ids(puuid):
+            linked = False
+            for kind in (MATCH, TIMELINE):
+                source, _ = find_match_file(self.shard_dir(match_id), match_id, kind, preferred=self.match_store)
+                target = os.path.join(save_dir, os.path.basename(source))
+                if os.path.exists(target):
+                    continue
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
+                linked = True
+            if linked:
+                manifest.record(match_id, self.load(match_id, MATCH), puuid)
+                exported += 1
+        manifest.close()
+        return exported
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class MatchCrawler:
+    # Breadth-first crawl from a set of seed summoners. The match list of every summoner is merged into the
+    # shared store and only matches the store has never seen are fetched, so a game shared by several tracked
+    # players costs its two requests once. With expand, the participants of the stored games are queued too.
+    def __init__(self, riot_api_helper, shared_store: SharedMatchStore,
+                 identity_registry: Optional[IdentityRegistry] = None, matches_per_summoner: int = 20):
+        self.riot_api_helper = riot_api_helper
+        self.shared_store = shared_store
+        self.identities = identity_registry if identity_registry is not None else IdentityRegistry()
+        self.matches_per_summoner = matches_per_summoner
+
+    def crawl(self, seed_names: Iterable[str], expand: bool = False, max_summoners: Optional[int] = None,
+              max_depth: Optional[int] = None, max_new_matches: Optional[int] = None) -> dict:
+        # max_summoners bounds the match lists fetched, max_new_matches the matches downloaded
+        seeds = self.identities.resolve(seed_names, self.riot_api_helper)
+        queue = deque((puuid, 0) for puuid in dict.fromkeys(seeds.values()) if puuid is not None)
+        queued = {puuid for puuid, _ in queue}
+        names = {puuid: name for name, puuid in seeds.items()}
+        stats = {'summoners': 0, 'downloaded': 0, 'skipped': 0, 'already_known': 0}
+
+        while queue and (max_summoners is None or stats['summoners'] < max_summoners):
+            if max_new_matches is not None and stats['downloaded'] >= max_new_matches:
+                break
+            puuid, depth = queue.popleft()
+            match_list = self.riot_api_helper.get_match_list(summoner_puuid=puuid, count=self.matches_per_summoner)
+            if match_list is None:
+                print(f'Could not get the match list of {names.get(puuid, puuid)}')
+                continue
+            self.shared_store.add_members(puuid, match_list)
+
+            known = self.shared_store.known(match_list)
+            new_match_ids = [match_id for match_id in match_list if match_id not in known]
+            if max_new_matches is not None:
+                new_match_ids = new_match_ids[:max_new_matches - stats['downloaded']]
+            saved, skipped = self.__download_matches(new_match_ids)
+            stats['downloaded'] += len(saved)
+            stats['skipped'] += len(skipped)
+            stats['already_known'] += len(known)
+            stats['summoners'] += 1
+            self.shared_store.mark_crawled(puuid, names.get(puuid), depth)
+
+            if expand and (max_depth is None or depth < max_depth):
+                for match_id in match_list:
+                    for participant in self.shared_store.participants(match_id):
+                        if participant not in queued:
+                            queued.add(participant)
+                            queue.append((participant, depth + 1))
+        return stats
+
+    def __download_matches(self, match_ids: list[str]) -> tuple[list[str], list[str]]:
+        # Returns the stored CLASSIC match ids and the ids of the other game modes, like the data handler
+        matches = self.riot_api_helper.get_matches_by_ids(match_ids)
+        classic_match_ids = []
+        skipped_match_ids = []
+        for match_id, match_data in matches.items():
+            if match_data is None:
+                print(f'Skipping match {match_id}, could not download it')
+            elif match_data['info']['gameMode'] == 'CLASSIC':
+                classic_match_ids.append(match_id)
+            else:
+                self.shared_store.mark_skipped(match_id, match_data)
+                skipped_match_ids.append(match_id)
+
+        saved_match_ids = []
+        timelines = self.riot_api_helper.get_match_timelines_by_ids(classic_match_ids)
+        for match_id in classic_match_ids:
+            if timelines[match_id] is None:
+                print(f'Skipping match {match_id}, could not download its timeline')
+                continue
+            self.shared_store.save(match_id, matches[match_id], timelines[match_id])
+            self.identities.record_match(matches[match_id])
+            saved_match_ids.append(match_id)
+        return saved_match_ids, skipped_match_ids
+
+
+def main():
+    from dotenv import load_dotenv
+    from src.response_cache import ResponseCache
+    from src.riot_api import RiotApiHelper
+
+    parser = argparse.ArgumentParser(description='Crawl the matches of several summoners into one shared store')
+    parser.add_argument('seeds', nargs='*', help='Summoner names to start from (default: SUMMONER_NAME)')
+    parser.add_argument('--root', default=None, help='Shared store directory (default: CRAWL_DIR or .crawl)')
+    parser.add_argument('--matches-per-summoner', type=int, default=20)
+    parser.add_argument('--expand', action='store_true', help='Also crawl the participants of the stored games')
+    parser.add_argument('--max-summoners', type=int, default=None)
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--max-new-matches', type=int, default=None)
+    parser.add_argument('--export', action='store_true',
+                        help='Link the matches of every seed into its data directory for the analysis scripts')
+    args = parser.parse_args()
+
+    load_dotenv()
+    seeds = args.seeds or [os.getenv("SUMMONER_NAME")]
+    response_cache = ResponseCache(os.getenv("RESPONSE_CACHE_PATH", ".riot_api_cache.sqlite"))
+    riot_api_helper = RiotApiHelper(os.getenv("API_KEY"), response_cache=response_cache)
+    identity_registry = IdentityRegistry(os.getenv("IDENTITY_REGISTRY_PATH", ".identity_registry.sqlite"))
+    shared_store = SharedMatchStore(args.root or os.getenv("CRAWL_DIR", ".crawl"),
+                                    get_match_store(os.getenv("MATCH_STORE_FORMAT", "json")))
+
+    crawler = MatchCrawler(riot_api_helper, shared_store, identity_registry, args.matches_per_summoner)
+    stats = crawler.crawl(seeds, expand=args.expand, max_summoners=args.max_summoners, max_depth=args.max_depth,
+                          max_new_matches=args.max_new_matches)
+    print(f"Crawled {stats['summoners']} summoners: {stats['downloaded']} matches downloaded, "
+          f"{stats['skipped']} skipped, {stats['already_known']} already known")
+
+    if args.export:
+        for name in seeds:
+            puuid = identity_registry.puuid(name)
+            if puuid is not None:
+                summoner = identity_registry.summoner(puuid)
+                summoner_data = {'puuid': puuid, 'name': summoner['name'], 'id': summoner['summoner_id'],
+                                 'accountId': summoner['account_id']}
+                exported = shared_store.export_summoner(puuid, name, summoner_data)
+                print(f'{exported} matches linked into {name}')
+
+
+if __name__ == '__main__':
+    main()
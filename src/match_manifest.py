@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+from src.helpers import read_directory_puuid
+from src.match_store import MATCH, TIMELINE, find_match_file, list_match_ids
+
+# Manifest column -> key of the match info
+INFO_FIELDS = {
+    'game_mode': 'gameMode',
+    'game_creation': 'gameCreation',
+    'game_duration': 'gameDuration',
+    'queue_id': 'queueId',
+}
+COLUMNS = ('match_id', 'game_mode', 'game_creation', 'game_duration', 'queue_id', 'player_index', 'champion_name',
+           'individual_position', 'match_file', 'timeline_file')
+ORDER_COLUMNS = ('match_id', 'game_creation', 'game_duration')
+
+
+def manifest_entry(match_id: str, match_data: dict, puuid: Optional[str], match_file: str,
+                   timeline_file: str) -> dict:
+    info = match_data['info']
+    entry = {'match_id': match_id, 'match_file': match_file, 'timeline_file': timeline_file}
+    for column, key in INFO_FIELDS.items():
+        entry[column] = info.get(key)
+    entry['player_index'] = entry['champion_name'] = entry['individual_position'] = None
+    participants = match_data['metadata']['participants']
+    if puuid in participants:
+        # The player index is the position in metadata.participants, like find_player_index_in_data returns
+        entry['player_index'] = participants.index(puuid)
+        player = next((participant for participant in info['participants'] if participant.get('puuid') == puuid),
+                      None)
+        if player is not None:
+            entry['champion_name'] = player.get('championName')
+            entry['individual_position'] = player.get('individualPosition')
+    return entry
+
+
+class MatchManifest:
+    # Per directory index of the stored matches, so that they can be listed, filtered and sorted
+    # without decoding a single match file. File locations are kept as names relative to the directory.
+    filename = '.match_manifest.sqlite'
+
+    def __init__(self, save_dir: str):
+        self.save_dir = save_dir
+        self.path = os.path.join(save_dir, self.filename)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS matches ('
+            'match_id TEXT PRIMARY KEY, game_mode TEXT, game_creation INTEGER, game_duration INTEGER, '
+            'queue_id INTEGER, player_index INTEGER, champion_name TEXT, individual_position TEXT, '
+            'match_file TEXT NOT NULL, timeline_file TEXT NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS matches_game_creation ON matches (game_creation)')
+        self._connection.commit()
+
+    def record(self, match_id: str, match_data: dict, puuid: Optional[str] = None):
+        # Called when a match is saved, while its data is still decoded
+        match_path, _ = find_match_file(self.save_dir, match_id, MATCH)
+        timeline_path, _ = find_match_file(self.save_dir, match_id, TIMELINE)
+        if match_path is None or timeline_path is None:
+            raise Exception(f'Match {match_id} has to be stored in {self.save_dir} before it is recorded')
+        if puuid is None:
+            puuid = read_directory_puuid(self.save_dir)
+        self.__put([manifest_entry(match_id, match_data, puuid, os.path.basename(match_path),
+                                   os.path.basename(timeline_path))])
+
+    def refresh(self) -> int:
+        # Brings the manifest in line with the directory: one listdir, then only the matches that are new, whose
+        # files moved (eg. a migration to another store format) or that were recorded before the puuid of the
+        # directory was known are decoded. Returns how many were indexed.
+        filenames = set(os.listdir(self.save_dir))
+        stored_match_ids = set(list_match_ids(self.save_dir))
+        puuid = read_directory_puuid(self.save_dir)
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT match_id, match_file, timeline_file, player_index FROM matches').fetchall()
+        up_to_date = {match_id for match_id, match_file, timeline_file, player_index in rows
+                      if match_file in filenames and timeline_file in filenames
+                      and (player_index is not None or puuid is None)}
+        removed = [match_id for match_id, _, _, _ in rows if match_id not in stored_match_ids]
+
+        entries = []
+        for match_id in sorted(stored_match_ids - up_to_date):
+            match_path, match_store = find_match_file(self.save_dir, match_id, MATCH)
+            timeline_path, _ = find_match_file(self.save_dir, match_id, TIMELINE)
+            if timeline_path is None:
+                continue
+            with open(match_path, 'rb') as file:
+                match_data = match_store.decode(file.read())
+            entries.append(manifest_entry(match_id, match_data, puuid, os.path.basename(match_path),
+                                          os.path.basename(timeline_path)))
+        self.__put(entries, removed)
+        return len(entries)
+
+    def get(self, match_id: str) -> Optional[dict]:
+        rows = self.__select('WHERE match_id = ?', (match_id,))
+        return rows[0] if rows else None
+
+    def entries(self, game_mode: Optional[str] = None, queue_id: Optional[int] = None,
+                champion: Optional[str] = None, position: Optional[str] = None, since: Optional[int] = None,
+                until: Optional[int] = None, order_by: str = 'match_id', descending: bool = False,
+                limit: Optional[int] = None) -> list[dict]:
+        # since/until are game creation timestamps in milliseconds, like gameCreation in the match data
+        if order_by not in ORDER_COLUMNS:
+            raise Exception(f"Cannot order matches by '{order_by}', use one of: {', '.join(ORDER_COLUMNS)}")
+        conditions = [
+            ('game_mode = ?', game_mode),
+            ('queue_id = ?', queue_id),
+            ('champion_name = ?', champion),
+            ('individual_position = ?', position),
+            ('game_creation >= ?', since),
+            ('game_creation < ?', until),
+        ]
+        conditions = [(condition, value) for condition, value in conditions if value is not None]
+        clause = ''
+        if conditions:
+            clause = 'WHERE ' + ' AND '.join(condition for condition, _ in conditions)
+        clause += f" ORDER BY {order_by} {'DESC' if descending else 'ASC'}"
+        parameters = [value for _, value in conditions]
+        if limit is not None:
+            clause += ' LIMIT ?'
+            parameters.append(limit)
+        return self.__select(clause, parameters)
+
+    def match_ids(self, **filters) -> list[str]:
+        return [entry['match_id'] for entry in self.entries(**filters)]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __select(self, clause: str, parameters) -> list[dict]:
+        with self._lock:
+            rows = self._connection.execute(f'SELECT {", ".join(COLUMNS)} FROM matches {clause}',
+                                            parameters).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def __put(self, entries: list[dict], removed: Optional[list[str]] = None):
+        with self._lock:
+            self._connection.executemany(
+                f'INSERT OR REPLACE INTO matches ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})',
+                [tuple(entry[column] for column in COLUMNS) for entry in entries])
+            self._connection.executemany('DELETE FROM matches WHERE match_id = ?',
+                                         [(match_id,) for match_id in removed or []])
+            self._connection.commit()
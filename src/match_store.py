@@ -0,0 +1,226 @@
+import argparse
+import gzip
+import io
+import json
+import os
+from typing import Optional
+
+from src.helpers import atomic_write_bytes
+from src.instrumentation import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MATCH = 'match'
+TIMELINE = 'timeline'
+
+
+class MatchStore:
+    extension = '.json'
+
+    def path(self, save_dir: str, match_id: str, kind: str) -> str:
+        suffix = '_timeline' if kind == TIMELINE else ''
+        return os.path.join(save_dir, f'match_{match_id}{suffix}{self.extension}')
+
+    def save(self, save_dir: str, match_id: str, kind: str, data: dict):
+        atomic_write_bytes(self.path(save_dir, match_id, kind), self.encode(data))
+
+    def load(self, save_dir: str, match_id: str, kind: str) -> dict:
+        # Every known format is readable, so directories written by another store keep working
+        path, store = find_match_file(save_dir, match_id, kind, preferred=self)
+        if path is None:
+            raise FileNotFoundError(f'No {kind} data for match {match_id} in {save_dir}')
+        with open(path, 'rb') as file:
+            raw = file.read()
+        metrics.increment('match_files_parsed')
+        metrics.increment('match_bytes_parsed', len(raw))
+        with metrics.timer('match_decode'):
+            return store.decode(raw)
+
+    def read_text(self, path: str) -> str:
+        with open(path, 'rb') as file:
+            return self.decompress(file.read()).decode('utf-8')
+
+    def open_text(self, path: str):
+        return open(path, 'r', encoding='utf-8')
+
+    def has(self, save_dir: str, match_id: str, kind: str) -> bool:
+        return find_match_file(save_dir, match_id, kind, preferred=self)[0] is not None
+
+    def has_match(self, save_dir: str, match_id: str) -> bool:
+        return self.has(save_dir, match_id, MATCH) and self.has(save_dir, match_id, TIMELINE)
+
+    def encode(self, data: dict) -> bytes:
+        return self.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    def decode(self, raw: bytes) -> dict:
+        return json.loads(self.decompress(raw))
+
+    def compress(self, raw: bytes) -> bytes:
+        return raw
+
+    def decompress(self, raw: bytes) -> bytes:
+        return raw
+
+
+class JsonFileMatchStore(MatchStore):
+    # The original layout: one pretty printed JSON file per match and timeline
+    extension = '.json'
+
+    def encode(self, data: dict) -> bytes:
+        return json.dumps(data, ensure_ascii=False, indent=4).encode('utf-8')
+
+
+class GzipMatchStore(MatchStore):
+    extension = '.json.gz'
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, raw: bytes) -> bytes:
+        return gzip.compress(raw, compresslevel=self.level, mtime=0)
+
+    def decompress(self, raw: bytes) -> bytes:
+        return gzip.decompress(raw)
+
+    def open_text(self, path: str):
+        return gzip.open(path, 'rt', encoding='utf-8')
+
+
+class ZstdMatchStore(MatchStore):
+    extension = '.json.zst'
+
+    def __init__(self, level: int = 10):
+        if zstandard is None:
+            raise Exception("The zstandard package is required for the zstd match store")
+        self.level = level
+
+    def compress(self, raw: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=self.level).compress(raw)
+
+    def decompress(self, raw: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(raw)
+
+    def open_text(self, path: str):
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+
+
+match_stores = {
+    'json': JsonFileMatchStore,
+    'gzip': GzipMatchStore,
+    'zstd': ZstdMatchStore,
+}
+
+
+def get_match_store(name: str = 'json') -> MatchStore:
+    if name not in match_stores:
+        raise Exception(f"Unknown match store '{name}', use one of: {', '.join(match_stores)}")
+    return match_stores[name]()
+
+
+def known_stores(preferred: Optional[MatchStore] = None) -> list[MatchStore]:
+    stores = [preferred] if preferred is not None else []
+    stores.append(JsonFileMatchStore())
+    stores.append(GzipMatchStore())
+    if zstandard is not None:
+        stores.append(ZstdMatchStore())
+    return stores
+
+
+def find_match_file(save_dir: str, match_id: str, kind: str, preferred: Optional[MatchStore] = None):
+    for store in known_stores(preferred):
+        path = store.path(save_dir, match_id, kind)
+        if os.path.exists(path):
+            return path, store
+    return None, None
+
+
+def store_for_path(path: str) -> MatchStore:
+    # Longest extension first, '.json.gz' also ends with '.gz' but never with '.json'
+    for store in sorted(known_stores(), key=lambda store: len(store.extension), reverse=True):
+        if path.endswith(store.extension):
+            return store
+    raise Exception(f'Unknown match file format: {path}')
+
+
+def read_match_text(path: str) -> str:
+    return store_for_path(path).read_text(path)
+
+
+def open_match_text(path: str):
+    return store_for_path(path).open_text(path)
+
+
+def parse_match_filename(filename: str):
+    # Returns (match_id, kind) for match files of any known format, None for everything else
+    if not filename.startswith('match_'):
+        return None
+    for extension in ('.json', '.json.gz', '.json.zst'):
+        if filename.endswith(extension):
+            name = filename[len('match_'):-len(extension)]
+            if name.endswith('_timeline'):
+                return name[:-len('_timeline')], TIMELINE
+            return name, MATCH
+    return None
+
+
+def list_match_ids(save_dir: str) -> list[str]:
+    match_ids = set()
+    for filename in os.listdir(save_dir):
+        parsed = parse_match_filename(filename)
+        if parsed is not None and parsed[1] == MATCH:
+            match_ids.add(parsed[0])
+    return sorted(match_ids)
+
+
+def list_stored_match_ids(save_dir: str) -> set[str]:
+    # Match ids with both the match and the timeline file, in one listdir
+    kinds: dict[str, set] = {}
+    if os.path.isdir(save_dir):
+        for filename in os.listdir(save_dir):
+            parsed = parse_match_filename(filename)
+            if parsed is not None:
+                kinds.setdefault(parsed[0], set()).add(parsed[1])
+    return {match_id for match_id, stored_kinds in kinds.items() if stored_kinds == {MATCH, TIMELINE}}
+
+
+def migrate_directory(save_dir: str, target: MatchStore, keep_source: bool = False):
+    migrated = 0
+    saved_bytes = 0
+    for match_id in list_match_ids(save_dir):
+        for kind in (MATCH, TIMELINE):
+            path, store = find_match_file(save_dir, match_id, kind, preferred=target)
+            if path is None or type(store) is type(target):
+                continue
+            with open(path, 'rb') as file:
+                raw = file.read()
+            data = store.decode(raw)
+            target.save(save_dir, match_id, kind, data)
+            # Re-read the new file before removing anything
+            if target.load(save_dir, match_id, kind) != data:
+                raise Exception(f'Migration check failed for {kind} of match {match_id}')
+            saved_bytes += len(raw) - os.path.getsize(target.path(save_dir, match_id, kind))
+            if not keep_source:
+                os.remove(path)
+            migrated += 1
+    return migrated, saved_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert stored match data to another storage format')
+    parser.add_argument('directories', nargs='+', help='Summoner data directories to migrate')
+    parser.add_argument('--to', dest='target', default='gzip', choices=list(match_stores))
+    parser.add_argument('--keep-source', action='store_true', help='Keep the original files after conversion')
+    args = parser.parse_args()
+
+    target = get_match_store(args.target)
+    for save_dir in args.directories:
+        migrated, saved_bytes = migrate_directory(save_dir, target, keep_source=args.keep_source)
+        print(f'{save_dir}: {migrated} files converted to {args.target}, {saved_bytes / 1024 ** 2:.1f} MB saved')
+
+
+if __name__ == '__main__':
+    main()
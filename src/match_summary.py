@@ -0,0 +1,160 @@
+import sys
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+
+# (column, dtype, path in the participant data) of the participant fields the analyses read. Strings are stored as
+# codes of the interned tables below; anything else is read from the raw match with MatchSummary.raw().
+PARTICIPANT_FIELDS = [
+    ('participant_id', np.int8, ('participantId',)),
+    ('team_id', np.int16, ('teamId',)),
+    ('win', np.bool_, ('win',)),
+    ('champion', np.int16, ('championName',)),
+    ('individual_position', np.int8, ('individualPosition',)),
+    ('team_position', np.int8, ('teamPosition',)),
+    ('champ_level', np.int8, ('champLevel',)),
+    ('kills', np.int16, ('kills',)),
+    ('deaths', np.int16, ('deaths',)),
+    ('assists', np.int16, ('assists',)),
+    ('kda', np.float64, ('challenges', 'kda')),
+    ('total_minions_killed', np.int16, ('totalMinionsKilled',)),
+    ('neutral_minions_killed', np.int16, ('neutralMinionsKilled',)),
+    ('gold_earned', np.int32, ('goldEarned',)),
+    ('gold_spent', np.int32, ('goldSpent',)),
+    ('damage_dealt_to_champions', np.int32, ('totalDamageDealtToChampions',)),
+    ('damage_taken', np.int32, ('totalDamageTaken',)),
+    ('damage_self_mitigated', np.int32, ('damageSelfMitigated',)),
+    ('vision_score', np.int16, ('visionScore',)),
+    ('wards_placed', np.int16, ('wardsPlaced',)),
+    ('wards_killed', np.int16, ('wardsKilled',)),
+    ('time_played', np.int32, ('timePlayed',)),
+]
+PARTICIPANT_DTYPE = np.dtype([(name, dtype) for name, dtype, _ in PARTICIPANT_FIELDS])
+
+
+class StringTable:
+    # Interned string <-> small integer code table, shared by every summary, so a champion or position name is
+    # kept once per process instead of once per participant of every match. Code 0 is the missing value.
+    def __init__(self):
+        self.strings: list[Optional[str]] = [None]
+        self.codes: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def code(self, value: Optional[str]) -> int:
+        if not value:
+            return 0
+        code = self.codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(value)
+                if code is None:
+                    code = len(self.strings)
+                    self.strings.append(sys.intern(value))
+                    self.codes[self.strings[code]] = code
+        return code
+
+    def string(self, code: int) -> Optional[str]:
+        return self.strings[code]
+
+
+CHAMPIONS = StringTable()
+POSITIONS = StringTable()
+_STRING_TABLES = {'champion': CHAMPIONS, 'individual_position': POSITIONS, 'team_position': POSITIONS}
+
+
+def _field(participant: dict, path: tuple):
+    value = participant
+    for key in path:
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+class ParticipantSummary:
+    # One participant of a summary as plain Python values, strings decoded, for code that reads several fields
+    # of the same player: built with one copy out of the array, then every field is an attribute access
+    __slots__ = PARTICIPANT_DTYPE.names
+
+    def __init__(self, values: tuple):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        self.champion = CHAMPIONS.string(self.champion)
+        self.individual_position = POSITIONS.string(self.individual_position)
+        self.team_position = POSITIONS.string(self.team_position)
+
+
+class MatchSummary:
+    # The match info and the PARTICIPANT_FIELDS of every participant in one structured array, about 2.3 KB (over
+    # half of it the ten puuids) instead of the ~140 KB the decoded match takes. Fields read in loops are plain
+    # attribute and array accesses:
+    #   summary.participants['kills'][player_index], summary.champion(player_index), summary.player(player_index).kda
+    # The raw match is decoded again from its file on demand for rarely used fields and is never kept.
+    __slots__ = ('match_id', 'game_creation', 'game_duration', 'game_mode', 'queue_id', 'puuids', 'participants',
+                 '_raw_loader')
+
+    def __init__(self, match_id: str, game_creation: int, game_duration: int, game_mode: str, queue_id: int,
+                 puuids: tuple, participants: np.ndarray, raw_loader: Optional[Callable[[], dict]] = None):
+        self.match_id = match_id
+        self.game_creation = game_creation
+        self.game_duration = game_duration
+        self.game_mode = game_mode
+        self.queue_id = queue_id
+        # In metadata.participants order, the player index is the position in this tuple
+        self.puuids = puuids
+        self.participants = participants
+        self._raw_loader = raw_loader
+
+    @classmethod
+    def from_match(cls, match_data: dict, raw_loader: Optional[Callable[[], dict]] = None) -> 'MatchSummary':
+        info = match_data['info']
+        participants = np.zeros(len(info['participants']), dtype=PARTICIPANT_DTYPE)
+        for row, participant in zip(participants, info['participants']):
+            for name, _, path in PARTICIPANT_FIELDS:
+                value = _field(participant, path)
+                if name in _STRING_TABLES:
+                    row[name] = _STRING_TABLES[name].code(value)
+                elif value is not None:
+                    row[name] = value
+        return cls(sys.intern(match_data['metadata']['matchId']), info['gameCreation'], info['gameDuration'],
+                   sys.intern(info['gameMode']), info.get('queueId', 0),
+                   tuple(sys.intern(puuid) for puuid in match_data['metadata']['participants']), participants,
+                   raw_loader)
+
+    def player_index(self, puuid: str) -> Optional[int]:
+        if puuid not in self.puuids:
+            return None
+        return self.puuids.index(puuid)
+
+    def player(self, player_index: int) -> ParticipantSummary:
+        return ParticipantSummary(self.participants.item(player_index))
+
+    def champion(self, player_index: int) -> Optional[str]:
+        return CHAMPIONS.string(int(self.participants['champion'][player_index]))
+
+    def position(self, player_index: int) -> Optional[str]:
+        return POSITIONS.string(int(self.participants['individual_position'][player_index]))
+
+    def team_position(self, player_index: int) -> Optional[str]:
+        return POSITIONS.string(int(self.participants['team_position'][player_index]))
+
+    def cs(self, player_index: int) -> int:
+        # Column first, indexing a row of a structured array first is several times slower
+        return (int(self.participants['total_minions_killed'][player_index])
+                + int(self.participants['neutral_minions_killed'][player_index]))
+
+    def raw(self) -> dict:
+        # The full decoded match, for the fields the summary does not keep
+        if self._raw_loader is None:
+            raise Exception(f'No raw data source for match {self.match_id}')
+        return self._raw_loader()
+
+    def raw_participant(self, player_index: int) -> dict:
+        return self.raw()['info']['participants'][player_index]
+
+    def nbytes(self) -> int:
+        # Memory held by this summary. The puuids and the match id are counted too: they are interned, but apart
+        # from the tracked player's puuid no other summary shares them. Champion, position and game mode strings
+        # are shared by every summary and left out.
+        return (sys.getsizeof(self) + sys.getsizeof(self.participants) + sys.getsizeof(self.puuids)
+                + sum(sys.getsizeof(puuid) for puuid in self.puuids) + sys.getsizeof(self.match_id)
+                + sys.getsizeof(self.game_creation) + sys.getsizeof(self.game_duration))
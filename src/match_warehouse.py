@@ -0,0 +1,316 @@
+import argparse
+import json
+import os
+import time
+import uuid
+from typing import Iterable, Optional
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.helpers import atomic_write_bytes, atomic_write_json, read_directory_puuid
+from src.match_store import MATCH, TIMELINE, find_match_file, list_match_ids
+from src.timeline_features import FEATURES, extract_participant_features_from_file
+
+PARTICIPANTS = 'participants'
+FRAMES = 'frames'
+# Written next to the parts of a summoner while they are staged or swapped, names starting with _ are skipped by readers
+COMPACTION_MARKER = '_compaction.json'
+STAGING_PREFIX = '_staging-'
+# Written in the root while the parts of an ingest batch are published, see ingest_directory
+INGEST_MARKER_PREFIX = '_ingest-'
+
+# Warehouse column -> key of the match info / participant summaries
+MATCH_FIELDS = {
+    'game_creation': 'gameCreation',
+    'game_duration': 'gameDuration',
+    'game_mode': 'gameMode',
+    'queue_id': 'queueId',
+    'game_version': 'gameVersion',
+}
+PARTICIPANT_FIELDS = {
+    'participant_id': 'participantId',
+    'puuid': 'puuid',
+    'summoner_name': 'summonerName',
+    'champion_name': 'championName',
+    'individual_position': 'individualPosition',
+    'team_position': 'teamPosition',
+    'team_id': 'teamId',
+    'win': 'win',
+    'kills': 'kills',
+    'deaths': 'deaths',
+    'assists': 'assists',
+    'total_minions_killed': 'totalMinionsKilled',
+    'neutral_minions_killed': 'neutralMinionsKilled',
+    'gold_earned': 'goldEarned',
+    'damage_dealt_to_champions': 'totalDamageDealtToChampions',
+    'damage_taken': 'totalDamageTaken',
+    'vision_score': 'visionScore',
+    'time_played': 'timePlayed',
+}
+
+# Columns every table has, so the same filters work on both of them
+_COMMON_SCHEMA = [
+    ('match_id', pa.string()),
+    ('game_creation', pa.int64()),
+    ('game_mode', pa.string()),
+    ('queue_id', pa.int32()),
+    ('participant_id', pa.int8()),
+    ('champion_name', pa.string()),
+    ('individual_position', pa.string()),
+    ('is_player', pa.bool_()),
+]
+SCHEMAS = {
+    PARTICIPANTS: pa.schema(_COMMON_SCHEMA + [
+        ('game_duration', pa.int32()),
+        ('game_version', pa.string()),
+        ('puuid', pa.string()),
+        ('summoner_name', pa.string()),
+        ('team_position', pa.string()),
+        ('team_id', pa.int16()),
+        ('win', pa.bool_()),
+        ('kills', pa.int32()),
+        ('deaths', pa.int32()),
+        ('assists', pa.int32()),
+        ('total_minions_killed', pa.int32()),
+        ('neutral_minions_killed', pa.int32()),
+        ('gold_earned', pa.int32()),
+        ('damage_dealt_to_champions', pa.int32()),
+        ('damage_taken', pa.int32()),
+        ('vision_score', pa.int32()),
+        ('time_played', pa.int32()),
+    ]),
+    # One row per participant per minute, the feature columns are the ones of the timeline extractor
+    FRAMES: pa.schema(_COMMON_SCHEMA + [('minute', pa.int16())] + [(name, pa.int64()) for name in FEATURES]),
+}
+
+
+def _participant_rows(match_id: str, match_data: dict, puuid: Optional[str]) -> dict[str, list]:
+    info = match_data['info']
+    columns = {name: [] for name in SCHEMAS[PARTICIPANTS].names}
+    for participant in info['participants']:
+        columns['match_id'].append(match_id)
+        for name, key in MATCH_FIELDS.items():
+            columns[name].append(info.get(key))
+        for name, key in PARTICIPANT_FIELDS.items():
+            columns[name].append(participant.get(key))
+        columns['is_player'].append(participant.get('puuid') == puuid)
+    return columns
+
+
+def _frame_rows(participants: dict[str, list], features: np.ndarray) -> dict[str, np.ndarray]:
+    # features is the (frames, participants, features) array of the timeline, the match level columns are
+    # repeated on every frame so that the frame table can be filtered without a join
+    frames, num_participants, _ = features.shape
+    participant_index = np.repeat(np.arange(num_participants), frames)
+    columns = {name: np.asarray(participants[name], dtype=object)[participant_index]
+               for name in ('match_id', 'game_mode', 'champion_name', 'individual_position')}
+    for name in ('game_creation', 'queue_id', 'participant_id', 'is_player'):
+        columns[name] = np.asarray(participants[name])[participant_index]
+    columns['minute'] = np.tile(np.arange(frames), num_participants)
+    participant_major = features.transpose(1, 0, 2).reshape(-1, len(FEATURES))
+    for column, name in enumerate(FEATURES):
+        columns[name] = participant_major[:, column]
+    return columns
+
+
+class MatchWarehouse:
+    # Columnar copy of the stored matches: <root>/<table>/summoner=<name>/part-*.parquet.
+    # Every ingest appends new part files sorted by game creation, so the row group statistics let
+    # time range filters skip whole row groups; compact() merges the parts of a summoner into one file.
+    row_group_size = 64 * 1024
+
+    def __init__(self, root: str):
+        self.root = root
+        for table in SCHEMAS:
+            os.makedirs(os.path.join(root, table), exist_ok=True)
+        # Finishes the ingests and compactions an earlier process was interrupted in, the ingests first, their
+        # staged parts would be removed as strays otherwise
+        for name in os.listdir(root):
+            if name.startswith(INGEST_MARKER_PREFIX) and name.endswith('.json'):
+                self.__publish(os.path.join(root, name))
+            elif name.endswith('.tmp'):
+                os.remove(os.path.join(root, name))
+        for table in SCHEMAS:
+            for partition in os.listdir(os.path.join(root, table)):
+                directory = os.path.join(root, table, partition)
+                if os.path.isdir(directory):
+                    self.__recover(directory)
+
+    def ingest_directory(self, save_dir: str, summoner_name: Optional[str] = None, batch_size: int = 500) -> int:
+        # Adds the matches of a summoner directory that are not in the warehouse yet, returns how many were added
+        summoner_name = summoner_name or os.path.basename(os.path.normpath(save_dir))
+        puuid = read_directory_puuid(save_dir)
+        if puuid is None:
+            print(f'No summoner file in {save_dir}, is_player will be false for every participant')
+        known_match_ids = set(self.match_ids(summoner_name))
+        new_match_ids = [match_id for match_id in list_match_ids(save_dir) if match_id not in known_match_ids]
+
+        for start in range(0, len(new_match_ids), batch_size):
+            tables = {table: [] for table in SCHEMAS}
+            for match_id in new_match_ids[start:start + batch_size]:
+                match_path, match_store = find_match_file(save_dir, match_id, MATCH)
+                timeline_path, _ = find_match_file(save_dir, match_id, TIMELINE)
+                with open(match_path, 'rb') as file:
+                    participants = _participant_rows(match_id, match_store.decode(file.read()), puuid)
+                frames = _frame_rows(participants, extract_participant_features_from_file(timeline_path))
+                tables[PARTICIPANTS].append(pa.Table.from_pydict(participants, schema=SCHEMAS[PARTICIPANTS]))
+                tables[FRAMES].append(pa.Table.from_pydict(frames, schema=SCHEMAS[FRAMES]))
+            # match_ids() reads the participant table only, a batch with participants but no frames would never
+            # be ingested again. Both parts are staged, then published together once the marker is written.
+            staged = []
+            for table, parts in tables.items():
+                part_name = self.__write_part(table, summoner_name, pa.concat_tables(parts), publish=False)
+                if part_name is not None:
+                    staged.append([os.path.relpath(self.__partition_dir(table, summoner_name), self.root),
+                                   part_name])
+            marker_path = os.path.join(self.root, f'{INGEST_MARKER_PREFIX}{uuid.uuid4().hex}.json')
+            atomic_write_json(marker_path, {'parts': staged})
+            self.__publish(marker_path)
+        return len(new_match_ids)
+
+    def match_ids(self, summoner_name: Optional[str] = None) -> list[str]:
+        # Reads only the match id column of the participant table
+        table = self.__scan(PARTICIPANTS, ['match_id'], self.__filter(summoner_name=summoner_name))
+        return list(dict.fromkeys(table.column('match_id').to_pylist()))
+
+    def query(self, table: str = PARTICIPANTS, columns: Optional[Iterable[str]] = None,
+              summoner_name: Optional[str] = None, champion: Optional[str] = None, position: Optional[str] = None,
+              game_mode: Optional[str] = None, since: Optional[int] = None, until: Optional[int] = None,
+              player_only: bool = False, last_games: Optional[int] = None) -> pd.DataFrame:
+        # Eg. the player's CS per minute on Jinx as BOTTOM in the last 50 games:
+        #   query(FRAMES, ['match_id', 'minute', 'cs'], 'alienteavend', 'Jinx', 'BOTTOM', player_only=True,
+        #         last_games=50)
+        # The filters are pushed down to the parquet reader (partition pruning for the summoner, row group
+        # statistics for the rest) and only the requested columns are read. since/until are game creation
+        # timestamps in milliseconds, like gameCreation in the match data.
+        if table not in SCHEMAS:
+            raise Exception(f'Unknown warehouse table {table}, expected one of {", ".join(SCHEMAS)}')
+        columns = list(columns) if columns is not None else SCHEMAS[table].names
+        expression = self.__filter(summoner_name, champion, position, game_mode, since, until, player_only)
+        if last_games is None:
+            return self.__scan(table, columns, expression).to_pandas()
+
+        # The newest games are picked on the participant table, then only their rows are read from the table
+        games = self.__scan(PARTICIPANTS, ['match_id', 'game_creation'], expression).to_pandas()
+        games = games.drop_duplicates('match_id').nlargest(last_games, 'game_creation')
+        expression = expression & ds.field('match_id').isin(games['match_id'].tolist())
+        return self.__scan(table, columns, expression).to_pandas()
+
+    def compact(self, summoner_name: str):
+        # Rewrites the part files of a summoner as one file, sorted by game creation. The merged file is staged
+        # under a name readers skip, then the swap is recorded in a marker before any part is touched: a crash
+        # after that point is rolled forward by the next MatchWarehouse, a crash before it leaves the old parts.
+        for table in SCHEMAS:
+            directory = self.__partition_dir(table, summoner_name)
+            if not os.path.isdir(directory):
+                continue
+            self.__recover(directory)
+            parts = sorted(part for part in os.listdir(directory) if part.startswith('part-'))
+            if len(parts) < 2:
+                continue
+            data = pa.concat_tables(pq.read_table(os.path.join(directory, part), schema=SCHEMAS[table])
+                                    for part in parts)
+            part_name = self.__write_part(table, summoner_name, data, publish=False)
+            atomic_write_json(os.path.join(directory, COMPACTION_MARKER), {'part': part_name, 'replaces': parts})
+            self.__recover(directory)
+
+    def __publish(self, marker_path: str):
+        # Renames the staged parts listed in an ingest marker, parts already renamed are skipped
+        with open(marker_path, 'r', encoding='utf-8') as file:
+            marker = json.load(file)
+        for directory, part_name in marker['parts']:
+            staged_path = os.path.join(self.root, directory, STAGING_PREFIX + part_name)
+            if os.path.exists(staged_path):
+                os.replace(staged_path, os.path.join(self.root, directory, part_name))
+        os.remove(marker_path)
+
+    @staticmethod
+    def __recover(directory: str):
+        marker_path = os.path.join(directory, COMPACTION_MARKER)
+        if os.path.exists(marker_path):
+            with open(marker_path, 'r', encoding='utf-8') as file:
+                marker = json.load(file)
+            for part in marker['replaces']:
+                if os.path.exists(os.path.join(directory, part)):
+                    os.remove(os.path.join(directory, part))
+            staged_path = os.path.join(directory, STAGING_PREFIX + marker['part'])
+            if os.path.exists(staged_path):
+                os.replace(staged_path, os.path.join(directory, marker['part']))
+            os.remove(marker_path)
+        # Staged by a write that crashed before it was published, or the temporary file of atomic_write_bytes
+        for name in os.listdir(directory):
+            if name.startswith(STAGING_PREFIX) or name.endswith('.tmp'):
+                os.remove(os.path.join(directory, name))
+
+    @staticmethod
+    def __part_name() -> str:
+        return f'part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet'
+
+    def __write_part(self, table: str, summoner_name: str, data: pa.Table, publish: bool = True) -> Optional[str]:
+        # Written under the staging prefix, so neither the part nor the temporary file of atomic_write_bytes is
+        # ever seen by the dataset reader, then renamed to its part name unless the caller publishes it. Returns
+        # the part name, None when there was nothing to write.
+        if data.num_rows == 0:
+            return None
+        data = data.sort_by([('game_creation', 'ascending'), ('match_id', 'ascending')])
+        buffer = pa.BufferOutputStream()
+        pq.write_table(data, buffer, row_group_size=self.row_group_size, compression='zstd')
+        directory = self.__partition_dir(table, summoner_name)
+        os.makedirs(directory, exist_ok=True)
+        part_name = self.__part_name()
+        staged_path = os.path.join(directory, STAGING_PREFIX + part_name)
+        atomic_write_bytes(staged_path, buffer.getvalue().to_pybytes())
+        if publish:
+            os.replace(staged_path, os.path.join(directory, part_name))
+        return part_name
+
+    def __partition_dir(self, table: str, summoner_name: str) -> str:
+        return os.path.join(self.root, table, f'summoner={quote(summoner_name, safe="")}')
+
+    def __scan(self, table: str, columns: list[str], expression) -> pa.Table:
+        dataset = ds.dataset(os.path.join(self.root, table), format='parquet', partitioning='hive',
+                             schema=SCHEMAS[table].append(pa.field('summoner', pa.string())))
+        return dataset.to_table(columns=columns, filter=expression)
+
+    @staticmethod
+    def __filter(summoner_name: Optional[str] = None, champion: Optional[str] = None,
+                 position: Optional[str] = None, game_mode: Optional[str] = None, since: Optional[int] = None,
+                 until: Optional[int] = None, player_only: bool = False):
+        conditions = [
+            (summoner_name is not None, lambda: ds.field('summoner') == summoner_name),
+            (champion is not None, lambda: ds.field('champion_name') == champion),
+            (position is not None, lambda: ds.field('individual_position') == position),
+            (game_mode is not None, lambda: ds.field('game_mode') == game_mode),
+            (since is not None, lambda: ds.field('game_creation') >= since),
+            (until is not None, lambda: ds.field('game_creation') < until),
+            (player_only, lambda: ds.field('is_player')),
+        ]
+        expression = ds.scalar(True)
+        for enabled, condition in conditions:
+            if enabled:
+                expression = expression & condition()
+        return expression
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy stored matches into the columnar match warehouse')
+    parser.add_argument('save_dirs', nargs='+', help='Summoner directories holding the matches')
+    parser.add_argument('--root', default=os.getenv('WAREHOUSE_DIR', '.warehouse'))
+    parser.add_argument('--compact', action='store_true', help='Merge the part files of every summoner afterwards')
+    args = parser.parse_args()
+
+    warehouse = MatchWarehouse(args.root)
+    for save_dir in args.save_dirs:
+        ingested = warehouse.ingest_directory(save_dir)
+        print(f'Ingested {ingested} matches from {save_dir}')
+        if args.compact:
+            warehouse.compact(os.path.basename(os.path.normpath(save_dir)))
+
+
+if __name__ == '__main__':
+    main()
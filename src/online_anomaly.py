@@ -0,0 +1,84 @@
+import time
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from src.timeline_features import (EVENT_COLUMNS, FEATURE_INDEX, FEATURES, FRAME_FIELDS, MODEL_FEATURES,
+                                   extract_frame_features)
+from src.timeline_reader import iter_timeline_frames
+
+
+def replay_frames(path: str, speed: Optional[float] = None, frame_interval: float = 60.0) -> Iterator[dict]:
+    # Replays a stored timeline frame by frame. With a speed the frames arrive like in a live game,
+    # eg. speed=60 plays one game minute per second; without it they come as fast as they can be read.
+    started_at = time.monotonic()
+    for frame_index, frame in enumerate(iter_timeline_frames(path, ('CHAMPION_KILL',), FRAME_FIELDS.values())):
+        if speed is not None:
+            delay = started_at + frame_index * frame_interval / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        yield frame
+
+
+class OnlineAnomalyScorer:
+    # Scores the per-minute feature differences of one participant as the frames come in.
+    # Keeps running means and variances (Welford) so every frame costs the same, whatever the game length.
+    def __init__(self, participant_id: int, num_participants: int = 10, threshold: float = 3.0, warmup: int = 5,
+                 model=None):
+        self.participant_id = participant_id
+        self.threshold = threshold
+        self.warmup = warmup
+        # Optional pre-fitted model (eg. IsolationForest) on the MODEL_FEATURES differences, -1 marks an outlier
+        self.model = model
+        self.columns = [FEATURE_INDEX[name] for name in MODEL_FEATURES]
+        self.totals = np.zeros((num_participants, len(FEATURES)), dtype=np.int64)
+        self.previous: Optional[np.ndarray] = None
+        self.count = 0
+        self.mean = np.zeros(len(MODEL_FEATURES))
+        self.m2 = np.zeros(len(MODEL_FEATURES))
+
+    def update(self, frame: dict) -> Optional[dict]:
+        # Returns the score of the minute that ended with this frame, None for the first frame.
+        # Minute N is the difference between frame N and N + 1, like the rows of 03's feature matrix.
+        started_at = time.perf_counter()
+        row = np.zeros_like(self.totals)
+        extract_frame_features(frame, row)
+        row[:, EVENT_COLUMNS] += self.totals[:, EVENT_COLUMNS]
+        self.totals = row
+        current = row[self.participant_id - 1, self.columns].astype(float)
+
+        previous, self.previous = self.previous, current
+        if previous is None:
+            return None
+        diff = current - previous
+
+        z_scores = np.zeros(len(MODEL_FEATURES))
+        if self.count >= 2:
+            std = np.sqrt(self.m2 / (self.count - 1))
+            np.divide(diff - self.mean, std, out=z_scores, where=std > 0)
+        anomaly = self.count >= self.warmup and bool(np.any(np.abs(z_scores) > self.threshold))
+        if self.model is not None:
+            anomaly = anomaly or bool(self.model.predict(diff.reshape(1, -1))[0] == -1)
+
+        # The statistics are updated after scoring, so a minute is never compared against itself
+        minute = self.count
+        self.count += 1
+        delta = diff - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (diff - self.mean)
+
+        return {
+            'minute': minute,
+            'features': dict(zip(MODEL_FEATURES, diff.tolist())),
+            'z_scores': dict(zip(MODEL_FEATURES, z_scores.tolist())),
+            'anomaly': anomaly,
+            'latency_ms': (time.perf_counter() - started_at) * 1000,
+        }
+
+
+def score_frames(frames: Iterable[dict], participant_id: int, **scorer_options) -> Iterator[dict]:
+    scorer = OnlineAnomalyScorer(participant_id, **scorer_options)
+    for frame in frames:
+        score = scorer.update(frame)
+        if score is not None:
+            yield score
@@ -0,0 +1,145 @@
+import os
+from typing import Optional
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+from src.batch_runner import run_batch
+from src.instrumentation import metrics
+
+CS_TIMELINE = 'cs_timeline'
+FEATURE_ANOMALIES = 'feature_anomalies'
+
+# (label, title, color) of the panels of the feature anomaly chart, in the order of 03's feature matrix
+FEATURE_PANELS = [
+    ('CS', 'CS Over Time', 'blue'),
+    ('Gold', 'Gold Over Time', 'green'),
+    ('Kills', 'Kills Over Time', 'purple'),
+    ('Assists', 'Assists Over Time', 'orange'),
+    ('Deaths', 'Deaths Over Time', 'red'),
+    ('Damage Done', 'Damage Done Over Time', 'cyan'),
+    ('Damage Received', 'Damage Received Over Time', 'magenta'),
+]
+
+
+def _reset_axes(figure: Figure, rows: int, columns: int, used: int) -> list:
+    # The axes are created on the first call and only cleared afterwards, so a figure can be reused between matches
+    if not figure.axes:
+        axes = figure.subplots(rows, columns, squeeze=False).flatten()
+        for ax in axes[used:]:
+            figure.delaxes(ax)
+    for ax in figure.axes:
+        ax.cla()
+    return figure.axes
+
+
+def draw_cs_timeline(figure: Figure, cs_per_minute_array: np.ndarray, anomaly_minutes: np.ndarray,
+                     game_duration: float):
+    ax = _reset_axes(figure, 1, 1, 1)[0]
+    timestamps = np.arange(0, game_duration + 1, 1)  # Assuming intervals of 1 minute
+    zero = 0 * timestamps
+    range_9_10 = (9 * timestamps, 10 * timestamps)
+    range_7_9 = (7 * timestamps, 9 * timestamps)
+    max_cs_per_minute = 12.6 * timestamps
+
+    ax.plot(timestamps, cs_per_minute_array, marker='x', label='CS per minute')
+    ax.scatter(anomaly_minutes, cs_per_minute_array[anomaly_minutes], color='red', marker='o', label='Anomalies')
+    # Plot horizontal lines for different CS per minute ranges
+    ax.plot(timestamps, max_cs_per_minute, color='gray', linestyle='--', label='Max CS per minute (12.6)')
+
+    ax.fill_between(timestamps, zero, range_9_10[0], color='red', alpha=0.3, label='CS per minute (7-) BAD')
+    ax.fill_between(timestamps, range_7_9[0], range_7_9[1], color='yellow', alpha=0.3,
+                    label='CS per minute (7-9) OKAY')
+    ax.fill_between(timestamps, range_9_10[0], range_9_10[1], color='blue', alpha=0.3,
+                    label='CS per minute (9-10) GOOD')
+    ax.fill_between(timestamps, range_9_10[1], max_cs_per_minute, color='green', alpha=0.3,
+                    label='CS per minute (10+) EXCELLENT')
+
+    ax.set_xlabel('Time (minutes)')
+    ax.set_ylabel('CS per minute')
+    ax.set_title('CS per Minute and Anomalies Timeline')
+    ax.legend()
+    ax.grid(True)
+
+
+def draw_feature_anomalies(figure: Figure, minutes: np.ndarray, feature_matrix: np.ndarray,
+                           anomaly_rows: np.ndarray):
+    # feature_matrix holds the per-minute differences, one column per FEATURE_PANELS entry
+    axes = _reset_axes(figure, 4, 2, len(FEATURE_PANELS))
+    for column, (ax, (label, title, color)) in enumerate(zip(axes, FEATURE_PANELS)):
+        ax.plot(minutes, feature_matrix[:, column], label=label, color=color)
+        ax.plot(minutes[anomaly_rows], feature_matrix[anomaly_rows, column], 'ro', label='Anomalies')
+        ax.set_title(title)
+        ax.set_xlabel('Minute')
+        ax.set_ylabel('Value')
+        ax.legend()
+
+    # Adjust spacing between subplots
+    figure.tight_layout()
+
+
+CHARTS = {
+    CS_TIMELINE: (draw_cs_timeline, (6.4, 4.8)),
+    FEATURE_ANOMALIES: (draw_feature_anomalies, (14, 12)),
+}
+
+
+class ChartRenderer:
+    # Renders one chart type without a GUI, reusing the same figure for every match
+    def __init__(self, chart: str, output_dir: str, file_format: str = 'png', pdf_name: Optional[str] = None):
+        self.chart = chart
+        self.draw, figsize = CHARTS[chart]
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self.pdf = None
+        os.makedirs(output_dir, exist_ok=True)
+        if file_format == 'pdf':
+            self.pdf = PdfPages(os.path.join(output_dir, f'{pdf_name or chart}.pdf'))
+
+    @metrics.timed('plot_render')
+    def render(self, name: str, chart_data: dict):
+        self.draw(self.figure, **chart_data)
+        if self.pdf is not None:
+            self.figure.suptitle(name)
+            self.pdf.savefig(self.figure)
+        else:
+            self.figure.savefig(os.path.join(self.output_dir, f'{name}_{self.chart}.{self.file_format}'))
+
+    def close(self):
+        if self.pdf is not None:
+            self.pdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _render_task(task: tuple) -> int:
+    chart, output_dir, file_format, pdf_name, items = task
+    with ChartRenderer(chart, output_dir, file_format, pdf_name) as renderer:
+        for name, chart_data in items:
+            renderer.render(name, chart_data)
+    return len(items)
+
+
+@metrics.timed('render_charts')
+def render_charts(chart: str, items_by_summoner: dict[str, list[tuple[str, dict]]], output_dir: str,
+                  file_format: str = 'png', max_workers: Optional[int] = None, chunksize: int = 8) -> int:
+    # items are (name, chart data) pairs, every file of a summoner goes to <output_dir>/<summoner>/. PNG/SVG files
+    # are spread over the workers in chunks, a PDF is one multi-page <chart>.pdf per summoner, so each summoner is
+    # rendered by one worker.
+    tasks = []
+    for summoner_name, items in items_by_summoner.items():
+        summoner_dir = os.path.join(output_dir, os.path.basename(os.path.normpath(summoner_name)))
+        if file_format == 'pdf':
+            tasks.append((chart, summoner_dir, file_format, None, items))
+            continue
+        for start in range(0, len(items), chunksize):
+            tasks.append((chart, summoner_dir, file_format, None, items[start:start + chunksize]))
+    return sum(run_batch(_render_task, tasks, max_workers=max_workers))
@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import Optional
+
+
+def parse_rate_limit_header(header: Optional[str]) -> list[tuple[int, int]]:
+    # Riot sends limits as "count:seconds" pairs, eg. "20:1,100:120"
+    limits = []
+    if not header:
+        return limits
+    for part in header.split(','):
+        count, seconds = part.strip().split(':')
+        limits.append((int(count), int(seconds)))
+    return limits
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.capacity / self.period)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.period / self.capacity
+
+    def consume(self):
+        self.tokens -= 1
+
+    def sync(self, used: int):
+        # The server count is the source of truth, never hand out more than it allows
+        self.tokens = min(self.tokens, float(self.capacity - used))
+
+
+class RateLimiter:
+    def __init__(self, limits: str = ''):
+        self._lock = threading.Lock()
+        self.buckets: dict[int, TokenBucket] = {}
+        self.blocked_until = 0.0
+        self.set_limits(parse_rate_limit_header(limits))
+
+    def set_limits(self, limits: list[tuple[int, int]]):
+        with self._lock:
+            for count, seconds in limits:
+                bucket = self.buckets.get(seconds)
+                if bucket is None or bucket.capacity != count:
+                    self.buckets[seconds] = TokenBucket(count, seconds)
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(self.blocked_until - now, 0.0)
+                for bucket in self.buckets.values():
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time())
+                if wait <= 0:
+                    for bucket in self.buckets.values():
+                        bucket.consume()
+                    return
+            time.sleep(wait)
+
+    def update_from_headers(self, limit_header: Optional[str], count_header: Optional[str]):
+        limits = parse_rate_limit_header(limit_header)
+        if limits:
+            self.set_limits(limits)
+        with self._lock:
+            for used, seconds in parse_rate_limit_header(count_header):
+                if seconds in self.buckets:
+                    self.buckets[seconds].sync(used)
+
+    def block_for(self, seconds: float):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
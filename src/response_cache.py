@@ -0,0 +1,86 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class ResponseCache:
+    def __init__(self, path: str, max_bytes: int = 2 * 1024 ** 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, body TEXT NOT NULL, size INTEGER NOT NULL, '
+            'expires_at REAL, accessed_at REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._connection.commit()
+        self._total_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute('SELECT body, size, expires_at FROM responses WHERE key = ?',
+                                           (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            body, size, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._connection.commit()
+                self._total_bytes -= size
+                self.misses += 1
+                return None
+            self._connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self._connection.commit()
+            self.hits += 1
+        return json.loads(body)
+
+    def put(self, key: str, value, ttl: Optional[float] = None):
+        # ttl=None means the entry never expires, only LRU eviction can remove it
+        body = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        size = len(body.encode('utf-8'))
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            old = self._connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if old is not None:
+                self._total_bytes -= old[0]
+            self._connection.execute('INSERT OR REPLACE INTO responses (key, body, size, expires_at, accessed_at) '
+                                     'VALUES (?, ?, ?, ?, ?)', (key, body, size, expires_at, now))
+            self._total_bytes += size
+            self.__evict()
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': self._total_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM responses')
+            self._connection.commit()
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._connection.execute('SELECT key, size FROM responses ORDER BY accessed_at LIMIT 64').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._total_bytes -= size
@@ -1,7 +1,33 @@
+import time
 from collections import defaultdict
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Iterable, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from src.instrumentation import metrics
+from src.rate_limiter import RateLimiter
+from src.response_cache import ResponseCache
+
+
+def retry_after_seconds(header: Optional[str], now: Optional[datetime] = None) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date, None when it is missing or unreadable
+    if not header:
+        return None
+    try:
+        return max(float(header), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(header)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - (now or datetime.now(timezone.utc))).total_seconds(), 0.0)
 
 
 class RiotApiHelper:
@@ -10,49 +36,147 @@ class RiotApiHelper:
     match_url = 'https://europe.api.riotgames.com/lol/match/v5/matches/%s'
     match_timeline_url = 'https://europe.api.riotgames.com/lol/match/v5/matches/%s/timeline'
 
-    def __init__(self, riot_api_key: str):
+    # Development key limits, replaced by the X-App-Rate-Limit header after the first response
+    default_app_rate_limit = '20:1,100:120'
+    retry_status_codes = (429, 500, 502, 503, 504)
+
+    # Finished matches and timelines never change, so those responses are cached without a TTL
+    summoner_ttl = 24 * 60 * 60
+    match_list_ttl = 10 * 60
+
+    def __init__(self, riot_api_key: str, max_workers: int = 8, max_retries: int = 3, backoff_factor: float = 1.0,
+                 timeout: float = 10.0, response_cache: Optional[ResponseCache] = None):
         self.riot_api_key = riot_api_key
         self.headers = {
             'X-Riot-Token': riot_api_key
         }
-        self.cache = defaultdict(lambda: defaultdict(lambda: {'puuid': ''}))
+        self.cache: dict[str, dict] = {}
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.response_cache = response_cache
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
-    def get_puuid_for_summoner_name(self, summoner_name: str):
+        self.app_rate_limiter = RateLimiter(self.default_app_rate_limit)
+        self.method_rate_limiters: dict[str, RateLimiter] = defaultdict(RateLimiter)
+
+    def get_puuid_for_summoner_name(self, summoner_name: str) -> Optional[str]:
         if summoner_name not in self.cache:
             self.get_summoner_data_by_name(summoner_name)
 
-        return self.cache[summoner_name]['puuid']
+        return self.cache.get(summoner_name, {}).get('puuid')
 
     def get_summoner_data_by_name(self, summoner_name: str):
-        data = self.__handle_request(self.summoner_url % summoner_name)
-        self.cache[summoner_name]['puuid'] = data['puuid']
+        data = self.__cached_request(self.summoner_url % summoner_name, self.summoner_url, self.summoner_ttl)
+        if data is None:
+            return None
+        self.cache[summoner_name] = {'puuid': data['puuid']}
         return data
 
-    def get_match_list(self, summoner_name: Optional[str] = None, summoner_puuid: Optional[str] = None):
+    def get_summoners_by_names(self, summoner_names: Iterable[str]) -> dict[str, Optional[dict]]:
+        return self.__map_concurrently(self.get_summoner_data_by_name, summoner_names)
+
+    def get_match_list(self, summoner_name: Optional[str] = None, summoner_puuid: Optional[str] = None,
+                       start: int = 0, count: int = 20):
         if not summoner_name and not summoner_puuid:
             raise Exception("At least one of summoner_name OR summoner_puuid must be set")
 
-        puuid = summoner_puuid
-        if not summoner_puuid and summoner_name and summoner_name not in self.cache:
-            self.get_summoner_data_by_name(summoner_name)
-            puuid = self.cache[summoner_name]['puuid']
+        puuid = summoner_puuid or self.get_puuid_for_summoner_name(summoner_name)
+        if puuid is None:
+            return None
 
-        data = self.__handle_request(self.match_list_url % puuid)
+        url = f'{self.match_list_url % puuid}?start={start}&count={count}'
+        data = self.__cached_request(url, self.match_list_url, self.match_list_ttl)
         return data
 
     def get_match_by_id(self, match_id: str):
-        data = self.__handle_request(self.match_url % match_id)
+        data = self.__cached_request(self.match_url % match_id, self.match_url)
         return data
 
     def get_match_timeline_by_id(self, match_id: str):
-        data = self.__handle_request(self.match_timeline_url % match_id)
+        data = self.__cached_request(self.match_timeline_url % match_id, self.match_timeline_url)
         return data
 
-    def __handle_request(self, url: str) -> Optional[dict]:
-        try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print('Error getting summoner data:', e)
-            return None
+    def get_matches_by_ids(self, match_ids: Iterable[str]) -> dict[str, Optional[dict]]:
+        return self.__map_concurrently(self.get_match_by_id, match_ids)
+
+    def get_match_timelines_by_ids(self, match_ids: Iterable[str]) -> dict[str, Optional[dict]]:
+        return self.__map_concurrently(self.get_match_timeline_by_id, match_ids)
+
+    def __map_concurrently(self, fetch, keys: Iterable[str]) -> dict[str, Optional[dict]]:
+        keys = list(keys)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(fetch, keys)
+            return dict(zip(keys, results))
+
+    def __cached_request(self, url: str, method: str, ttl: Optional[float] = None):
+        if self.response_cache is None:
+            return self.__handle_request(url, method)
+
+        data = self.response_cache.get(url)
+        if data is not None:
+            metrics.increment('response_cache_hits')
+            return data
+        metrics.increment('response_cache_misses')
+        data = self.__handle_request(url, method)
+        if data is not None:
+            self.response_cache.put(url, data, ttl)
+        return data
+
+    def __handle_request(self, url: str, method: str) -> Optional[dict]:
+        method_rate_limiter = self.method_rate_limiters[method]
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if attempt > 0:
+                metrics.increment('api_retries')
+            with metrics.timer('api_rate_limit_wait'):
+                self.app_rate_limiter.acquire()
+                method_rate_limiter.acquire()
+            metrics.increment('api_requests')
+            try:
+                with metrics.timer('api_request'):
+                    response = self.session.get(url, headers=self.headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                if last_attempt:
+                    metrics.increment('api_errors')
+                    print('Error getting data:', e)
+                    return None
+                time.sleep(self.__backoff(attempt))
+                continue
+
+            self.app_rate_limiter.update_from_headers(response.headers.get('X-App-Rate-Limit'),
+                                                      response.headers.get('X-App-Rate-Limit-Count'))
+            method_rate_limiter.update_from_headers(response.headers.get('X-Method-Rate-Limit'),
+                                                    response.headers.get('X-Method-Rate-Limit-Count'))
+            metrics.increment('api_bytes_downloaded', len(response.content))
+            if response.status_code == 429:
+                metrics.increment('api_rate_limited')
+
+            if response.status_code in self.retry_status_codes and not last_attempt:
+                wait = retry_after_seconds(response.headers.get('Retry-After'))
+                if wait is None:
+                    wait = self.__backoff(attempt)
+                if response.status_code == 429 and response.headers.get('X-Rate-Limit-Type') == 'method':
+                    method_rate_limiter.block_for(wait)
+                elif response.status_code == 429:
+                    self.app_rate_limiter.block_for(wait)
+                else:
+                    time.sleep(wait)
+                continue
+
+            try:
+                response.raise_for_status()
+                return response.json()
+            except requests.exceptions.RequestException as e:
+                metrics.increment('api_errors')
+                print('Error getting data:', e)
+                return None
+        return None
+
+    def __backoff(self, attempt: int) -> float:
+        return self.backoff_factor * (2 ** attempt)
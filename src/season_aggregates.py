@@ -0,0 +1,218 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from src.match_summary import MatchSummary
+
+# Summed per match of the summoner, the rates are derived from these
+AGGREGATE_COLUMNS = ('games', 'wins', 'duration', 'cs', 'gold', 'kills', 'deaths', 'assists', 'damage')
+# Partial aggregates are kept per UTC day (for the last N days) and per block of games in chronological order
+# (for the last N games), so a windowed view sums a few buckets and at most one bucket worth of single matches
+DAY = 'day'
+BLOCK = 'block'
+BLOCK_SIZE = 16
+DAY_MS = 24 * 60 * 60 * 1000
+# Grouping of an aggregate: every match, per champion or per individualPosition
+ALL, CHAMPION, POSITION = 'all', 'champion', 'position'
+
+_SUMS = ', '.join(f'SUM({column})' for column in AGGREGATE_COLUMNS)
+
+
+def summary_row(summary: MatchSummary, player_index: int) -> dict:
+    player = summary.player(player_index)
+    return {
+        'games': 1,
+        'wins': int(player.win),
+        'duration': summary.game_duration,
+        'cs': player.total_minions_killed + player.neutral_minions_killed,
+        'gold': player.gold_earned,
+        'kills': player.kills,
+        'deaths': player.deaths,
+        'assists': player.assists,
+        'damage': player.damage_dealt_to_champions,
+    }
+
+
+def rates(totals: dict) -> dict:
+    # Adds the per minute rates, KDA and win rate to summed aggregates
+    minutes = totals['duration'] / 60
+    games = totals['games']
+    return {
+        **totals,
+        'cs_per_minute': totals['cs'] / minutes if minutes else 0.0,
+        'gold_per_minute': totals['gold'] / minutes if minutes else 0.0,
+        'damage_per_minute': totals['damage'] / minutes if minutes else 0.0,
+        'kda': (totals['kills'] + totals['assists']) / max(totals['deaths'], 1),
+        'win_rate': totals['wins'] / games if games else 0.0,
+    }
+
+
+class SeasonAggregates:
+    # Running sums per summoner, overall and per champion and position, kept in SQLite. Every folded match is
+    # recorded, so update only decodes the matches a sync added, and only their match summaries.
+    def __init__(self, path: str = '.season_aggregates.sqlite'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        columns = ', '.join(f'{column} INTEGER NOT NULL' for column in AGGREGATE_COLUMNS)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS matches ('
+            'summoner TEXT NOT NULL, match_id TEXT NOT NULL, sequence INTEGER NOT NULL, '
+            f'game_creation INTEGER NOT NULL, champion TEXT, position TEXT, {columns}, '
+            'PRIMARY KEY (summoner, match_id))'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS matches_sequence ON matches (summoner, sequence)'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS buckets ('
+            'summoner TEXT NOT NULL, kind TEXT NOT NULL, bucket INTEGER NOT NULL, grouping TEXT NOT NULL, '
+            f'grp TEXT NOT NULL, {columns}, PRIMARY KEY (summoner, kind, bucket, grouping, grp))'
+        )
+        self._connection.commit()
+
+    def folded_match_ids(self, summoner_name: str) -> set[str]:
+        with self._lock:
+            return {match_id for match_id, in self._connection.execute(
+                'SELECT match_id FROM matches WHERE summoner = ?', (summoner_name,))}
+
+    def update(self, data_handler, summoner_name: str) -> int:
+        # Folds in the stored matches of the summoner that are not folded yet, returns how many
+        folded = self.folded_match_ids(summoner_name)
+        new_match_ids = [match_id for match_id in data_handler.list_match_ids(summoner_name)
+                         if match_id not in folded]
+        summaries = []
+        for match_id in new_match_ids:
+            summary = data_handler.load_summary(summoner_name, match_id)
+            summaries.append((summary, data_handler.find_player_index_in_summary(summary, summoner_name)))
+        self.fold(summoner_name, summaries)
+        return len(summaries)
+
+    def fold(self, summoner_name: str, summaries: list[tuple[MatchSummary, int]]):
+        # (summary, player index) pairs of matches that are not folded yet
+        if not summaries:
+            return
+        summaries = sorted(summaries, key=lambda item: item[0].game_creation)
+        with self._lock:
+            count, last_creation = self._connection.execute(
+                'SELECT COUNT(*), MAX(game_creation) FROM matches WHERE summoner = ?', (summoner_name,)).fetchone()
+            # Games older than the newest folded one shift the sequence of the later games, the block buckets
+            # are then rebuilt from the match rows, without decoding any match again
+            backfill = last_creation is not None and summaries[0][0].game_creation < last_creation
+            for sequence, (summary, player_index) in enumerate(summaries, start=count):
+                row = summary_row(summary, player_index)
+                player = summary.player(player_index)
+                groups = [(ALL, ''), (CHAMPION, player.champion or ''), (POSITION, player.individual_position or '')]
+                self._connection.execute(
+                    f"INSERT INTO matches (summoner, match_id, sequence, game_creation, champion, position, "
+                    f"{', '.join(AGGREGATE_COLUMNS)}) VALUES ({', '.join('?' * (6 + len(AGGREGATE_COLUMNS)))})",
+                    (summoner_name, summary.match_id, sequence, summary.game_creation, player.champion,
+                     player.individual_position, *(row[column] for column in AGGREGATE_COLUMNS)))
+                for grouping, group in groups:
+                    self.__add_to_bucket(summoner_name, DAY, summary.game_creation // DAY_MS, grouping, group, row)
+                # Block buckets only exist for the whole history, the last N games of one champion are summed
+                # from the match rows
+                if not backfill:
+                    self.__add_to_bucket(summoner_name, BLOCK, sequence // BLOCK_SIZE, ALL, '', row)
+            if backfill:
+                self.__rebuild_blocks(summoner_name)
+            self._connection.commit()
+
+    def totals(self, summoner_name: str, champion: Optional[str] = None, position: Optional[str] = None,
+               last_games: Optional[int] = None, last_days: Optional[int] = None,
+               now: Optional[float] = None) -> dict:
+        # Summed aggregates and rates of the summoner, optionally for one champion or position and for the last
+        # N games or days. now (seconds) defaults to the current time.
+        if champion is not None and position is not None:
+            raise Exception("Pass either a champion or a position, aggregates are not kept per both")
+        grouping, group = ALL, ''
+        if champion is not None:
+            grouping, group = CHAMPION, champion
+        elif position is not None:
+            grouping, group = POSITION, position
+        with self._lock:
+            if last_games is not None:
+                sums = self.__last_games(summoner_name, grouping, group, last_games)
+            elif last_days is not None:
+                since = int(((now if now is not None else time.time()) * 1000)) - last_days * DAY_MS
+                sums = self.__since(summoner_name, grouping, group, since)
+            else:
+                sums = self._connection.execute(
+                    f'SELECT {_SUMS} FROM buckets WHERE summoner = ? AND kind = ? AND grouping = ? AND grp = ?',
+                    (summoner_name, DAY, grouping, group)).fetchone()
+        return rates({column: value or 0 for column, value in zip(AGGREGATE_COLUMNS, sums)})
+
+    def breakdown(self, summoner_name: str, grouping: str = CHAMPION, last_days: Optional[int] = None,
+                  now: Optional[float] = None) -> dict[str, dict]:
+        # group (champion or position) -> aggregates and rates, most played first
+        options = {CHAMPION: 'champion', POSITION: 'position'}
+        if grouping not in options:
+            raise Exception(f"Unknown grouping {grouping}, use '{CHAMPION}' or '{POSITION}'")
+        with self._lock:
+            groups = [group for group, in self._connection.execute(
+                'SELECT DISTINCT grp FROM buckets WHERE summoner = ? AND kind = ? AND grouping = ?',
+                (summoner_name, DAY, grouping))]
+        result = {group: self.totals(summoner_name, last_days=last_days, now=now, **{options[grouping]: group})
+                  for group in groups}
+        result = {group: totals for group, totals in result.items() if totals['games']}
+        return dict(sorted(result.items(), key=lambda item: item[1]['games'], reverse=True))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __last_games(self, summoner_name: str, grouping: str, group: str, last_games: int) -> tuple:
+        if grouping != ALL:
+            column = 'champion' if grouping == CHAMPION else 'position'
+            return self._connection.execute(
+                f'SELECT {_SUMS} FROM (SELECT * FROM matches WHERE summoner = ? AND {column} = ? '
+                'ORDER BY sequence DESC LIMIT ?)', (summoner_name, group, last_games)).fetchone()
+        count, = self._connection.execute('SELECT COUNT(*) FROM matches WHERE summoner = ?',
+                                          (summoner_name,)).fetchone()
+        first = max(count - last_games, 0)
+        # Whole blocks from the first block boundary at or after the first game, the games before it one by one
+        first_block = -(-first // BLOCK_SIZE)
+        blocks = self._connection.execute(
+            f'SELECT {_SUMS} FROM buckets WHERE summoner = ? AND kind = ? AND bucket >= ? AND grouping = ?',
+            (summoner_name, BLOCK, first_block, ALL)).fetchone()
+        games = self._connection.execute(
+            f'SELECT {_SUMS} FROM matches WHERE summoner = ? AND sequence >= ? AND sequence < ?',
+            (summoner_name, first, first_block * BLOCK_SIZE)).fetchone()
+        return tuple((left or 0) + (right or 0) for left, right in zip(blocks, games))
+
+    def __since(self, summoner_name: str, grouping: str, group: str, since: int) -> tuple:
+        # Whole days after the day of `since`, the games of that day one by one
+        first_day = since // DAY_MS + 1
+        days = self._connection.execute(
+            f'SELECT {_SUMS} FROM buckets WHERE summoner = ? AND kind = ? AND bucket >= ? AND grouping = ? '
+            'AND grp = ?', (summoner_name, DAY, first_day, grouping, group)).fetchone()
+        group_filter = {ALL: '', CHAMPION: 'AND champion = ?', POSITION: 'AND position = ?'}[grouping]
+        parameters = (summoner_name, since, first_day * DAY_MS) + ((group,) if grouping != ALL else ())
+        games = self._connection.execute(
+            f'SELECT {_SUMS} FROM matches WHERE summoner = ? AND game_creation >= ? AND game_creation < ? '
+            f'{group_filter}', parameters).fetchone()
+        return tuple((left or 0) + (right or 0) for left, right in zip(days, games))
+
+    def __add_to_bucket(self, summoner_name: str, kind: str, bucket: int, grouping: str, group: str, row: dict):
+        self._connection.execute(
+            f"INSERT INTO buckets (summoner, kind, bucket, grouping, grp, {', '.join(AGGREGATE_COLUMNS)}) "
+            f"VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(AGGREGATE_COLUMNS))}) "
+            "ON CONFLICT (summoner, kind, bucket, grouping, grp) DO UPDATE SET "
+            + ', '.join(f'{column} = {column} + excluded.{column}' for column in AGGREGATE_COLUMNS),
+            (summoner_name, kind, bucket, grouping, group, *(row[column] for column in AGGREGATE_COLUMNS)))
+
+    def __rebuild_blocks(self, summoner_name: str):
+        rows = self._connection.execute(
+            'SELECT match_id FROM matches WHERE summoner = ? ORDER BY game_creation, match_id',
+            (summoner_name,)).fetchall()
+        self._connection.executemany('UPDATE matches SET sequence = ? WHERE summoner = ? AND match_id = ?',
+                                     [(sequence, summoner_name, match_id)
+                                      for sequence, (match_id,) in enumerate(rows)])
+        self._connection.execute('DELETE FROM buckets WHERE summoner = ? AND kind = ?', (summoner_name, BLOCK))
+        self._connection.execute(
+            f"INSERT INTO buckets (summoner, kind, bucket, grouping, grp, {', '.join(AGGREGATE_COLUMNS)}) "
+            f"SELECT summoner, ?, sequence / {BLOCK_SIZE}, ?, '', {_SUMS} FROM matches "
+            f"WHERE summoner = ? GROUP BY sequence / {BLOCK_SIZE}", (BLOCK, ALL, summoner_name))
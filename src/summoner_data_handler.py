@@ -1,129 +1,315 @@
 import json
 import os
-from collections import defaultdict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
 
-from src.riot_api import RiotApiHelper
+from src.helpers import atomic_write_json
+from src.identity_registry import IdentityRegistry
+from src.instrumentation import metrics
+from src.lru_cache import LruCache
+from src.match_manifest import MatchManifest
+from src.match_store import MATCH, TIMELINE, JsonFileMatchStore, MatchStore, list_match_ids, list_stored_match_ids
+from src.match_summary import MatchSummary
+from src.sync_journal import SyncJournal
+
+if TYPE_CHECKING:
+    # Only for the annotations, requests is slow to import and reading stored matches never needs it
+    from src.riot_api import RiotApiHelper
+
+
+# Bytes of Python objects (dicts, lists, strings, ints) per byte of minified JSON once decoded, measured with a
+# recursive sys.getsizeof on the bundled matches: ~2.15 for match data, ~2.9 for the number heavy timelines
+DECODED_OVERHEAD = {'match': 2.2, 'timeline': 2.9}
+
+
+def decoded_size(data: dict) -> int:
+    # Estimated memory of a decoded {'match': ..., 'timeline': ...} pair
+    return sum(int(len(json.dumps(data[kind], ensure_ascii=False, separators=(',', ':'))) * overhead)
+               for kind, overhead in DECODED_OVERHEAD.items())
 
 
 class SummonerDataHandler:
-    def __init__(self, riot_api_helper: RiotApiHelper):
+    def __init__(self, riot_api_helper: Optional['RiotApiHelper'], match_store: Optional[MatchStore] = None,
+                 cache_max_entries: Optional[int] = 16, cache_max_bytes: Optional[int] = None, prefetch: int = 4,
+                 decode_workers: int = 2, identity_registry: Optional[IdentityRegistry] = None):
         self.riot_api_helper = riot_api_helper
-        self.cache = defaultdict(lambda: defaultdict(lambda: {'match': {}, 'timeline': {}}))
-        self.summoner_cache = defaultdict(lambda: defaultdict(lambda: {}))
+        self.match_store = match_store if match_store is not None else JsonFileMatchStore()
+        # Decoded matches keyed by (summoner_name, match_id). cache_max_bytes budgets the estimated memory of the
+        # decoded dicts (see decoded_size), which is two to three times the minified JSON and unrelated to the size
+        # of the stored, possibly compressed, files.
+        self.cache = LruCache(max_entries=cache_max_entries, max_bytes=cache_max_bytes)
+        self.prefetch = prefetch
+        self.decode_workers = decode_workers
+        self.identities = identity_registry if identity_registry is not None else IdentityRegistry()
+        self.manifests: dict[str, MatchManifest] = {}
+        # Summaries are about 2.3 KB per match, all of them are kept
+        self.summaries: dict[tuple[str, str], MatchSummary] = {}
 
     def save_match_data_for_summoner(self, save_dir: str, summoner_name: str, num_matches: int = 5,
                                      force: bool = False):
         # We are getting CLASSIC games only!
 
-        os.makedirs(save_dir, exist_ok=True)
-        summoner_data = self.riot_api_helper.get_summoner_data_by_name(summoner_name)
-        with open(os.path.join(save_dir, f'{summoner_name}.json'), 'w', encoding='utf-8') as file:
-            json.dump(summoner_data, file, ensure_ascii=False, indent=4)
-            self.summoner_cache[summoner_name] = summoner_data
-        puuid = summoner_data['puuid']
+        puuid = self.__save_summoner_data(save_dir, summoner_name)
+        if puuid is None:
+            return
 
         match_list = self.riot_api_helper.get_match_list(summoner_puuid=puuid)
+        if match_list is None:
+            print(f'Could not get the match list of {summoner_name}')
+            return
+
+        # Stored matches only count towards num_matches, they are not read; iterator_on_data loads them when needed
+        stored_match_ids = set() if force else list_stored_match_ids(save_dir)
         downloaded_matches = 0
-        for match_id in match_list:
-            if downloaded_matches == num_matches:
+        position = 0
+        while downloaded_matches < num_matches and position < len(match_list):
+            # Fetch just enough matches to fill the remaining slots, the non-CLASSIC ones are dropped afterwards
+            batch = match_list[position:position + num_matches - downloaded_matches]
+            position += len(batch)
+
+            to_download = []
+            for match_id in batch:
+                if match_id in stored_match_ids:
+                    downloaded_matches += 1
+                else:
+                    to_download.append(match_id)
+
+            saved, _ = self.__download_matches(save_dir, summoner_name, to_download)
+            downloaded_matches += len(saved)
+
+    def sync_match_data_for_summoner(self, save_dir: str, summoner_name: str, max_matches: Optional[int] = None,
+                                     page_size: int = 100):
+        # Incremental sync: walk the match history from the newest game until an already known match is found,
+        # then download everything new. The journal keeps the work list, so an interrupted run resumes from it.
+        puuid = self.__save_summoner_data(save_dir, summoner_name)
+        if puuid is None:
+            return
+
+        journal = SyncJournal(save_dir)
+        new_match_ids = []
+        start = 0
+        while max_matches is None or len(new_match_ids) < max_matches:
+            count = page_size if max_matches is None else min(page_size, max_matches - len(new_match_ids))
+            page = self.riot_api_helper.get_match_list(summoner_puuid=puuid, start=start, count=count)
+            if page is None:
+                print(f'Could not get the match list of {summoner_name} from {start}')
                 break
 
-            match_data = self.riot_api_helper.get_match_by_id(match_id)
-            if match_data['info']['gameMode'] != 'CLASSIC':
+            reached_known_match = False
+            for match_id in page:
+                if match_id in journal.skipped or self.__is_match_stored(save_dir, match_id):
+                    reached_known_match = True
+                    break
+                new_match_ids.append(match_id)
+            if reached_known_match or len(page) < count:
+                break
+            start += len(page)
+
+        journal.add_pending(new_match_ids)
+
+        batch_size = self.riot_api_helper.max_workers
+        while journal.pending:
+            batch = journal.pending[:batch_size]
+            saved, skipped = self.__download_matches(save_dir, summoner_name, batch)
+            journal.mark_done(saved)
+            journal.mark_done(skipped, skipped=True)
+            if not saved and not skipped:
+                print(f'Sync of {summoner_name} stopped, {len(journal.pending)} matches left in the journal')
+                break
+
+    def __save_summoner_data(self, save_dir: str, summoner_name: str) -> Optional[str]:
+        os.makedirs(save_dir, exist_ok=True)
+        summoner_data = self.riot_api_helper.get_summoner_data_by_name(summoner_name)
+        if summoner_data is None:
+            print(f'Could not get the summoner data of {summoner_name}')
+            return None
+        atomic_write_json(os.path.join(save_dir, f'{summoner_name}.json'), summoner_data)
+        self.identities.record_summoner(summoner_data, alias=summoner_name)
+        return summoner_data['puuid']
+
+    def __download_matches(self, save_dir: str, summoner_name: str, match_ids: list[str]):
+        # Returns the saved CLASSIC match ids and the ids of the other game modes
+        matches = self.riot_api_helper.get_matches_by_ids(match_ids)
+        classic_match_ids = []
+        skipped_match_ids = []
+        for match_id, match_data in matches.items():
+            if match_data is None:
+                print(f'Skipping match {match_id}, could not download it')
+            elif match_data['info']['gameMode'] == 'CLASSIC':
+                classic_match_ids.append(match_id)
+            else:
+                skipped_match_ids.append(match_id)
+
+        saved_match_ids = []
+        timelines = self.riot_api_helper.get_match_timelines_by_ids(classic_match_ids)
+        for match_id in classic_match_ids:
+            match_data = matches[match_id]
+            match_timeline_data = timelines[match_id]
+            if match_timeline_data is None:
+                print(f'Skipping match {match_id}, could not download its timeline')
                 continue
-            match_data_filename = os.path.join(save_dir, f'match_{match_id}.json')
-            if force or not os.path.exists(match_data_filename):
-                with open(match_data_filename, 'w', encoding='utf-8') as file:
-                    json.dump(match_data, file, ensure_ascii=False, indent=4)
-
-            match_timeline_data = self.riot_api_helper.get_match_timeline_by_id(match_id)
-            match_timeline_data_filename = os.path.join(save_dir, f'match_{match_id}_timeline.json')
-            if force or not os.path.exists(match_timeline_data_filename):
-                with open(match_timeline_data_filename, 'w', encoding='utf-8') as file:
-                    json.dump(match_timeline_data, file, ensure_ascii=False, indent=4)
-
-            self.cache[summoner_name][match_id] = {
+
+            self.match_store.save(save_dir, match_id, MATCH, match_data)
+            self.match_store.save(save_dir, match_id, TIMELINE, match_timeline_data)
+            self.manifest(save_dir).record(match_id, match_data, self.identities.puuid(summoner_name))
+            self.identities.record_match(match_data)
+
+            data = {
                 'match': match_data,
                 'timeline': match_timeline_data
             }
-            downloaded_matches += 1
+            self.cache.put((summoner_name, match_id), data, self.__cache_size(data))
+            saved_match_ids.append(match_id)
+        return saved_match_ids, skipped_match_ids
 
-    def iterator_on_match_data(self, summoner_name: str):
-        if not os.path.exists(summoner_name):
-            self.save_match_data_for_summoner(summoner_name, summoner_name)
-        elif os.path.exists(summoner_name) and summoner_name not in self.cache:
-            self.__load_match_data_from_directory(summoner_name)
-        for match_id, data in self.cache[summoner_name].items():
+    def __is_match_stored(self, save_dir: str, match_id: str) -> bool:
+        return self.match_store.has_match(save_dir, match_id)
+
+    def __load_match_from_directory(self, save_dir: str, match_id: str) -> dict:
+        return {
+            'match': self.match_store.load(save_dir, match_id, MATCH),
+            'timeline': self.match_store.load(save_dir, match_id, TIMELINE)
+        }
+
+    def iterator_on_match_data(self, summoner_name: str, **filters):
+        for data in self.iterator_on_data(summoner_name, **filters):
             yield data['match']
 
-    def iterator_on_match_timeline_data(self, summoner_name: str):
+    def iterator_on_match_timeline_data(self, summoner_name: str, **filters):
+        for data in self.iterator_on_data(summoner_name, **filters):
+            yield data['timeline']
+
+    def iterator_on_data(self, summoner_name: str, **filters):
+        # filters are the ones of MatchManifest.entries, eg. game_mode='CLASSIC', champion='Jinx', limit=20;
+        # the matches that do not pass them are never read
         if not os.path.exists(summoner_name):
             self.save_match_data_for_summoner(summoner_name, summoner_name)
-        elif os.path.exists(summoner_name) and summoner_name not in self.cache:
-            self.__load_match_data_from_directory(summoner_name)
+        if not os.path.isdir(summoner_name):
+            return
 
-        for match_id, data in self.cache[summoner_name].items():
-            yield data['timeline']
+        # Matches are decoded lazily in a small thread pool, at most `prefetch` of them ahead of the consumer
+        match_ids = iter(self.list_match_ids(summoner_name, **filters))
+        executor = ThreadPoolExecutor(max_workers=self.decode_workers)
+        pending = deque()
+        try:
+            for match_id in match_ids:
+                pending.append((match_id, executor.submit(self.__get_match, summoner_name, match_id)))
+                if len(pending) >= self.prefetch:
+                    break
+            while pending:
+                match_id, future = pending.popleft()
+                next_match_id = next(match_ids, None)
+                if next_match_id is not None:
+                    pending.append((next_match_id, executor.submit(self.__get_match, summoner_name, next_match_id)))
+                try:
+                    data = future.result()
+                except Exception as e:
+                    print(f"Error loading match {match_id} from {summoner_name}: {e}")
+                    continue
+                yield data
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-    def iterator_on_data(self, summoner_name: str):
+    def iterator_on_summaries(self, summoner_name: str, **filters):
+        # Like iterator_on_match_data, but yields compact MatchSummary objects; timelines are never read
         if not os.path.exists(summoner_name):
             self.save_match_data_for_summoner(summoner_name, summoner_name)
-        elif os.path.exists(summoner_name) and summoner_name not in self.cache:
-            self.__load_match_data_from_directory(summoner_name)
-
-        for match_id, data in self.cache[summoner_name].items():
-            yield data
-
-    def find_player_index_in_data(self, match_data: dict, summoner_name: str):
-        if summoner_name in self.summoner_cache:
-            puuid = self.summoner_cache[summoner_name]['puuid']
-        elif summoner_name not in self.summoner_cache and os.path.exists(summoner_name):
-            data = self.__load_player_data_from_directory(summoner_name)
-            puuid = data['puuid']
-        else:
-            puuid = self.riot_api_helper.get_puuid_for_summoner_name(summoner_name)
-        return match_data['metadata']['participants'].index(puuid)
+        for match_id in self.list_match_ids(summoner_name, **filters):
+            try:
+                summary = self.load_summary(summoner_name, match_id)
+            except Exception as e:
+                print(f"Error loading match {match_id} from {summoner_name}: {e}")
+                continue
+            yield summary
 
-    def __load_player_data_from_directory(self, summoner_name: str):
-        with open(os.path.join(summoner_name, f'{summoner_name}.json'), 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            self.summoner_cache[summoner_name] = data
-        return data
+    def load_summary(self, summoner_name: str, match_id: str) -> MatchSummary:
+        key = (summoner_name, match_id)
+        summary = self.summaries.get(key)
+        if summary is None:
+            # A match still in the LRU cache is summarized from there, otherwise only its match file is decoded
+            data = self.cache.get(key)
+            match_data = data['match'] if data is not None else self.match_store.load(summoner_name, match_id, MATCH)
+            self.identities.record_match(match_data)
+            summary = MatchSummary.from_match(match_data, lambda: self.match_store.load(summoner_name, match_id,
+                                                                                        MATCH))
+            self.summaries[key] = summary
+        return summary
 
-    def __load_match_data_from_directory(self, summoner_name: str):
-        # Check if it's a directory
+    def list_match_ids(self, summoner_name: str, **filters) -> list[str]:
+        if not os.path.isdir(summoner_name):
+            return []
+        if not filters:
+            return list_match_ids(summoner_name)
+        return [entry['match_id'] for entry in self.list_matches(summoner_name, **filters)]
+
+    def list_matches(self, summoner_name: str, **filters) -> list[dict]:
+        # Manifest entries (game mode, creation, duration, queue, player index, champion, position and file names)
+        # of the stored matches, see MatchManifest.entries for the filters
+        if not os.path.isdir(summoner_name):
+            return []
+        manifest = self.manifest(summoner_name)
+        manifest.refresh()
+        return manifest.entries(**filters)
+
+    def manifest(self, save_dir: str) -> MatchManifest:
+        if save_dir not in self.manifests:
+            self.manifests[save_dir] = MatchManifest(save_dir)
+        return self.manifests[save_dir]
+
+    def load_match(self, summoner_name: str, match_id: str) -> dict:
+        return self.__get_match(summoner_name, match_id)
+
+    def find_player_index_in_data(self, match_data: dict, summoner_name: str) -> int:
+        # match_data is the match or the timeline data. Once the summoner and the match are in the identity
+        # registry this is two dict lookups; the summoner file or the API are only used for unknown summoners.
+        puuid = self.identities.puuid(summoner_name)
+        if puuid is None:
+            puuid = self.__resolve_puuid(summoner_name)
+        self.identities.record_match(match_data)
+        match_id = match_data['metadata']['matchId']
+        player_index = self.identities.participant_index(match_id, puuid)
+        if player_index is None:
+            raise Exception(f'{summoner_name} did not play in match {match_id}')
+        return player_index
+
+    def find_player_index_in_summary(self, summary: MatchSummary, summoner_name: str) -> int:
+        puuid = self.identities.puuid(summoner_name)
+        if puuid is None:
+            puuid = self.__resolve_puuid(summoner_name)
+        player_index = summary.player_index(puuid)
+        if player_index is None:
+            raise Exception(f'{summoner_name} did not play in match {summary.match_id}')
+        return player_index
+
+    def __resolve_puuid(self, summoner_name: str) -> str:
         if os.path.isdir(summoner_name):
-            # Initialize match and timeline dictionaries
-            match_data = {}
-            timeline_data = {}
+            summoner_data = self.__load_player_data_from_directory(summoner_name)
+        else:
+            summoner_data = self.riot_api_helper.get_summoner_data_by_name(summoner_name)
+        if summoner_data is None:
+            raise Exception(f'Could not resolve the summoner {summoner_name}')
+        self.identities.record_summoner(summoner_data, alias=summoner_name)
+        return summoner_data['puuid']
 
-            # Iterate over files in the subdirectory
-            for filename in os.listdir(summoner_name):
-                if filename == f'{summoner_name}.json':
-                    continue
-                match_id = filename.replace("match_", "").replace("_timeline", "").replace(".json", "")
-                file_path = os.path.join(summoner_name, filename)
-
-                # Check if it's a JSON file not ending with "_timeline"
-                if filename.endswith(".json") and not filename.endswith("_timeline.json"):
-                    try:
-                        # Load the JSON content into match_data
-                        with open(file_path, 'r', encoding='utf-8') as file:
-                            match_data[match_id] = json.load(file)
-                    except Exception as e:
-                        print(f"Error loading match data from {file_path}: {e}")
-
-                # Check if it's a JSON file ending with "_timeline.json"
-                elif filename.endswith("_timeline.json"):
-                    try:
-                        # Load the JSON content into timeline_data
-                        with open(file_path, 'r', encoding='utf-8') as file:
-                            timeline_data[match_id] = json.load(file)
-                    except Exception as e:
-                        print(f"Error loading timeline data from {file_path}: {e}")
-
-            for filename in match_data.keys():
-                self.cache[summoner_name][filename] = {
-                    "match": match_data[filename],
-                    "timeline": timeline_data[filename]
-                }
+    def __load_player_data_from_directory(self, summoner_name: str) -> dict:
+        # The summoner file is named after the directory, which may also be given as a path
+        player_file_name = f'{os.path.basename(os.path.normpath(summoner_name))}.json'
+        with open(os.path.join(summoner_name, player_file_name), 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def __get_match(self, summoner_name: str, match_id: str) -> dict:
+        key = (summoner_name, match_id)
+        data = self.cache.get(key)
+        metrics.increment('match_cache_misses' if data is None else 'match_cache_hits')
+        if data is None:
+            data = self.__load_match_from_directory(summoner_name, match_id)
+            self.identities.record_match(data['match'])
+            self.cache.put(key, data, self.__cache_size(data))
+        return data
+
+    def __cache_size(self, data: dict) -> int:
+        # Estimating costs a serialization of the match, skipped when the cache has no byte budget
+        if self.cache.max_bytes is None:
+            return 0
+        return decoded_size(data)
@@ -0,0 +1,44 @@
+import json
+import os
+
+from src.helpers import atomic_write_json
+
+
+class SyncJournal:
+    filename = '.sync_journal.json'
+
+    def __init__(self, save_dir: str):
+        self.path = os.path.join(save_dir, self.filename)
+        self.pending: list[str] = []
+        self.skipped: set[str] = set()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except ValueError as e:
+            print(f'Ignoring broken sync journal {self.path}: {e}')
+            return
+        self.pending = data.get('pending', [])
+        self.skipped = set(data.get('skipped', []))
+
+    def save(self):
+        atomic_write_json(self.path, {
+            'pending': self.pending,
+            'skipped': sorted(self.skipped),
+        }, indent=None)
+
+    def add_pending(self, match_ids: list[str]):
+        known = set(self.pending)
+        self.pending.extend(match_id for match_id in match_ids if match_id not in known)
+        self.save()
+
+    def mark_done(self, match_ids: list[str], skipped: bool = False):
+        done = set(match_ids)
+        self.pending = [match_id for match_id in self.pending if match_id not in done]
+        if skipped:
+            self.skipped.update(done)
+        self.save()
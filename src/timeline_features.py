@@ -0,0 +1,89 @@
+import numpy as np
+
+from src.instrumentation import metrics
+from src.timeline_reader import read_timeline
+
+# Bump when the extraction logic changes, stored features built by an older version get rebuilt
+EXTRACTOR_VERSION = 1
+
+FEATURES = ('cs', 'jungle_cs', 'gold', 'xp', 'level', 'kills', 'deaths', 'assists', 'damage_done',
+            'damage_received')
+FEATURE_INDEX = {name: index for index, name in enumerate(FEATURES)}
+# Per-minute differences of these features are the input of the weak minute model and the online anomaly scorer
+MODEL_FEATURES = ('cs', 'gold', 'kills', 'assists', 'deaths', 'damage_done', 'damage_received')
+
+# Features read straight from participantFrames, the rest are accumulated from CHAMPION_KILL events
+FRAME_FIELDS = {
+    'cs': 'minionsKilled',
+    'jungle_cs': 'jungleMinionsKilled',
+    'gold': 'totalGold',
+    'xp': 'xp',
+    'level': 'level',
+}
+
+
+def _damage(damage_event: dict) -> int:
+    return damage_event['magicDamage'] + damage_event['physicalDamage'] + damage_event['trueDamage']
+
+
+_FRAME_COLUMNS = [(FEATURE_INDEX[name], field) for name, field in FRAME_FIELDS.items()]
+EVENT_COLUMNS = [FEATURE_INDEX[name] for name in ('kills', 'deaths', 'assists', 'damage_done', 'damage_received')]
+
+
+def extract_frame_features(frame: dict, row: np.ndarray):
+    # Fills a (participants, features) row from one frame. The event columns get the counts of this frame only,
+    # the caller turns them into running totals.
+    kills, deaths, assists = FEATURE_INDEX['kills'], FEATURE_INDEX['deaths'], FEATURE_INDEX['assists']
+    damage_done, damage_received = FEATURE_INDEX['damage_done'], FEATURE_INDEX['damage_received']
+
+    for participant_id, participant_frame in frame['participantFrames'].items():
+        participant = int(participant_id) - 1
+        for column, field in _FRAME_COLUMNS:
+            row[participant, column] = participant_frame[field]
+
+    for event in frame['events']:
+        if event['type'] != 'CHAMPION_KILL':
+            continue
+        killer_id = event['killerId']
+        victim_id = event['victimId']
+        assisting_ids = event.get('assistingParticipantIds', [])
+        if killer_id > 0:
+            row[killer_id - 1, kills] += 1
+        row[victim_id - 1, deaths] += 1
+        for assisting_id in assisting_ids:
+            row[assisting_id - 1, assists] += 1
+
+        # Damage done only counts for the players credited with the kill
+        credited = {killer_id, *assisting_ids}
+        for damage_event in event.get('victimDamageDealt', []):
+            if damage_event['participantId'] in credited and damage_event['participantId'] > 0:
+                row[damage_event['participantId'] - 1, damage_done] += _damage(damage_event)
+        received = sum(_damage(damage_event) for damage_event in event.get('victimDamageReceived', []))
+        row[victim_id - 1, damage_received] += received
+
+
+def extract_participant_features(match_data_timeline: dict) -> np.ndarray:
+    # Returns a (frames, participants, features) array, participant id N lives at index N - 1
+    frames = match_data_timeline['info']['frames']
+    num_participants = len(match_data_timeline['metadata']['participants'])
+    features = np.zeros((len(frames), num_participants, len(FEATURES)), dtype=np.int64)
+
+    with metrics.timer('feature_extraction'):
+        for frame_index, frame in enumerate(frames):
+            extract_frame_features(frame, features[frame_index])
+    metrics.increment('frames_processed', len(frames))
+    metrics.increment('events_processed', sum(len(frame['events']) for frame in frames))
+
+    # Event counts are per frame so far, the series are running totals like the frame fields
+    features[:, :, EVENT_COLUMNS] = np.cumsum(features[:, :, EVENT_COLUMNS], axis=0)
+    return features
+
+
+def participant_series(match_data_timeline: dict, participant_id: int, names=FEATURES) -> tuple:
+    features = extract_participant_features(match_data_timeline)[:, participant_id - 1]
+    return tuple(features[:, FEATURE_INDEX[name]] for name in names)
+
+
+def extract_participant_features_from_file(path: str) -> np.ndarray:
+    # Same as extract_participant_features, but only decodes the parts of the timeline file it needs
+    return extract_participant_features(read_timeline(path, ('CHAMPION_KILL',), FRAME_FIELDS.values()))
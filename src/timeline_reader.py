@@ -0,0 +1,235 @@
+import json
+import os
+import re
+from typing import Iterable, Iterator, Optional, TextIO
+
+from src.instrumentation import metrics
+from src.match_store import open_match_text, read_match_text
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# An object without nested objects or arrays, most events (wards, items, skills, levels) look like this
+_FLAT_OBJECT = re.compile(r'\{[^{}\[\]"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^{}\[\]"]*)*\}')
+_EVENT_TYPE = re.compile(r'"type"\s*:\s*"([A-Z_]+)"')
+# Stored files up to this size are decoded whole with json.loads and projected afterwards, which is faster than
+# the scanner; only bigger ones are streamed, keeping the peak memory near one chunk plus the projected result
+STREAM_ABOVE = 8 << 20
+
+
+class _Scanner:
+    # Walks a JSON document read in chunks, only the values asked for are decoded into Python objects
+    def __init__(self, file: TextIO, chunk_size: int = 1 << 16):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self, size: Optional[int] = None) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what was already consumed so the buffer stays around one chunk
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_more():
+                raise ValueError('Unexpected end of JSON document')
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r}, got {self.text[self.pos]!r}')
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        # Every failed attempt decodes the value from its start again, so the read size doubles each time:
+        # a value spanning many chunks costs a logarithmic number of attempts, not one per chunk
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                # A number at the very end of the buffer might continue in the next chunk
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read_more(size)
+            size *= 2
+
+    def members(self) -> Iterator[str]:
+        # Yields the keys of an object, the caller has to consume each value
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f'Expected \',\' or \'}}\', got {char!r}')
+
+    def elements(self) -> Iterator[None]:
+        # Yields once per array element, the caller has to consume each element
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'Expected \',\' or \']\', got {char!r}')
+
+    def event(self, event_types: Optional[frozenset]) -> Optional[dict]:
+        self.peek()
+        flat = _FLAT_OBJECT.match(self.text, self.pos)
+        if flat is None:
+            event = self.decode()
+            return event if event_types is None or event['type'] in event_types else None
+
+        # Flat events are matched by regex and only decoded when their type is requested
+        self.pos = flat.end()
+        if event_types is not None:
+            event_type = _EVENT_TYPE.search(self.text, flat.start(), flat.end())
+            if event_type is None or event_type.group(1) not in event_types:
+                return None
+        return json.loads(flat.group())
+
+
+def _read_frame(scanner: _Scanner, event_types: Optional[frozenset], participant_fields: Optional[frozenset],
+                include_participant_frames: bool) -> dict:
+    frame = {}
+    for key in scanner.members():
+        if key == 'events':
+            events = []
+            for _ in scanner.elements():
+                event = scanner.event(event_types)
+                if event is not None:
+                    events.append(event)
+            frame['events'] = events
+        elif key == 'participantFrames':
+            participant_frames = scanner.decode()
+            if not include_participant_frames:
+                continue
+            if participant_fields is not None:
+                participant_frames = {
+                    participant_id: {field: value for field, value in participant_frame.items()
+                                     if field in participant_fields}
+                    for participant_id, participant_frame in participant_frames.items()
+                }
+            frame[key] = participant_frames
+        else:
+            frame[key] = scanner.decode()
+    return frame
+
+
+def _project_frame(frame: dict, event_types: Optional[frozenset], participant_fields: Optional[frozenset],
+                   include_participant_frames: bool) -> dict:
+    # What _read_frame returns, from a frame that is already decoded
+    projected = {}
+    for key, value in frame.items():
+        if key == 'events':
+            projected[key] = [event for event in value if event_types is None or event.get('type') in event_types]
+        elif key == 'participantFrames':
+            if not include_participant_frames:
+                continue
+            if participant_fields is not None:
+                value = {
+                    participant_id: {field: field_value for field, field_value in participant_frame.items()
+                                     if field in participant_fields}
+                    for participant_id, participant_frame in value.items()
+                }
+            projected[key] = value
+        else:
+            projected[key] = value
+    return projected
+
+
+def _walk_decoded(timeline: dict, event_types: Optional[frozenset], participant_fields: Optional[frozenset],
+                  include_participant_frames: bool):
+    for key, value in timeline.items():
+        if key != 'info':
+            yield key, value
+            continue
+        for info_key, info_value in value.items():
+            if info_key == 'frames':
+                for frame in info_value:
+                    yield 'frame', _project_frame(frame, event_types, participant_fields, include_participant_frames)
+            else:
+                yield 'info', (info_key, info_value)
+
+
+def _walk_timeline(path: str, event_types: Optional[Iterable[str]], participant_fields: Optional[Iterable[str]],
+                   include_participant_frames: bool, chunk_size: int, stream_above: int):
+    # Yields (key, value) pairs for the top level and info fields and ('frame', frame) items in file order
+    event_types = frozenset(event_types) if event_types is not None else None
+    participant_fields = frozenset(participant_fields) if participant_fields is not None else None
+    # Counted like MatchStore.load counts its reads, by stored file size
+    size = os.path.getsize(path)
+    metrics.increment('match_files_parsed')
+    metrics.increment('match_bytes_parsed', size)
+    if size <= stream_above:
+        yield from _walk_decoded(json.loads(read_match_text(path)), event_types, participant_fields,
+                                 include_participant_frames)
+        return
+    with open_match_text(path) as file:
+        scanner = _Scanner(file, chunk_size)
+        for key in scanner.members():
+            if key != 'info':
+                yield key, scanner.decode()
+                continue
+            for info_key in scanner.members():
+                if info_key == 'frames':
+                    for _ in scanner.elements():
+                        yield 'frame', _read_frame(scanner, event_types, participant_fields,
+                                                   include_participant_frames)
+                else:
+                    yield 'info', (info_key, scanner.decode())
+
+
+def iter_timeline_frames(path: str, event_types: Optional[Iterable[str]] = None,
+                         participant_fields: Optional[Iterable[str]] = None,
+                         include_participant_frames: bool = True, chunk_size: int = 1 << 16,
+                         stream_above: int = STREAM_ABOVE) -> Iterator[dict]:
+    # None keeps every event type / participant frame field, an empty collection drops all of them
+    for kind, value in _walk_timeline(path, event_types, participant_fields, include_participant_frames,
+                                      chunk_size, stream_above):
+        if kind == 'frame':
+            yield value
+
+
+def read_timeline(path: str, event_types: Optional[Iterable[str]] = None,
+                  participant_fields: Optional[Iterable[str]] = None,
+                  include_participant_frames: bool = True, chunk_size: int = 1 << 16,
+                  stream_above: int = STREAM_ABOVE) -> dict:
+    # Same shape as json.load of the timeline, restricted to the requested events and fields
+    timeline = {'info': {'frames': []}}
+    for kind, value in _walk_timeline(path, event_types, participant_fields, include_participant_frames,
+                                      chunk_size, stream_above):
+        if kind == 'frame':
+            timeline['info']['frames'].append(value)
+        elif kind == 'info':
+            timeline['info'][value[0]] = value[1]
+        else:
+            timeline[kind] = value
+    return timeline
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import pickle
+from typing import Iterable, Optional
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from src.feature_store import FeatureStore
+from src.helpers import atomic_write_bytes
+from src.instrumentation import metrics
+from src.timeline_features import EXTRACTOR_VERSION, FEATURE_INDEX, MODEL_FEATURES
+
+MODEL_VERSION = 1
+
+LOW_CS_THRESHOLD = 7
+HIGH_DEATHS_THRESHOLD = 2
+
+
+def schema_hash() -> str:
+    schema = {
+        'features': MODEL_FEATURES,
+        'extractor_version': EXTRACTOR_VERSION,
+        'low_cs_threshold': LOW_CS_THRESHOLD,
+        'high_deaths_threshold': HIGH_DEATHS_THRESHOLD,
+    }
+    return hashlib.sha1(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def minute_features(match_features: np.ndarray) -> np.ndarray:
+    # (frames, participants, features) -> (frames - 1, participants, model features) per minute differences
+    columns = [FEATURE_INDEX[name] for name in MODEL_FEATURES]
+    return np.diff(match_features[:, :, columns], axis=0)
+
+
+def label_minutes(feature_matrix: np.ndarray) -> np.ndarray:
+    cs_diff = feature_matrix[..., MODEL_FEATURES.index('cs')]
+    deaths_diff = feature_matrix[..., MODEL_FEATURES.index('deaths')]
+    return np.where((cs_diff < LOW_CS_THRESHOLD) | (deaths_diff > HIGH_DEATHS_THRESHOLD), 'weak', 'strong')
+
+
+def corpus_training_data(feature_store: FeatureStore, match_ids: Iterable[str]) -> tuple[np.ndarray, np.ndarray]:
+    # Every minute of every participant of the given matches
+    matrices = [minute_features(feature_store.get_match(match_id)).reshape(-1, len(MODEL_FEATURES))
+                for match_id in match_ids]
+    if not matrices:
+        return np.empty((0, len(MODEL_FEATURES))), np.empty(0, dtype=str)
+    feature_matrix = np.concatenate(matrices)
+    return feature_matrix, label_minutes(feature_matrix)
+
+
+class WeakMinuteModel:
+    def __init__(self, n_estimators: int = 100, trees_per_update: int = 20, random_state: int = 42):
+        self.n_estimators = n_estimators
+        self.trees_per_update = trees_per_update
+        self.random_state = random_state
+        self.classifier: Optional[RandomForestClassifier] = None
+        self.trained_match_ids: set[str] = set()
+        # (accuracy, matches) on the matches added since the saved model, measured before they were fitted
+        self.held_out_accuracy: Optional[tuple[float, int]] = None
+
+    def train(self, feature_store: FeatureStore, match_ids: Optional[Iterable[str]] = None):
+        match_ids = list(match_ids) if match_ids is not None else feature_store.match_ids()
+        match_ids = [match_id for match_id in match_ids if match_id in feature_store]
+        feature_matrix, labels = corpus_training_data(feature_store, match_ids)
+        # sklearn would fail with a ValueError about a 0 sample array
+        if len(feature_matrix) == 0:
+            raise Exception(f'No matches to train the weak minute model on in the feature store '
+                            f'{feature_store.directory}, run sync first')
+        self.classifier = RandomForestClassifier(n_estimators=self.n_estimators, random_state=self.random_state,
+                                                 warm_start=True, n_jobs=-1)
+        with metrics.timer('model_fit'):
+            self.classifier.fit(feature_matrix, labels)
+        self.trained_match_ids = set(match_ids)
+
+    def update(self, feature_store: FeatureStore) -> int:
+        # Incremental retraining: the new matches are learned by a few additional trees, the old trees are kept
+        new_match_ids = [match_id for match_id in feature_store.match_ids() if match_id not in self.trained_match_ids]
+        if not new_match_ids:
+            return 0
+        if self.classifier is None:
+            self.train(feature_store)
+            return len(new_match_ids)
+
+        feature_matrix, labels = corpus_training_data(feature_store, new_match_ids)
+        if set(labels) != set(self.classifier.classes_):
+            # Added trees have to see every class, fall back to training on the whole corpus
+            self.train(feature_store)
+            return len(new_match_ids)
+        self.classifier.n_estimators += self.trees_per_update
+        with metrics.timer('model_fit'):
+            self.classifier.fit(feature_matrix, labels)
+        self.trained_match_ids.update(new_match_ids)
+        return len(new_match_ids)
+
+    def predict(self, feature_matrix: np.ndarray) -> np.ndarray:
+        if self.classifier is None:
+            raise Exception("The weak minute model has to be trained or loaded before predicting")
+        with metrics.timer('model_predict'):
+            return self.classifier.predict(feature_matrix)
+
+    def evaluate(self, feature_store: FeatureStore, match_ids: Iterable[str]) -> float:
+        # Share of the minutes of the given matches whose label is predicted, only meaningful for matches the
+        # model was not fitted on
+        feature_matrix, labels = corpus_training_data(feature_store, match_ids)
+        return float(np.mean(self.predict(feature_matrix) == labels))
+
+    def predict_match(self, match_features: np.ndarray, participant_id: int) -> np.ndarray:
+        return self.predict(minute_features(match_features)[:, participant_id - 1])
+
+    def save(self, path: str):
+        atomic_write_bytes(path, pickle.dumps({
+            'version': MODEL_VERSION,
+            'schema_hash': schema_hash(),
+            'n_estimators': self.n_estimators,
+            'trees_per_update': self.trees_per_update,
+            'random_state': self.random_state,
+            'classifier': self.classifier,
+            'trained_match_ids': sorted(self.trained_match_ids),
+        }))
+
+    @classmethod
+    def load(cls, path: str) -> 'WeakMinuteModel':
+        with open(path, 'rb') as file:
+            data = pickle.load(file)
+        if data['version'] != MODEL_VERSION or data['schema_hash'] != schema_hash():
+            raise Exception(f'The model in {path} was built for another version or feature schema, retrain it')
+        model = cls(data['n_estimators'], data['trees_per_update'], data['random_state'])
+        model.classifier = data['classifier']
+        model.trained_match_ids = set(data['trained_match_ids'])
+        return model
+
+    @classmethod
+    def load_or_train(cls, path: str, feature_store: FeatureStore) -> 'WeakMinuteModel':
+        # Loads the saved model and folds in the matches added since, or trains a new one
+        model = None
+        if os.path.exists(path):
+            try:
+                model = cls.load(path)
+            except Exception as e:
+                print(f'Retraining the weak minute model: {e}')
+        if model is None:
+            model = cls()
+            model.train(feature_store)
+            model.save(path)
+        else:
+            new_match_ids = [match_id for match_id in feature_store.match_ids()
+                             if match_id not in model.trained_match_ids]
+            if new_match_ids:
+                model.held_out_accuracy = (model.evaluate(feature_store, new_match_ids), len(new_match_ids))
+            if model.update(feature_store):
+                model.save(path)
+        return model
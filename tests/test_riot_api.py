@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.riot_api import RiotApiHelper, retry_after_seconds
+
+MATCH_ID = 'EUN1_1'
+NOW = datetime(2023, 9, 8, 12, 0, 0, tzinfo=timezone.utc)
+
+
+class StubRiotApi(BaseHTTPRequestHandler):
+    # Answers every request with the next queued (status, headers, body) of the server, then with 200 and {}
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            status, headers, body = self.server.responses.pop(0) if self.server.responses else (200, {}, {})
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubRiotApi)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def api(server):
+    api = RiotApiHelper('test-key', max_retries=2, backoff_factor=0.01, timeout=5)
+    api.match_url = f'http://127.0.0.1:{server.server_address[1]}/lol/match/v5/matches/%s'
+    return api
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds('2') == 2.0
+    assert retry_after_seconds('0.5') == 0.5
+    assert retry_after_seconds('-3') == 0.0
+    assert retry_after_seconds('Fri, 08 Sep 2023 12:00:05 GMT', now=NOW) == 5.0
+    # A date in the past means the request can be retried right away
+    assert retry_after_seconds('Fri, 08 Sep 2023 11:59:00 GMT', now=NOW) == 0.0
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds('') is None
+    assert retry_after_seconds('soon') is None
+
+
+def test_429_with_retry_after_seconds_blocks_the_app_bucket(server, api):
+    server.responses = [
+        (429, {'Retry-After': '0.2', 'X-Rate-Limit-Type': 'application'}, {}),
+        (200, {}, {'metadata': {'matchId': MATCH_ID}}),
+    ]
+    started_at = time.monotonic()
+    assert api.get_match_by_id(MATCH_ID) == {'metadata': {'matchId': MATCH_ID}}
+    assert len(server.requests) == 2
+    assert time.monotonic() - started_at >= 0.2
+    assert api.app_rate_limiter.blocked_until >= started_at + 0.2
+    assert api.method_rate_limiters[api.match_url].blocked_until == 0.0
+
+
+def test_429_with_retry_after_date_blocks_the_method_bucket(server, api):
+    # An HTTP date used to fail float(), any date in the past retries right away
+    server.responses = [
+        (429, {'Retry-After': 'Fri, 08 Sep 2023 11:59:00 GMT', 'X-Rate-Limit-Type': 'method'}, {}),
+        (200, {}, {'metadata': {'matchId': MATCH_ID}}),
+    ]
+    started_at = time.monotonic()
+    assert api.get_match_by_id(MATCH_ID) == {'metadata': {'matchId': MATCH_ID}}
+    assert len(server.requests) == 2
+    assert api.method_rate_limiters[api.match_url].blocked_until >= started_at
+    assert api.app_rate_limiter.blocked_until == 0.0
+
+
+def test_unreadable_retry_after_falls_back_to_backoff(server, api):
+    server.responses = [
+        (429, {'Retry-After': 'soon', 'X-Rate-Limit-Type': 'application'}, {}),
+        (503, {}, {}),
+        (200, {}, {'ok': True}),
+    ]
+    assert api.get_match_by_id(MATCH_ID) == {'ok': True}
+    assert len(server.requests) == 3
+
+
+def test_gives_up_after_max_retries(server, api):
+    server.responses = [(429, {'Retry-After': '0', 'X-Rate-Limit-Type': 'application'}, {})] * 3
+    assert api.get_match_by_id(MATCH_ID) is None
+    assert len(server.requests) == 3
+
+
+def test_rate_limit_headers_update_app_and_method_buckets(server, api):
+    server.responses = [(200, {
+        'X-App-Rate-Limit': '20:1,100:120',
+        'X-App-Rate-Limit-Count': '5:1,40:120',
+        'X-Method-Rate-Limit': '2000:10',
+        'X-Method-Rate-Limit-Count': '1999:10',
+    }, {'ok': True})]
+    assert api.get_match_by_id(MATCH_ID) == {'ok': True}
+
+    app_buckets = api.app_rate_limiter.buckets
+    assert {seconds: bucket.capacity for seconds, bucket in app_buckets.items()} == {1: 20, 120: 100}
+    # The server counts are the source of truth, the local tokens never exceed what is left
+    assert app_buckets[1].tokens <= 15
+    assert app_buckets[120].tokens <= 60
+
+    method_buckets = api.method_rate_limiters[api.match_url].buckets
+    assert {seconds: bucket.capacity for seconds, bucket in method_buckets.items()} == {10: 2000}
+    assert method_buckets[10].tokens <= 1
@@ -0,0 +1,77 @@
+import glob
+import json
+import os
+
+import pytest
+
+from src.timeline_reader import iter_timeline_frames, read_timeline
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alienteavend')
+TIMELINES = sorted(glob.glob(os.path.join(FIXTURES_DIR, 'match_*_timeline.json')))
+# Small chunks split keys, strings, numbers and flat events across chunk boundaries, stream_above=0 makes even
+# these small files go through the scanner, the defaults decode them whole and project afterwards
+READ_OPTIONS = [{'chunk_size': 7, 'stream_above': 0}, {'chunk_size': 64, 'stream_above': 0},
+                {'chunk_size': 1 << 16, 'stream_above': 0}, {}]
+OPTION_IDS = ['stream-7', 'stream-64', 'stream-65536', 'decoded']
+
+
+def load(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def project(timeline: dict, event_types, participant_fields) -> dict:
+    # What read_timeline should return for the projection, built from the fully decoded timeline
+    frames = []
+    for frame in timeline['info']['frames']:
+        frame = dict(frame)
+        frame['events'] = [event for event in frame['events'] if event['type'] in event_types]
+        frame['participantFrames'] = {
+            participant_id: {field: value for field, value in participant_frame.items() if field in participant_fields}
+            for participant_id, participant_frame in frame['participantFrames'].items()
+        }
+        frames.append(frame)
+    return {**timeline, 'info': {**timeline['info'], 'frames': frames}}
+
+
+def test_fixtures_are_bundled():
+    assert TIMELINES
+
+
+@pytest.mark.parametrize('options', READ_OPTIONS, ids=OPTION_IDS)
+@pytest.mark.parametrize('path', TIMELINES, ids=os.path.basename)
+def test_full_read_matches_json_load(path, options):
+    assert read_timeline(path, **options) == load(path)
+
+
+@pytest.mark.parametrize('options', READ_OPTIONS, ids=OPTION_IDS)
+@pytest.mark.parametrize('path', TIMELINES, ids=os.path.basename)
+def test_projected_read_matches_json_load(path, options):
+    event_types = ('CHAMPION_KILL', 'WARD_PLACED', 'ITEM_PURCHASED')
+    participant_fields = ('minionsKilled', 'totalGold', 'position')
+    expected = project(load(path), event_types, participant_fields)
+    assert read_timeline(path, event_types, participant_fields, **options) == expected
+
+
+@pytest.mark.parametrize('options', READ_OPTIONS[1:], ids=OPTION_IDS[1:])
+@pytest.mark.parametrize('path', TIMELINES, ids=os.path.basename)
+def test_empty_projection_drops_everything(path, options):
+    expected = project(load(path), (), ())
+    assert read_timeline(path, (), (), **options) == expected
+
+
+@pytest.mark.parametrize('options', READ_OPTIONS[1:], ids=OPTION_IDS[1:])
+@pytest.mark.parametrize('path', TIMELINES, ids=os.path.basename)
+def test_without_participant_frames(path, options):
+    timeline = read_timeline(path, ('CHAMPION_KILL',), include_participant_frames=False, **options)
+    expected = project(load(path), ('CHAMPION_KILL',), ())
+    for frame in expected['info']['frames']:
+        del frame['participantFrames']
+    assert timeline == expected
+
+
+@pytest.mark.parametrize('options', READ_OPTIONS[1:], ids=OPTION_IDS[1:])
+@pytest.mark.parametrize('path', TIMELINES, ids=os.path.basename)
+def test_iter_frames_matches_read(path, options):
+    frames = list(iter_timeline_frames(path, ('CHAMPION_KILL',), ('minionsKilled',), **options))
+    assert frames == read_timeline(path, ('CHAMPION_KILL',), ('minionsKilled',))['info']['frames']